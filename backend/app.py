@@ -1,32 +1,41 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, request, jsonify, send_file, stream_with_context, g
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from flask_cors import CORS
 import os
+import sys
+import click
 import jwt
 import base64
+import json
 import hashlib
+import hmac
+import csv
+import gzip
+import io
 import time
-from werkzeug.security import generate_password_hash, check_password_hash
+from password_policy import password_policy, UNUSABLE_PASSWORD
 from functools import wraps
 import datetime
+import random
 import uuid
 from dotenv import load_dotenv
+import logging
+from logging_setup import configure_logging, RequestLogSampler
+
+# Load environment variables
+load_dotenv()
+
+# JSON-line logs, written by a background thread (LOG_LEVEL, LOG_FORMAT)
+configure_logging()
 
 # PDF Generation Imports
 try:
-    from reportlab.pdfgen import canvas
-    from reportlab.lib.pagesizes import A4, landscape
-    from reportlab.lib import colors
-    from reportlab.pdfbase import pdfmetrics
-    from reportlab.pdfbase.ttfonts import TTFont
+    from certificate_renderer import certificate_renderer
     PDF_ENABLED = True
 except ImportError:
     PDF_ENABLED = False
-    print("Warning: reportlab not installed. PDF generation disabled.")
-
-# Load environment variables
-load_dotenv()
+    logging.getLogger(__name__).warning("reportlab not installed. PDF generation disabled.")
 
 app = Flask(__name__, static_folder='static')
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///tree_donation.db')
@@ -41,159 +50,211 @@ try:
     from ioka_service import ioka_service
     IOKA_ENABLED = True
 except Exception as e:
-    print(f"Warning: Ioka service not available: {e}")
+    app.logger.warning(f"Ioka service not available: {e}")
     IOKA_ENABLED = False
 
-# Add request logging
-import logging
-logging.basicConfig(level=logging.DEBUG)
-app.logger.setLevel(logging.DEBUG)
+# One sampled log line per request with its route, status and duration (never the body),
+# and the same figures as Prometheus metrics for /metrics
+from sqlalchemy.engine import Engine
+from metrics import (query_stats, metrics_exporter, REQUEST_LATENCY, REQUEST_DB_QUERIES, REQUEST_DB_SECONDS,
+                     CERTIFICATE_RENDER_SECONDS, CERTIFICATE_JOBS)
+query_stats.install(Engine)
+request_logger = logging.getLogger('app.request')
+request_log_sampler = RequestLogSampler.from_env()
+
+# QUERY_PROFILE=all (or a comma-separated list of routes) records every statement of those
+# requests, returns X-Query-Count and logs statement shapes repeated QUERY_PROFILE_REPEAT times
+from query_recorder import QueryRecorder
+QUERY_PROFILE = {route.strip() for route in os.environ.get('QUERY_PROFILE', '').split(',') if route.strip()}
+QUERY_PROFILE_REPEAT = int(os.environ.get('QUERY_PROFILE_REPEAT', 5))
+query_logger = logging.getLogger('app.queries')
 
 @app.before_request
-def log_request_info():
-    app.logger.debug(f'Request: {request.method} {request.path}')
-    if request.data:
-        app.logger.debug(f'Body: {request.get_data(as_text=True)[:200]}')
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    query_stats.start()
+    route = request.url_rule.rule if request.url_rule else None
+    if 'all' in QUERY_PROFILE or route in QUERY_PROFILE:
+        g.query_recorder = QueryRecorder().start()
+
+@app.after_request
+def log_request(response):
+    started = g.pop('request_started', None)
+    if started is None:
+        return response
+    duration = time.perf_counter() - started
+    queries, query_seconds = query_stats.stop()
+    route = request.url_rule.rule if request.url_rule else None
+    REQUEST_LATENCY.labels(request.method, route or '<unmatched>', response.status_code).observe(duration)
+    REQUEST_DB_QUERIES.labels(route or '<unmatched>').observe(queries)
+    REQUEST_DB_SECONDS.labels(route or '<unmatched>').observe(query_seconds)
+
+    recorder = g.pop('query_recorder', None)
+    if recorder is not None:
+        recorder.stop()
+        response.headers['X-Query-Count'] = str(recorder.count)
+        repeated = recorder.repeated(QUERY_PROFILE_REPEAT)
+        if repeated:
+            query_logger.warning(f'{request.method} {route} repeated {len(repeated)} statement shapes', extra={
+                'route': route,
+                'queries': recorder.count,
+                'repeated': [{'count': count, 'statement': shape} for shape, count in repeated]
+            })
+
+    duration_ms = duration * 1000
+    if request_log_sampler.should_log(route, response.status_code, duration_ms):
+        request_logger.info(f'{request.method} {request.path} {response.status_code}', extra={
+            'method': request.method,
+            'path': request.path,
+            'route': route,
+            'status': response.status_code,
+            'duration_ms': round(duration_ms, 2),
+            'db_queries': queries,
+            'db_ms': round(query_seconds * 1000, 2),
+            'bytes': response.content_length,
+            'sample_rate': request_log_sampler.rate_for(route)
+        })
+    return response
 
 db = SQLAlchemy(app)
 migrate = Migrate(app, db)
 
-# Register fonts at startup
-with app.app_context():
-    if PDF_ENABLED:
-        try:
-            # We call this to ensure fonts are registered on startup
-            # The function itself handles path detection
-            from reportlab.pdfbase import pdfmetrics
-            from reportlab.pdfbase.ttfonts import TTFont
-            
-            def register_fonts_startup():
-                font_paths = [
-                    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
-                    "/usr/share/fonts/TTF/DejaVuSans.ttf",
-                    "C:\\Windows\\Fonts\\arial.ttf",
-                    os.path.join(app.root_path, 'static', 'fonts', 'DejaVuSans.ttf')
-                ]
-                for path in font_paths:
-                    if os.path.exists(path):
-                        bold_path = path.replace('.ttf', '-Bold.ttf')
-                        if not os.path.exists(bold_path): bold_path = path
-                        pdfmetrics.registerFont(TTFont('DejaVu', path))
-                        pdfmetrics.registerFont(TTFont('DejaVu-Bold', bold_path))
-                        print(f"Registered Cyrillic fonts from {path}")
-                        return True
+# Certificate PDFs are rendered off the request path by these threads
+from background_worker import BackgroundWorker
+certificate_worker = BackgroundWorker(
+    'certificate-renderer', app, lambda: process_next_certificate_job(),
+    threads=int(os.environ.get('CERTIFICATE_WORKERS', 1))
+)
+
+# Awaiting-payment donations are settled against Ioka by this thread, not by status polls
+payment_reconciler = BackgroundWorker(
+    'payment-reconciler', app, lambda: reconcile_awaiting_payments() >= PAYMENT_RECONCILE_BATCH,
+    threads=int(os.environ.get('PAYMENT_RECONCILER_WORKERS', 1)),
+    poll_interval=float(os.environ.get('PAYMENT_RECONCILE_POLL', 5))
+)
+
+# Webhook deliveries are acknowledged once stored; this thread applies them to donations
+webhook_worker = BackgroundWorker(
+    'webhook-inbox', app, lambda: process_next_webhook_events(),
+    threads=int(os.environ.get('WEBHOOK_WORKERS', 1))
+)
+
+@app.before_request
+def start_background_workers():
+    if not app.testing:
+        certificate_worker.start()
+        form_writer_worker.start()
+        if IOKA_ENABLED:
+            payment_reconciler.start()
+            webhook_worker.start()
+
+# Wakes /api/donations/<id>/events waiters, across workers via PostgreSQL LISTEN/NOTIFY
+from donation_events import DonationNotifier
+
+def donation_listen_connection():
+    """Dedicated connection for LISTEN, or None when the database cannot notify"""
+    with app.app_context():
+        if db.engine.dialect.name != 'postgresql':
+            return None
+        import psycopg2
+        return psycopg2.connect(db.engine.url.set(drivername='postgresql').render_as_string(hide_password=False))
+
+def donation_notify(channel, donation_id):
+    if db.engine.dialect.name == 'postgresql':
+        with db.engine.connect() as connection:
+            connection.execute(db.text('SELECT pg_notify(:channel, :payload)'),
+                               {'channel': channel, 'payload': donation_id})
+            connection.commit()
+
+donation_notifier = DonationNotifier(
+    poll_interval=float(os.environ.get('DONATION_EVENTS_POLL', 2)),
+    connect=donation_listen_connection,
+    execute_notify=donation_notify
+)
+
+# Snapshots of authenticated users, so protected routes skip the user lookup
+from principal_cache import PrincipalCache
+principal_cache = PrincipalCache(
+    max_size=int(os.environ.get('PRINCIPAL_CACHE_SIZE', 1024)),
+    ttl=float(os.environ.get('PRINCIPAL_CACHE_TTL', 30))
+)
+
+# Contact and partnership forms are stored by one writer thread, many rows per commit
+from batch_writer import BatchWriter
+FORM_WRITE_TIMEOUT = 10
+
+def write_form_rows(rows):
+    """Insert (model, values) rows, one executemany per model, in a single transaction"""
+    by_model = {}
+    for model, values in rows:
+        by_model.setdefault(model, []).append(values)
+    for model, values in by_model.items():
+        db.session.execute(db.insert(model), values)
+    db.session.commit()
+
+form_writer = BatchWriter(write_form_rows, max_batch=int(os.environ.get('FORM_WRITER_BATCH', 100)),
+                          on_error=lambda: db.session.rollback())
+form_writer_worker = BackgroundWorker('form-writer', app, form_writer.drain, poll_interval=5.0)
+
+def save_form_row(model, values):
+    """
+    Store one form row through the batch writer and wait until it is committed
+
+    Returns False when the writer did not get to the row in time. The row is
+    then taken back out of the queue, so nothing is stored and the client can
+    safely send the form again.
+    """
+    pending = form_writer.submit((model, values))
+    if form_writer_worker.running:
+        form_writer_worker.wake()
+        if not pending.wait(FORM_WRITE_TIMEOUT):
+            if form_writer.withdraw(pending):
+                app.logger.warning(f"Form writer did not store a {model.__tablename__} row in time")
                 return False
-            
-            register_fonts_startup()
-        except Exception as e:
-            print(f"Startup font registration warning: {e}")
+            # Already part of the batch being written: wait for its commit
+            pending.wait()
+    else:
+        # No writer thread in this process (tests, CLI): write in line
+        while form_writer.drain():
+            pass
+        pending.wait(0)
+    return True
 
-def register_fonts():
-    """Register fonts that support Cyrillic characters"""
-    try:
-        # Option 1: Use DejaVu fonts (commonly available in Docker container after our recent Dockerfile update)
-        # We'll look for DejaVuSans which is provided by fonts-dejavu-core
-        font_paths = [
-            "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
-            "/usr/share/fonts/TTF/DejaVuSans.ttf",
-            "C:\\Windows\\Fonts\\arial.ttf",  # Local Windows testing
-            os.path.join(app.root_path, 'static', 'fonts', 'DejaVuSans.ttf')
-        ]
-        
-        for path in font_paths:
-            if os.path.exists(path):
-                bold_path = path.replace('.ttf', '-Bold.ttf')
-                if not os.path.exists(bold_path):
-                    bold_path = path # fallback to regular if bold not found
-                
-                pdfmetrics.registerFont(TTFont('DejaVu', path))
-                pdfmetrics.registerFont(TTFont('DejaVu-Bold', bold_path))
-                return 'DejaVu', 'DejaVu-Bold'
-        
-        # Fallback 2: try system fonts (Liberation)
-        liberation_path = '/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf'
-        liberation_bold = '/usr/share/fonts/truetype/liberation/LiberationSans-Bold.ttf'
-        if os.path.exists(liberation_path):
-            pdfmetrics.registerFont(TTFont('Arial', liberation_path))
-            pdfmetrics.registerFont(TTFont('Arial-Bold', liberation_bold if os.path.exists(liberation_bold) else liberation_path))
-            return 'Arial', 'Arial-Bold'
-
-        print("Warning: No Cyrillic fonts available, text may not display correctly")
-        return 'Helvetica', 'Helvetica-Bold'
-    except Exception as e:
-        print(f"Error registering fonts: {e}")
-        return 'Helvetica', 'Helvetica-Bold'
+FORM_BUSY_MESSAGE = 'Сервис временно перегружен, попробуйте отправить форму еще раз'
+
+# Register the certificate fonts once per process
+if PDF_ENABLED:
+    certificate_renderer.template
+
+# Rendered PDFs, sharded by content hash. Files of the old flat layout
+# (<donation_id>.pdf in the same directory) are served until `flask migrate-certificates` moves them
+from certificate_store import CertificateStore
+CERTIFICATES_DIR = os.environ.get('CERTIFICATES_DIR', os.path.join(app.root_path, 'static', 'certificates'))
+certificate_store = CertificateStore(CERTIFICATES_DIR)
 
 def generate_certificate_pdf(donation):
-    """Generate a physical PDF file for the certificate"""
+    """Render the certificate PDF into the certificate store; returns its StoredFile, or None"""
     if not PDF_ENABLED:
         return None
         
     # Extra safety check: only generate if paid
     if donation.status != 'completed':
-        print(f"Skipping PDF generation: donation {donation.id} status is {donation.status}")
+        app.logger.info(f"Skipping PDF generation: donation {donation.id} status is {donation.status}")
         return None
         
     try:
-        # Register fonts at the start
-        font_name, font_bold = register_fonts()
-        
-        # Create directory if it doesn't exist
-        certificates_dir = os.path.join(app.root_path, 'static', 'certificates')
-        if not os.path.exists(certificates_dir):
-            os.makedirs(certificates_dir)
-            
-        file_path = os.path.join(certificates_dir, f"{donation.id}.pdf")
-        
-        # Create canvas
-        c = canvas.Canvas(file_path, pagesize=landscape(A4))
-        width, height = landscape(A4)
-        
-        # Background color
-        c.setFillColor(colors.HexColor('#F9FDF9'))
-        c.rect(0, 0, width, height, fill=1)
-        
-        # Border
-        c.setStrokeColor(colors.HexColor('#10B981'))
-        c.setLineWidth(10)
-        c.rect(20, 20, width-40, height-40)
-        
-        # Title
-        c.setFillColor(colors.HexColor('#064E3B'))
-        c.setFont(font_bold, 40)
-        c.drawCentredString(width/2, height - 100, "СЕРТИФИКАТ ПОСАДКИ")
-        
-        # Message
-        c.setFont(font_name, 20)
-        c.drawCentredString(width/2, height - 160, "Настоящим подтверждается, что")
-        
-        # Donor Name
-        donor_name = donation.donor_info.get('full_name', 'Анонимный благотворитель')
-        c.setFont(font_bold, 30)
-        c.drawCentredString(width/2, height - 220, donor_name)
-        
-        # Contribution
-        c.setFont(font_name, 20)
-        c.drawCentredString(width/2, height - 280, f"внес(ла) вклад в посадку {donation.tree_count} деревьев")
-        
-        # Location
-        location = Location.query.get(donation.location_id)
-        location_name = location.name if location else 'Mukhatay Ormany'
-        c.drawCentredString(width/2, height - 320, f"в локации {location_name}")
-        
-        # Date
-        c.setFont(font_name, 14)
-        date_str = donation.created_at.strftime('%d.%m.%Y')
-        c.drawCentredString(width/2, 100, f"Дата: {date_str}")
-        
-        # ID
-        c.setFont(font_name, 10)
-        c.drawCentredString(width/2, 60, f"ID Сертификата: {donation.id}")
-        
-        c.save()
-        return f"/certificates/{donation.id}.pdf"
+        location = db.session.get(Location, donation.location_id) if donation.location_id else None
+        with CERTIFICATE_RENDER_SECONDS.time():
+            return certificate_store.write(lambda file_path: certificate_renderer.render(
+                file_path,
+                donor_name=donation.donor_info.get('full_name', 'Анонимный благотворитель'),
+                tree_count=donation.tree_count,
+                location_name=location.name if location else 'Mukhatay Ormany',
+                date_str=donation.created_at.strftime('%d.%m.%Y'),
+                certificate_id=donation.id
+            ))
     except Exception as e:
-        print(f"Error generating PDF: {e}")
+        app.logger.exception(f"Error generating PDF for donation {donation.id}: {e}")
         return None
 
 # Models
@@ -208,6 +269,11 @@ class User(db.Model):
     status = db.Column(db.String, default='active')  # active, guest
     created_at = db.Column(db.DateTime, server_default=db.func.now())
     last_login = db.Column(db.DateTime)
+    guest_donations_linked_at = db.Column(db.DateTime)  # when donations made with this email were attached
+
+# Case-insensitive email lookups; text_pattern_ops also serves prefix searches on PostgreSQL
+db.Index('ix_user_email_lower', db.func.lower(User.email).label('email_lower'),
+         postgresql_ops={'email_lower': 'text_pattern_ops'})
 
 class Location(db.Model):
     id = db.Column(db.String, primary_key=True)
@@ -229,23 +295,73 @@ class Package(db.Model):
     popular = db.Column(db.Boolean)
 
 class Donation(db.Model):
+    __table_args__ = (
+        # (created_at, id) matches the keyset order of every donation list
+        db.Index('ix_donation_created_at', 'created_at', 'id'),
+        db.Index('ix_donation_user_id_created_at', 'user_id', 'created_at', 'id'),
+        db.Index('ix_donation_status_created_at', 'status', 'created_at', 'id'),
+        db.Index('ix_donation_location_id_created_at', 'location_id', 'created_at', 'id'),
+        db.Index('ix_donation_email_user_id', 'email', 'user_id'),
+        db.Index('ix_donation_status_payment_checked_at', 'status', 'payment_checked_at'),
+    )
     id = db.Column(db.String, primary_key=True)
-    location_id = db.Column(db.String, db.ForeignKey('location.id'))
+    # active_history keeps the previous value of the fields the donation
+    # summary rollup is keyed on, even when they were not loaded before a change
+    location_id = db.column_property(db.Column(db.String, db.ForeignKey('location.id')), active_history=True)
     package_id = db.Column(db.String, db.ForeignKey('package.id'))
     user_id = db.Column(db.String, db.ForeignKey('user.id'))
     email = db.Column(db.String)  # For guest donations linking
-    tree_count = db.Column(db.Integer)
-    amount = db.Column(db.Integer)
-    status = db.Column(db.String)
+    tree_count = db.column_property(db.Column(db.Integer), active_history=True)
+    amount = db.column_property(db.Column(db.Integer), active_history=True)
+    status = db.column_property(db.Column(db.String), active_history=True)
     created_at = db.Column(db.DateTime, server_default=db.func.now())
     donor_info = db.Column(db.JSON)
-    payment_order_id = db.Column(db.String)  # Ioka payment order ID
+    payment_order_id = db.Column(db.String, index=True)  # Ioka payment order ID
+    payment_checked_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)  # last sync with the Ioka order status
+
+db.Index('ix_donation_email_lower', db.func.lower(Donation.email).label('email_lower'),
+         postgresql_ops={'email_lower': 'text_pattern_ops'})
 
 class Certificate(db.Model):
     id = db.Column(db.String, primary_key=True)
-    donation_id = db.Column(db.String, db.ForeignKey('donation.id'))
+    donation_id = db.Column(db.String, db.ForeignKey('donation.id'), index=True, unique=True)
     pdf_url = db.Column(db.String)
     created_date = db.Column(db.DateTime, server_default=db.func.now())
+    file_sha256 = db.Column(db.String)  # content hash, which locates the PDF in certificate_store
+    file_size = db.Column(db.Integer)
+
+class CertificateRenderJob(db.Model):
+    """Persistent queue entry for rendering the certificate PDF of one donation"""
+    __tablename__ = 'certificate_render_job'
+    __table_args__ = (
+        db.Index('ix_certificate_render_job_status_next_attempt_at', 'status', 'next_attempt_at'),
+    )
+    id = db.Column(db.String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    donation_id = db.Column(db.String, db.ForeignKey('donation.id'), nullable=False, unique=True)  # one job per donation
+    status = db.Column(db.String, nullable=False, default='queued')  # queued, rendering, done, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+    locked_until = db.Column(db.DateTime)  # lease of the worker rendering it
+    last_error = db.Column(db.String)
+    created_at = db.Column(db.DateTime, server_default=db.func.now())
+    updated_at = db.Column(db.DateTime, server_default=db.func.now(), onupdate=db.func.now())
+
+class WebhookEvent(db.Model):
+    """Verified Ioka webhook delivery, stored on receipt and applied later by the webhook worker"""
+    __tablename__ = 'webhook_event'
+    __table_args__ = (
+        db.Index('ix_webhook_event_status_donation_id', 'status', 'donation_id'),
+    )
+    id = db.Column(db.Integer, primary_key=True)  # arrival order, in which events of a donation are applied
+    event_key = db.Column(db.String, nullable=False, unique=True)  # redeliveries of one event share it
+    donation_id = db.Column(db.String, nullable=False)
+    event_type = db.Column(db.String, nullable=False)
+    payload = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String, nullable=False, default='pending')  # pending, applied, skipped, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.String)
+    received_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+    processed_at = db.Column(db.DateTime)
 
 class News(db.Model):
     id = db.Column(db.String, primary_key=True)
@@ -258,6 +374,553 @@ class News(db.Model):
     published = db.Column(db.Boolean, default=True)
     category = db.Column(db.String, default='general')
 
+class ContactSubmission(db.Model):
+    __tablename__ = 'contact_submission'
+    __table_args__ = (
+        db.Index('ix_contact_submission_created_at', 'created_at', 'id'),
+    )
+    id = db.Column(db.String, primary_key=True)
+    name = db.Column(db.String, nullable=False)
+    email = db.Column(db.String, nullable=False)
+    phone = db.Column(db.String)
+    message = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+
+class PartnershipInquiry(db.Model):
+    __tablename__ = 'partnership_inquiry'
+    __table_args__ = (
+        db.Index('ix_partnership_inquiry_created_at', 'created_at', 'id'),
+        db.Index('ix_partnership_inquiry_status_created_at', 'status', 'created_at', 'id'),
+    )
+    id = db.Column(db.String, primary_key=True)
+    company_name = db.Column(db.String, nullable=False)
+    contact_person = db.Column(db.String, nullable=False)
+    email = db.Column(db.String, nullable=False)
+    phone = db.Column(db.String)
+    partnership_type = db.Column(db.String)
+    message = db.Column(db.Text)
+    status = db.Column(db.String, nullable=False, default='pending')
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+
+class DonationSummary(db.Model):
+    """Donation totals per location and status, kept in step with the donation table"""
+    __tablename__ = 'donation_summary'
+    location_id = db.Column(db.String, primary_key=True)  # '' for donations without a location
+    status = db.Column(db.String, primary_key=True)
+    donations = db.Column(db.Integer, nullable=False, default=0)
+    trees = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Integer, nullable=False, default=0)
+
+class CatalogVersion(db.Model):
+    """Change counter of one public catalog (locations, packages, news), used for HTTP validators"""
+    __tablename__ = 'catalog_version'
+    name = db.Column(db.String, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False)
+
+# Donation summary rollup
+SUMMARY_FIELDS = ('location_id', 'status', 'tree_count', 'amount')
+
+def donation_summary_values(donation, committed=False):
+    """Rollup-relevant fields of a donation, either as pending or as last flushed"""
+    state = db.inspect(donation)
+    values = []
+    for field in SUMMARY_FIELDS:
+        history = state.attrs[field].history
+        if committed and history.deleted:
+            values.append(history.deleted[0])
+        else:
+            values.append(getattr(donation, field))
+    return tuple(values)
+
+def upsert_donation_summary(connection, location_id, status, donations, trees, revenue):
+    """Atomically add deltas to one rollup row, creating it if needed"""
+    table = DonationSummary.__table__
+    key = {'location_id': location_id, 'status': status}
+    increments = {
+        'donations': table.c.donations + donations,
+        'trees': table.c.trees + trees,
+        'revenue': table.c.revenue + revenue
+    }
+    dialect = connection.dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        statement = insert(table).values(donations=donations, trees=trees, revenue=revenue, **key)
+        connection.execute(statement.on_conflict_do_update(index_elements=list(key), set_=increments))
+        return
+    result = connection.execute(table.update().where(
+        table.c.location_id == location_id, table.c.status == status
+    ).values(**increments))
+    if result.rowcount == 0:
+        connection.execute(table.insert().values(donations=donations, trees=trees, revenue=revenue, **key))
+
+@db.event.listens_for(db.session, 'before_flush')
+def update_donation_summary(session, flush_context, instances):
+    """Fold donation inserts, changes and deletes into the rollup inside the same transaction"""
+    deltas = {}
+
+    def add(values, sign):
+        location_id, status, tree_count, amount = values
+        delta = deltas.setdefault((location_id or '', status or ''), [0, 0, 0])
+        delta[0] += sign
+        delta[1] += sign * (tree_count or 0)
+        delta[2] += sign * (amount or 0)
+
+    for obj in session.new:
+        if isinstance(obj, Donation):
+            add(donation_summary_values(obj), 1)
+    for obj in session.dirty:
+        if isinstance(obj, Donation) and session.is_modified(obj):
+            before, after = donation_summary_values(obj, committed=True), donation_summary_values(obj)
+            if before != after:
+                add(before, -1)
+                add(after, 1)
+    for obj in session.deleted:
+        if isinstance(obj, Donation):
+            add(donation_summary_values(obj, committed=True), -1)
+
+    deltas = {key: delta for key, delta in deltas.items() if any(delta)}
+    if deltas:
+        connection = session.connection()
+        for (location_id, status), (donations, trees, revenue) in sorted(deltas.items()):
+            upsert_donation_summary(connection, location_id, status, donations, trees, revenue)
+        planted = {location_id: trees for (location_id, status), (_, trees, _) in deltas.items()
+                   if status == 'completed' and location_id and trees}
+        if planted:
+            add_planted_trees(connection, planted)
+
+def add_planted_trees(connection, planted):
+    """Add completed trees to the location counters with UPDATE ... SET planted_trees = planted_trees + n
+
+    The statement bypasses the session, so the catalog version is bumped
+    here rather than by the flush listener.
+    """
+    table = Location.__table__
+    for location_id, trees in sorted(planted.items()):
+        connection.execute(table.update().where(table.c.id == location_id).values(
+            planted_trees=db.func.coalesce(table.c.planted_trees, 0) + trees))
+    bump_catalog_version(connection, 'locations')
+
+def compute_donation_summary():
+    """Recompute the rollup from the donation table"""
+    rows = db.session.query(
+        Donation.location_id, Donation.status, db.func.count(Donation.id),
+        db.func.coalesce(db.func.sum(Donation.tree_count), 0),
+        db.func.coalesce(db.func.sum(Donation.amount), 0)
+    ).group_by(Donation.location_id, Donation.status).all()
+    summary = {}
+    for location_id, status, donations, trees, revenue in rows:
+        key = (location_id or '', status or '')
+        totals = summary.get(key, (0, 0, 0))
+        summary[key] = (totals[0] + donations, totals[1] + trees, totals[2] + revenue)
+    return summary
+
+def load_principal(user_id):
+    """Cached, read-only snapshot of the user a token was issued for"""
+    return principal_cache.get(user_id, lambda user_id: User.query.get(user_id))
+
+# Public catalog versions and HTTP caching
+CATALOG_MODELS = {'Location': 'locations', 'Package': 'packages', 'News': 'news'}
+CATALOG_CACHE_MAX_AGE = int(os.environ.get('CATALOG_CACHE_MAX_AGE', 60))
+CATALOG_BODY_CACHE_SIZE = 256
+
+def bump_catalog_version(connection, name):
+    """Atomically advance a catalog's version, creating its row if needed"""
+    table = CatalogVersion.__table__
+    now = datetime.datetime.utcnow().replace(microsecond=0)
+    dialect = connection.dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        statement = insert(table).values(name=name, version=1, updated_at=now)
+        connection.execute(statement.on_conflict_do_update(
+            index_elements=['name'], set_={'version': table.c.version + 1, 'updated_at': now}))
+        return
+    result = connection.execute(table.update().where(table.c.name == name).values(
+        version=table.c.version + 1, updated_at=now))
+    if result.rowcount == 0:
+        connection.execute(table.insert().values(name=name, version=1, updated_at=now))
+
+@db.event.listens_for(db.session, 'before_flush')
+def update_catalog_versions(session, flush_context, instances):
+    """Bump the version of every catalog whose rows change in this flush"""
+    changed = set()
+    for obj in list(session.new) + list(session.deleted):
+        changed.add(CATALOG_MODELS.get(type(obj).__name__))
+    for obj in session.dirty:
+        if session.is_modified(obj):
+            changed.add(CATALOG_MODELS.get(type(obj).__name__))
+    changed.discard(None)
+    if changed:
+        connection = session.connection()
+        for name in sorted(changed):
+            bump_catalog_version(connection, name)
+
+_catalog_bodies = {}  # (catalog, key) -> (etag, serialized body), per process
+
+def catalog_response(name, build, key=''):
+    """
+    Serve a public catalog with a strong ETag, Last-Modified and Cache-Control
+
+    Conditional requests that still match the catalog version get a 304
+    without loading the catalog. build() returns the JSON-serializable data
+    and only runs when this process has not serialized the current version.
+    """
+    row = db.session.execute(
+        db.select(CatalogVersion.version, CatalogVersion.updated_at).where(CatalogVersion.name == name)
+    ).first()
+    version, updated_at = row if row else (0, None)
+    etag = hashlib.sha256(f'{name}:{version}:{updated_at}:{key}'.encode()).hexdigest()[:32]
+    last_modified = updated_at.replace(tzinfo=datetime.timezone.utc) if updated_at else None
+
+    if request.if_none_match:
+        not_modified = request.if_none_match.contains(etag)
+    else:
+        not_modified = bool(last_modified and request.if_modified_since
+                            and last_modified <= request.if_modified_since)
+
+    if not_modified:
+        response = app.response_class(status=304)
+    else:
+        cached = _catalog_bodies.get((name, key))
+        if cached and cached[0] == etag:
+            body = cached[1]
+        else:
+            body = jsonify(build()).get_data()
+            if len(_catalog_bodies) >= CATALOG_BODY_CACHE_SIZE:
+                _catalog_bodies.clear()
+            _catalog_bodies[(name, key)] = (etag, body)
+        response = app.response_class(body, mimetype='application/json')
+    return cache_validators(response, etag, last_modified)
+
+def static_catalog_response(data):
+    """Serve data that only changes with a deploy, using a content-hash ETag"""
+    body = jsonify(data).get_data()
+    etag = hashlib.sha256(body).hexdigest()[:32]
+    if request.if_none_match and request.if_none_match.contains(etag):
+        return cache_validators(app.response_class(status=304), etag)
+    return cache_validators(app.response_class(body, mimetype='application/json'), etag)
+
+def cache_validators(response, etag, last_modified=None):
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    response.cache_control.public = True
+    response.cache_control.max_age = CATALOG_CACHE_MAX_AGE
+    return response
+
+# Certificate render queue
+CERTIFICATE_MAX_ATTEMPTS = int(os.environ.get('CERTIFICATE_MAX_ATTEMPTS', 5))
+CERTIFICATE_RETRY_DELAY = float(os.environ.get('CERTIFICATE_RETRY_DELAY', 5))  # seconds, doubled per attempt
+CERTIFICATE_RETRY_MAX_DELAY = 300
+CERTIFICATE_RENDER_LEASE = datetime.timedelta(minutes=2)
+
+def enqueue_certificate_render(donation_id, force=False):
+    """Queue the certificate of a donation for rendering in the current transaction.
+
+    Idempotent per donation: an existing job is left alone unless force is set,
+    in which case a finished or failed job is queued again.
+    """
+    table = CertificateRenderJob.__table__
+    now = datetime.datetime.utcnow()
+    connection = db.session.connection()
+    values = {'id': str(uuid.uuid4()), 'donation_id': donation_id, 'status': 'queued',
+              'attempts': 0, 'next_attempt_at': now}
+    dialect = connection.dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        connection.execute(insert(table).values(**values).on_conflict_do_nothing(index_elements=['donation_id']))
+    elif not connection.execute(db.select(table.c.id).where(table.c.donation_id == donation_id)).first():
+        connection.execute(table.insert().values(**values))
+
+    if force:
+        connection.execute(table.update().where(
+            table.c.donation_id == donation_id, table.c.status.in_(['done', 'failed'])
+        ).values(status='queued', attempts=0, next_attempt_at=now, last_error=None))
+
+def claim_certificate_job():
+    """Atomically take the next due job (or one whose worker lease expired)"""
+    now = datetime.datetime.utcnow()
+    claimable = db.or_(
+        db.and_(CertificateRenderJob.status == 'queued', CertificateRenderJob.next_attempt_at <= now),
+        db.and_(CertificateRenderJob.status == 'rendering', CertificateRenderJob.locked_until < now)
+    )
+    candidates = db.session.query(CertificateRenderJob.id).filter(claimable) \
+        .order_by(CertificateRenderJob.next_attempt_at).limit(5).all()
+    for (job_id,) in candidates:
+        claimed = CertificateRenderJob.query.filter(CertificateRenderJob.id == job_id, claimable).update(
+            {'status': 'rendering', 'locked_until': now + CERTIFICATE_RENDER_LEASE,
+             'attempts': CertificateRenderJob.attempts + 1},
+            synchronize_session=False
+        )
+        db.session.commit()
+        if claimed:
+            return job_id
+    return None
+
+def run_certificate_job(job_id):
+    """Render the PDF of a claimed job and record the certificate, or schedule a retry"""
+    job = CertificateRenderJob.query.get(job_id)
+    donation = Donation.query.get(job.donation_id)
+    if not donation or donation.status != 'completed':
+        job.status = 'failed'
+        job.last_error = 'Donation is not completed'
+        job.locked_until = None
+        db.session.commit()
+        CERTIFICATE_JOBS.labels('failed').inc()
+        return
+
+    stored = generate_certificate_pdf(donation)
+    replaced = None
+    if stored or not PDF_ENABLED:
+        certificate = Certificate.query.filter_by(donation_id=donation.id).first()
+        if not certificate:
+            certificate = Certificate(
+                id=str(uuid.uuid4()),
+                donation_id=donation.id,
+                pdf_url=f"/api/certificates/{donation.id}.pdf"
+            )
+            db.session.add(certificate)
+        if stored:
+            if certificate.file_sha256 and certificate.file_sha256 != stored.digest:
+                replaced = certificate.file_sha256
+            certificate.file_sha256, certificate.file_size = stored.digest, stored.size
+        job.status = 'done'
+        job.last_error = None
+    elif job.attempts >= CERTIFICATE_MAX_ATTEMPTS:
+        job.status = 'failed'
+        job.last_error = 'PDF generation failed'
+    else:
+        # Exponential backoff with jitter so retries from several workers spread out
+        delay = min(CERTIFICATE_RETRY_DELAY * 2 ** (job.attempts - 1), CERTIFICATE_RETRY_MAX_DELAY)
+        job.status = 'queued'
+        job.next_attempt_at = datetime.datetime.utcnow() + datetime.timedelta(seconds=delay * random.uniform(1, 1.5))
+        job.last_error = 'PDF generation failed'
+    job.locked_until = None
+    db.session.commit()
+    if replaced:
+        # A re-render: nothing refers to the previous file any more
+        certificate_store.delete(replaced)
+    CERTIFICATE_JOBS.labels('retry' if job.status == 'queued' else job.status).inc()
+    if job.status != 'queued':
+        donation_notifier.publish(donation.id)
+
+def process_next_certificate_job():
+    """Claim and render one job; returns False when the queue has nothing due"""
+    job_id = claim_certificate_job()
+    if not job_id:
+        return False
+    try:
+        run_certificate_job(job_id)
+    except Exception as e:
+        db.session.rollback()
+        app.logger.exception(f"Certificate job {job_id} crashed: {e}")
+    return True
+
+# Payment reconciliation
+from payment_reconciler import PaymentStatusFetcher
+PAYMENT_RECONCILE_INTERVAL = float(os.environ.get('PAYMENT_RECONCILE_INTERVAL', 15))  # seconds between checks of one donation
+PAYMENT_RECONCILE_BATCH = int(os.environ.get('PAYMENT_RECONCILE_BATCH', 50))
+PAYMENT_STATUS_TRANSITIONS = {'PAID': 'completed', 'DECLINED': 'failed', 'CANCELLED': 'cancelled', 'EXPIRED': 'cancelled'}
+payment_status_fetcher = PaymentStatusFetcher(
+    concurrency=int(os.environ.get('PAYMENT_RECONCILE_CONCURRENCY', 4)),
+    rate=float(os.environ.get('PAYMENT_RECONCILE_RATE', 5))
+)
+
+def apply_payment_status(donation, ioka_status):
+    """Move an awaiting_payment donation to the state matching its Ioka order status"""
+    new_status = PAYMENT_STATUS_TRANSITIONS.get(ioka_status)
+    if not new_status or donation.status != 'awaiting_payment':
+        return None
+    donation.status = new_status
+    if new_status == 'completed':
+        # Ensure the certificate gets rendered, again if no stored file is recorded for it
+        stored = db.session.query(Certificate.file_sha256).filter(Certificate.donation_id == donation.id).scalar()
+        enqueue_certificate_render(donation.id, force=not stored)
+    return new_status
+
+def claim_awaiting_payments(limit):
+    """Take up to limit donations whose payment status is due for a check, as (id, order id) pairs"""
+    now = datetime.datetime.utcnow()
+    due = db.and_(
+        Donation.status == 'awaiting_payment',
+        Donation.payment_order_id.isnot(None),
+        Donation.payment_checked_at < now - datetime.timedelta(seconds=PAYMENT_RECONCILE_INTERVAL)
+    )
+    candidates = db.session.query(Donation.id, Donation.payment_order_id).filter(due) \
+        .order_by(Donation.payment_checked_at).limit(limit).all()
+    claimed = []
+    for donation_id, order_id in candidates:
+        # Conditional update, so reconcilers in other workers skip donations already taken
+        if Donation.query.filter(Donation.id == donation_id, due).update(
+                {'payment_checked_at': now}, synchronize_session=False):
+            claimed.append((donation_id, order_id))
+    db.session.commit()
+    return claimed
+
+def reconcile_awaiting_payments(limit=PAYMENT_RECONCILE_BATCH):
+    """Check one batch of awaiting_payment donations with Ioka; returns how many were checked"""
+    if not IOKA_ENABLED:
+        return 0
+    claimed = claim_awaiting_payments(limit)
+    if not claimed:
+        return 0
+    # No transaction is held open while Ioka answers
+    statuses = payment_status_fetcher.fetch([order_id for _, order_id in claimed], ioka_service.get_payment_status)
+
+    changed = {}
+    donations = Donation.query.filter(Donation.id.in_([donation_id for donation_id, _ in claimed]),
+                                      Donation.status == 'awaiting_payment').all()
+    for donation in donations:
+        new_status = apply_payment_status(donation, statuses.get(donation.payment_order_id))
+        if new_status:
+            changed[donation.id] = new_status
+    db.session.commit()
+    if 'completed' in changed.values():
+        certificate_worker.wake()
+    for donation_id in changed:
+        donation_notifier.publish(donation_id)
+    return len(claimed)
+
+# Webhook inbox: deliveries are stored on receipt and applied by webhook_worker
+WEBHOOK_STATUS_TRANSITIONS = {'payment.succeeded': 'completed', 'payment.failed': 'failed',
+                              'payment.cancelled': 'cancelled'}
+WEBHOOK_MAX_ATTEMPTS = int(os.environ.get('WEBHOOK_MAX_ATTEMPTS', 5))
+
+def webhook_event_key(data, donation_id):
+    """Deduplication key of a delivery: Ioka's event id, else the event type on the payment or order"""
+    if data.get('id'):
+        return f"event:{data['id']}"
+    order_data = data.get('object') or {}
+    return f"{data.get('event')}:{order_data.get('id') or donation_id}"
+
+def store_webhook_event(event_key, donation_id, event_type, payload):
+    """Insert a delivery into the inbox in the current transaction; False if its key is already there"""
+    table = WebhookEvent.__table__
+    values = {'event_key': event_key, 'donation_id': donation_id, 'event_type': event_type or '',
+              'payload': payload, 'status': 'pending', 'attempts': 0,
+              'received_at': datetime.datetime.utcnow()}
+    connection = db.session.connection()
+    dialect = connection.dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        result = connection.execute(insert(table).values(**values).on_conflict_do_nothing(index_elements=['event_key']))
+        return result.rowcount == 1
+    if connection.execute(db.select(table.c.id).where(table.c.event_key == event_key)).first():
+        return False
+    connection.execute(table.insert().values(**values))
+    return True
+
+def claim_webhook_donation():
+    """Lock the donation with the oldest pending event, skipping donations another worker holds
+
+    The row lock lasts until the caller commits, so the events of one
+    donation are never applied by two workers at once or out of order.
+    """
+    candidates = db.session.query(WebhookEvent.donation_id).filter(WebhookEvent.status == 'pending') \
+        .group_by(WebhookEvent.donation_id).order_by(db.func.min(WebhookEvent.id)).limit(5).all()
+    for (donation_id,) in candidates:
+        locked = db.session.query(Donation.id).filter(Donation.id == donation_id) \
+            .with_for_update(skip_locked=True).scalar()
+        if locked:
+            return donation_id
+        if not db.session.query(Donation.id).filter(Donation.id == donation_id).scalar():
+            WebhookEvent.query.filter_by(donation_id=donation_id, status='pending').update(
+                {'status': 'failed', 'last_error': 'Donation not found',
+                 'processed_at': datetime.datetime.utcnow()}, synchronize_session=False)
+            db.session.commit()
+            app.logger.warning(f"Webhook events for unknown donation {donation_id} dropped")
+    return None
+
+def apply_webhook_events(donation_id):
+    """Apply the pending events of a claimed donation in arrival order; returns how many changed it"""
+    donation = db.session.get(Donation, donation_id)
+    events = WebhookEvent.query.filter_by(donation_id=donation_id, status='pending') \
+        .order_by(WebhookEvent.id).all()
+    now = datetime.datetime.utcnow()
+    applied = 0
+    for event in events:
+        event.attempts += 1
+        event.processed_at = now
+        new_status = WEBHOOK_STATUS_TRANSITIONS.get(event.event_type)
+        if not new_status:
+            event.status = 'skipped'
+            continue
+        donation.status = new_status
+        if new_status == 'completed':
+            # The PDF is rendered by the certificate worker, not here
+            enqueue_certificate_render(donation.id)
+        event.status = 'applied'
+        applied += 1
+        app.logger.info(f"Webhook {event.event_type} applied to donation {donation_id}")
+    db.session.commit()
+    if applied and donation.status == 'completed':
+        certificate_worker.wake()
+    if applied:
+        # Wake /api/donations/<id>/events waiters in every worker
+        donation_notifier.publish(donation_id)
+    return applied
+
+def process_next_webhook_events():
+    """Apply the pending events of one donation; returns False when the inbox has nothing to do"""
+    donation_id = claim_webhook_donation()
+    if not donation_id:
+        return False
+    try:
+        apply_webhook_events(donation_id)
+    except Exception as e:
+        db.session.rollback()
+        app.logger.exception(f"Webhook events of donation {donation_id} crashed: {e}")
+        pending = WebhookEvent.query.filter_by(donation_id=donation_id, status='pending')
+        pending.update({'attempts': WebhookEvent.attempts + 1, 'last_error': str(e)[:500]},
+                       synchronize_session=False)
+        pending.filter(WebhookEvent.attempts >= WEBHOOK_MAX_ATTEMPTS).update(
+            {'status': 'failed', 'processed_at': datetime.datetime.utcnow()}, synchronize_session=False)
+        db.session.commit()
+    return True
+
+def certificate_render_state(donation_id, certificate):
+    """'ready', 'rendering' or 'failed' for the status endpoint, None if nothing is queued"""
+    if certificate:
+        return 'ready'
+    job = CertificateRenderJob.query.filter_by(donation_id=donation_id).first()
+    if not job:
+        return None
+    return 'failed' if job.status == 'failed' else 'rendering'
+
+def link_guest_donations(user, relink=False):
+    """Attach unowned donations made with the user's email, in one UPDATE, once per account
+
+    The watermark guest_donations_linked_at makes repeat calls free; pass
+    relink=True after the account's email changes. The caller commits.
+    """
+    if user.guest_donations_linked_at is not None and not relink:
+        return 0
+    # Matched regardless of case, like logins (served by ix_donation_email_lower)
+    linked = Donation.query.filter(db.func.lower(Donation.email) == db.func.lower(user.email),
+                                   Donation.user_id.is_(None)) \
+        .update({'user_id': user.id}, synchronize_session=False)
+    user.guest_donations_linked_at = datetime.datetime.utcnow()
+    return linked
+
+def find_user_by_email(email):
+    """Look up a user by email regardless of case (served by ix_user_email_lower)"""
+    if not email:
+        return None
+    return User.query.filter(db.func.lower(User.email) == email.strip().lower()) \
+        .order_by(User.created_at, User.id).first()
+
 # Decorator for token validation
 def token_required(f):
     @wraps(f)
@@ -271,7 +934,9 @@ def token_required(f):
 
         try:
             data = jwt.decode(token, app.config['SECRET_KEY'], algorithms=["HS256"])
-            current_user = User.query.filter_by(id=data['id']).first()
+            current_user = load_principal(data['id'])
+            if not current_user:
+                return jsonify({'message': 'Token is invalid!'}), 401
         except jwt.ExpiredSignatureError:
             return jsonify({'message': 'Token has expired!'}), 401
         except jwt.InvalidTokenError:
@@ -283,6 +948,132 @@ def token_required(f):
 
     return decorated
 
+# Cursor pagination helpers
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+def get_page_args(default_limit=None):
+    """Read the ?limit= and ?cursor= query parameters of a paginated endpoint
+
+    Without either the limit is default_limit. None returns the whole list,
+    as before pagination existed, for the cabinet lists whose clients do not
+    page; the admin lists pass DEFAULT_PAGE_SIZE so a bare call stays bounded.
+    """
+    limit = request.args.get('limit', type=int)
+    cursor = request.args.get('cursor') or None
+    if limit is None:
+        if not cursor and default_limit is None:
+            return None, None
+        limit = default_limit or DEFAULT_PAGE_SIZE
+    return max(1, min(limit, MAX_PAGE_SIZE)), cursor
+
+def keyset_condition(sort_column, anchor, id_column, cursor, descending=True):
+    """Rows strictly after the anchor row in (sort_column, id) order"""
+    if descending:
+        return db.or_(sort_column < anchor, db.and_(sort_column == anchor, id_column < cursor))
+    return db.or_(sort_column > anchor, db.and_(sort_column == anchor, id_column > cursor))
+
+def apply_keyset(query, model, time_column, cursor):
+    """Order query newest first and restrict it to rows after the cursor row.
+
+    The cursor is the id of the last row of the previous page. Its timestamp is
+    resolved inside the same statement, so the database compares its own stored
+    values and no extra round trip is needed.
+    """
+    if cursor:
+        # Resolved through an alias, so the subquery is never correlated to the outer row
+        anchor_row = db.aliased(model)
+        anchor = db.session.query(getattr(anchor_row, time_column.key)) \
+            .filter(anchor_row.id == cursor).scalar_subquery()
+        query = query.filter(keyset_condition(time_column, anchor, model.id, cursor))
+    return query.order_by(time_column.desc(), model.id.desc())
+
+def fetch_page(query, limit, get_id):
+    """Fetch one page (every row when limit is None) and return (rows, next_cursor)"""
+    if limit is None:
+        return query.all(), None
+    return split_page(query.limit(limit + 1).all(), limit, get_id)
+
+def split_page(rows, limit, get_id):
+    """Trim a limit + 1 fetch to one page and return (rows, next_cursor)"""
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, get_id(rows[-1])
+    return rows, None
+
+# Opt-in streaming of whole admin lists: ?stream=json (one JSON array) or ?stream=ndjson
+STREAM_BATCH_SIZE = int(os.environ.get('STREAM_BATCH_SIZE', 500))
+STREAM_FORMATS = {'json': 'application/json', 'ndjson': 'application/x-ndjson'}
+
+def get_stream_format():
+    """'json' or 'ndjson' when the client asked for a streamed list, else None"""
+    requested = request.args.get('stream')
+    if requested is None and request.accept_mimetypes.best == STREAM_FORMATS['ndjson']:
+        requested = 'ndjson'
+    return requested if requested in STREAM_FORMATS else None
+
+def stream_rows(query, serialize, stream_format):
+    """Serialize query rows as they are fetched, STREAM_BATCH_SIZE at a time
+
+    Nothing is buffered beyond one batch, so memory stays flat however long
+    the list is and the first bytes go out before the last row is read.
+    """
+    def generate():
+        chunk = ['['] if stream_format == 'json' else []
+        rows = 0
+        for row in query.yield_per(STREAM_BATCH_SIZE):
+            item = app.json.dumps(serialize(row))
+            if stream_format == 'json':
+                chunk.append(item if rows == 0 else ',' + item)
+            else:
+                chunk.append(item + '\n')
+            rows += 1
+            if rows % STREAM_BATCH_SIZE == 0:
+                yield ''.join(chunk)
+                chunk = []
+        if stream_format == 'json':
+            chunk.append(']')
+        if chunk:
+            yield ''.join(chunk)
+
+    return app.response_class(stream_with_context(generate()), mimetype=STREAM_FORMATS[stream_format])
+
+def user_donations_query(user_id):
+    """Donations of a user with location name and certificate in one statement"""
+    certificate = db.session.query(Certificate.id, Certificate.created_date) \
+        .filter(Certificate.donation_id == Donation.id) \
+        .order_by(Certificate.created_date) \
+        .limit(1)
+    return db.session.query(
+        Donation,
+        Location.name.label('location_name'),
+        certificate.with_entities(Certificate.id).scalar_subquery().label('certificate_id'),
+        certificate.with_entities(Certificate.created_date).scalar_subquery().label('certificate_date')
+    ).outerjoin(Location, Location.id == Donation.location_id) \
+        .filter(Donation.user_id == user_id)
+
+def serialize_user_donation(row):
+    donation = row.Donation
+    return {
+        'id': donation.id,
+        'date': donation.created_at.isoformat() + 'Z',
+        'location': row.location_name or donation.location_id,
+        'trees': donation.tree_count,
+        'amount': donation.amount,
+        'status': donation.status,
+        'certificate_id': row.certificate_id
+    }
+
+def serialize_user_certificate(certificate_id, certificate_date, donation_id, tree_count, location):
+    return {
+        "id": certificate_id,
+        "donation_id": donation_id,
+        "trees": tree_count or 0,
+        "location": location or 'Unknown Location',
+        "date": certificate_date.isoformat() + 'Z' if certificate_date else None,
+        "pdf_url": f"/api/certificates/{donation_id}.pdf"
+    }
+
 @app.route('/api/auth/register', methods=['POST'])
 def register_user():
     try:
@@ -295,7 +1086,7 @@ def register_user():
             existing_user = User.query.get(guest_user_id)
         
         if not existing_user:
-            existing_user = User.query.filter_by(email=data['email']).first()
+            existing_user = find_user_by_email(data['email'])
         
         if existing_user:
             if existing_user.status == 'guest':
@@ -303,23 +1094,21 @@ def register_user():
                 
                 # If changing email, check if new email is already taken by another active user
                 if existing_user.email != data['email']:
-                    email_taken = User.query.filter_by(email=data['email']).first()
+                    email_taken = find_user_by_email(data['email'])
                     if email_taken and email_taken.id != existing_user.id:
                         return jsonify({'message': 'Этот email уже используется другим аккаунтом'}), 400
                 
-                hashed_password = generate_password_hash(data['password'], method='pbkdf2:sha256', salt_length=12)
+                hashed_password = password_policy.hash(data['password'])
                 existing_user.full_name = data.get('full_name', existing_user.full_name)
                 existing_user.email = data['email']
                 existing_user.password = hashed_password
                 existing_user.phone = data.get('phone', existing_user.phone)
                 existing_user.status = 'active'
                 
-                # Re-link any other donations with the NEW email that might have been legacy guests
-                legacy_donations = Donation.query.filter_by(email=existing_user.email, user_id=None).all()
-                for d in legacy_donations:
-                    d.user_id = existing_user.id
-                
+                # Link any legacy guest donations made with the (possibly new) email
+                link_guest_donations(existing_user, relink=True)
                 db.session.commit()
+                principal_cache.invalidate(existing_user.id)
                 return jsonify({
                     'message': 'Аккаунт успешно активирован!',
                     'user_id': existing_user.id,
@@ -329,7 +1118,7 @@ def register_user():
                 return jsonify({'message': 'Пользователь с таким email уже существует'}), 400
         
         # Create new active user from scratch
-        hashed_password = generate_password_hash(data['password'], method='pbkdf2:sha256', salt_length=12)
+        hashed_password = password_policy.hash(data['password'])
         new_user = User(
             id=str(uuid.uuid4()), 
             full_name=data['full_name'], 
@@ -339,14 +1128,10 @@ def register_user():
             status='active'
         )
         db.session.add(new_user)
-        db.session.commit()
-        
+        db.session.flush()
         # Link any legacy guest donations with the same email
-        guest_donations = Donation.query.filter_by(email=data['email'], user_id=None).all()
-        for donation in guest_donations:
-            donation.user_id = new_user.id
-        if guest_donations:
-            db.session.commit()
+        link_guest_donations(new_user)
+        db.session.commit()
         
         return jsonify({
             'message': 'Новый пользователь создан!',
@@ -377,20 +1162,22 @@ def login_user():
         return jsonify({'message': 'Could not verify'}), 401
 
 
-    user = User.query.filter_by(email=email).first()
+    user = find_user_by_email(email)
     if not user:
         return jsonify({'message': 'Could not verify'}), 401
 
-    if check_password_hash(user.password, password):
+    if password_policy.verify(user.password, password):
         token = jwt.encode({'id': user.id, 'exp': datetime.datetime.utcnow() + datetime.timedelta(hours=24)}, app.config['SECRET_KEY'], algorithm="HS256")
-        
-        # Link any guest donations with the same email
-        guest_donations = Donation.query.filter_by(email=email, user_id=None).all()
-        for donation in guest_donations:
-            donation.user_id = user.id
-        if guest_donations:
+
+        # Upgrade hashes made under an older PASSWORD_HASH_METHOD while the password is at hand
+        if password_policy.needs_rehash(user.password):
+            user.password = password_policy.hash(password)
+        # Accounts created before linking moved to registration are linked on their first login
+        if user.guest_donations_linked_at is None:
+            link_guest_donations(user)
+        if db.session.dirty:
             db.session.commit()
-        
+
         return jsonify({'token': token})
 
     return jsonify({'message': 'Could not verify'}), 401
@@ -405,27 +1192,45 @@ def logout(current_user):
 
 @app.route('/api/locations', methods=['GET'])
 def get_locations():
-    locations = Location.query.all()
-    output = []
-    for location in locations:
-        location_data = {
-            'id': location.id,
-            'name': location.name,
-            'description': location.description,
-            'area_hectares': location.area_hectares,
-            'coordinates': location.coordinates,
-            'image_url': location.image_url,
-            'status': location.status,
-            'capacity_trees': location.capacity_trees,
-            'planted_trees': location.planted_trees
-        }
-        output.append(location_data)
-    return jsonify(output)
+    def build():
+        return [serialize_location(location) for location in Location.query.all()]
+    return catalog_response('locations', build)
 
 @app.route('/api/locations/<string:location_id>', methods=['GET'])
 def get_location_details(location_id):
-    location = Location.query.get_or_404(location_id)
-    location_data = {
+    # The catalog validator does not depend on the id, so an unknown id is answered before it
+    db.first_or_404(db.select(Location.id).where(Location.id == location_id))
+
+    def build():
+        location_data = serialize_location(Location.query.get_or_404(location_id))
+        location_data['features'] = ["Доступно круглый год", "Быстрый старт", "Идеально для частных лиц"]
+        return location_data
+    return catalog_response('locations', build, key=location_id)
+
+@app.route('/api/locations/progress', methods=['GET'])
+def get_locations_progress():
+    """Planted and capacity counters of every location, for the landing page to poll"""
+    def build():
+        rows = db.session.execute(db.select(
+            Location.id, Location.name, Location.status, Location.capacity_trees, Location.planted_trees
+        ).order_by(Location.id)).all()
+        locations = [{
+            'id': row.id,
+            'name': row.name,
+            'status': row.status,
+            'capacity_trees': row.capacity_trees,
+            'planted_trees': row.planted_trees or 0,
+            'percent': round(100 * (row.planted_trees or 0) / row.capacity_trees, 1) if row.capacity_trees else None
+        } for row in rows]
+        return {
+            'locations': locations,
+            'planted_trees': sum(location['planted_trees'] for location in locations),
+            'capacity_trees': sum(location['capacity_trees'] or 0 for location in locations)
+        }
+    return catalog_response('locations', build, key='progress')
+
+def serialize_location(location):
+    return {
         'id': location.id,
         'name': location.name,
         'description': location.description,
@@ -434,16 +1239,12 @@ def get_location_details(location_id):
         'image_url': location.image_url,
         'status': location.status,
         'capacity_trees': location.capacity_trees,
-        'planted_trees': location.planted_trees,
-        'features': ["Доступно круглый год", "Быстрый старт", "Идеально для частных лиц"]
+        'planted_trees': location.planted_trees
     }
-    return jsonify(location_data)
 
-@app.route('/api/packages', methods=['GET'])
-def get_packages():
-    packages = Package.query.all()
+def serialize_packages():
     output = []
-    for package in packages:
+    for package in Package.query.all():
         package_data = {
             'id': package.id,
             'name': package.name,
@@ -453,7 +1254,11 @@ def get_packages():
             'popular': package.popular
         }
         output.append(package_data)
-    return jsonify(output)
+    return output
+
+@app.route('/api/packages', methods=['GET'])
+def get_packages():
+    return catalog_response('packages', serialize_packages)
 
 @app.route('/api/packages/by-location/<string:location_id>', methods=['GET'])
 def get_packages_by_location(location_id):
@@ -492,14 +1297,14 @@ def create_guest_donation():
         return jsonify({'message': 'Email is required'}), 400
 
     # Link to guest user or existing user
-    user = User.query.filter_by(email=donor_email).first()
+    user = find_user_by_email(donor_email)
     if not user:
         # Create a guest user if they don't exist
         user = User(
             id=str(uuid.uuid4()),
             full_name=donor_name,
             email=donor_email,
-            password=generate_password_hash(str(uuid.uuid4()), method='pbkdf2:sha256', salt_length=12),
+            password=UNUSABLE_PASSWORD,  # no login until the account is upgraded by registering
             status='guest'
         )
         db.session.add(user)
@@ -529,9 +1334,7 @@ def create_guest_donation():
 @token_required
 def process_payment(current_user, donation_id):
     """Process payment for authenticated user donation using Ioka"""
-    print(f"\n=== PAYMENT REQUEST for donation {donation_id} ===")
-    print(f"User: {current_user.email}")
-    print(f"IOKA_ENABLED: {IOKA_ENABLED}")
+    app.logger.info(f"Payment request for donation {donation_id}", extra={'ioka_enabled': IOKA_ENABLED})
     
     donation = Donation.query.get_or_404(donation_id)
     if donation.user_id != current_user.id:
@@ -546,7 +1349,6 @@ def process_payment(current_user, donation_id):
             description = f"Посадка {donation.tree_count} деревьев в {location_name}"
             
             # Create Ioka payment order
-            print(f"Creating Ioka payment order for donation {donation.id}")
             payment_result = ioka_service.create_payment_order(
                 amount=donation.amount,
                 description=description,
@@ -554,12 +1356,14 @@ def process_payment(current_user, donation_id):
                 customer_email=current_user.email,
                 customer_name=current_user.full_name
             )
-            print(f"Ioka payment result: {payment_result}")
+            app.logger.info(f"Ioka payment order for donation {donation.id}: success={payment_result.get('success')}",
+                            extra={'order_id': payment_result.get('order_id')})
             
             if payment_result.get('success'):
                 # Store Ioka order ID
                 donation.payment_order_id = payment_result.get('order_id')
                 donation.status = 'awaiting_payment'
+                donation.payment_checked_at = datetime.datetime.utcnow()
                 db.session.commit()
                 
                 return jsonify({
@@ -584,12 +1388,15 @@ def process_payment(current_user, donation_id):
         # Fallback: mark as completed without payment gateway
         donation.status = 'completed'
         
-        new_certificate = Certificate(
-            id=str(uuid.uuid4()),
-            donation_id=donation.id,
-            pdf_url=f"/api/certificates/{donation.id}.pdf"
-        )
-        db.session.add(new_certificate)
+        # One certificate per donation (unique donation_id), so reuse it on repeated calls
+        new_certificate = Certificate.query.filter_by(donation_id=donation.id).first()
+        if not new_certificate:
+            new_certificate = Certificate(
+                id=str(uuid.uuid4()),
+                donation_id=donation.id,
+                pdf_url=f"/api/certificates/{donation.id}.pdf"
+            )
+            db.session.add(new_certificate)
         db.session.commit()
 
         return jsonify({
@@ -603,8 +1410,7 @@ def process_payment(current_user, donation_id):
 @app.route('/api/guest-donations/<string:donation_id>/payment', methods=['POST'])
 def process_guest_payment(donation_id):
     """Process payment for guest donation using Ioka"""
-    print(f"\n=== GUEST PAYMENT REQUEST for donation {donation_id} ===")
-    print(f"IOKA_ENABLED: {IOKA_ENABLED}")
+    app.logger.info(f"Guest payment request for donation {donation_id}", extra={'ioka_enabled': IOKA_ENABLED})
     
     donation = Donation.query.get_or_404(donation_id)
     
@@ -638,6 +1444,7 @@ def process_guest_payment(donation_id):
                 # Store Ioka order ID
                 donation.payment_order_id = payment_result.get('order_id')
                 donation.status = 'awaiting_payment'
+                donation.payment_checked_at = datetime.datetime.utcnow()
                 db.session.commit()
                 
                 return jsonify({
@@ -662,12 +1469,15 @@ def process_guest_payment(donation_id):
         # Fallback: mark as completed without payment gateway
         donation.status = 'completed'
         
-        new_certificate = Certificate(
-            id=str(uuid.uuid4()),
-            donation_id=donation.id,
-            pdf_url=f"/api/certificates/{donation.id}.pdf"
-        )
-        db.session.add(new_certificate)
+        # One certificate per donation (unique donation_id), so reuse it on repeated calls
+        new_certificate = Certificate.query.filter_by(donation_id=donation.id).first()
+        if not new_certificate:
+            new_certificate = Certificate(
+                id=str(uuid.uuid4()),
+                donation_id=donation.id,
+                pdf_url=f"/api/certificates/{donation.id}.pdf"
+            )
+            db.session.add(new_certificate)
         db.session.commit()
 
         return jsonify({
@@ -681,36 +1491,16 @@ def process_guest_payment(donation_id):
 @app.route('/api/users/me/donations', methods=['GET'])
 @token_required
 def get_user_donations(current_user):
-    # First, link any guest donations with the same email
-    guest_donations = Donation.query.filter_by(email=current_user.email, user_id=None).all()
-    for donation in guest_donations:
-        donation.user_id = current_user.id
-    if guest_donations:
-        db.session.commit()
-    
-    # Now get all donations for the user
-    donations = Donation.query.filter_by(user_id=current_user.id).all()
-    output = []
-    for donation in donations:
-        # Get location name instead of ID
-        location = Location.query.get(donation.location_id)
-        location_name = location.name if location else donation.location_id
-        
-        # Get certificate ID safely
-        certificate = Certificate.query.filter_by(donation_id=donation.id).first()
-        certificate_id = certificate.id if certificate else None
-        
-        donation_data = {
-            'id': donation.id,
-            'date': donation.created_at.isoformat() + 'Z',
-            'location': location_name,
-            'trees': donation.tree_count,
-            'amount': donation.amount,
-            'status': donation.status,
-            'certificate_id': certificate_id
-        }
-        output.append(donation_data)
-    return jsonify(output)
+    # Location name and certificate come from the same statement, so the
+    # number of queries does not grow with the donation history
+    limit, cursor = get_page_args()
+    query = apply_keyset(user_donations_query(current_user.id), Donation, Donation.created_at, cursor)
+    rows, next_cursor = fetch_page(query, limit, lambda row: row.Donation.id)
+
+    response = jsonify([serialize_user_donation(row) for row in rows])
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
 
 @app.route('/api/users/me', methods=['GET'])
 @token_required
@@ -739,27 +1529,52 @@ def logout_endpoint(current_user):
 @app.route('/api/users/me/certificates', methods=['GET'])
 @token_required
 def get_user_certificates(current_user):
-    donations = Donation.query.filter_by(user_id=current_user.id).all()
-    donation_ids = [donation.id for donation in donations]
-    certificates = Certificate.query.filter(Certificate.donation_id.in_(donation_ids)).all()
-    
-    output = []
-    for certificate in certificates:
-        donation = Donation.query.get(certificate.donation_id)
-        # Handle case where donation might not exist
-        tree_count = donation.tree_count if donation else 0
-        location_id = donation.location_id if donation else 'Unknown Location'
-        
-        certificate_data = {
-            "id": certificate.id,
-            "donation_id": certificate.donation_id,
-            "trees": tree_count,
-            "location": location_id,
-            "date": certificate.created_date.isoformat() + 'Z' if certificate.created_date else None,
-            "pdf_url": f"/api/certificates/{certificate.donation_id}.pdf"
-        }
-        output.append(certificate_data)
-    return jsonify(output)
+    limit, cursor = get_page_args()
+    query = db.session.query(
+        Certificate.id, Certificate.created_date, Certificate.donation_id,
+        Donation.tree_count, db.func.coalesce(Location.name, Donation.location_id).label('location')
+    ).join(Donation, Donation.id == Certificate.donation_id) \
+        .outerjoin(Location, Location.id == Donation.location_id) \
+        .filter(Donation.user_id == current_user.id)
+    query = apply_keyset(query, Certificate, Certificate.created_date, cursor)
+    rows, next_cursor = fetch_page(query, limit, lambda row: row.id)
+
+    response = jsonify([serialize_user_certificate(*row) for row in rows])
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
+
+@app.route('/api/users/me/dashboard', methods=['GET'])
+@token_required
+def get_user_dashboard(current_user):
+    """Donations, certificates and totals for the cabinet in a constant number of queries"""
+    limit, cursor = get_page_args()
+    query = apply_keyset(user_donations_query(current_user.id), Donation, Donation.created_at, cursor)
+    rows, next_cursor = fetch_page(query, limit, lambda row: row.Donation.id)
+
+    donations_count, trees_planted, total_amount = db.session.query(
+        db.func.count(Donation.id),
+        db.func.coalesce(db.func.sum(Donation.tree_count), 0),
+        db.func.coalesce(db.func.sum(Donation.amount), 0)
+    ).filter(Donation.user_id == current_user.id).one()
+
+    certificates = [
+        serialize_user_certificate(
+            row.certificate_id, row.certificate_date, row.Donation.id,
+            row.Donation.tree_count, row.location_name or row.Donation.location_id
+        )
+        for row in rows if row.certificate_id
+    ]
+    return jsonify({
+        'donations': [serialize_user_donation(row) for row in rows],
+        'certificates': certificates,
+        'totals': {
+            'donations_count': donations_count,
+            'trees_planted': trees_planted,
+            'total_amount': total_amount
+        },
+        'next_cursor': next_cursor
+    })
 
 # Decorator for admin-only routes
 def admin_required(f):
@@ -774,7 +1589,9 @@ def admin_required(f):
 
         try:
             data = jwt.decode(token, app.config['SECRET_KEY'], algorithms=["HS256"])
-            current_user = User.query.filter_by(id=data['id']).first()
+            current_user = load_principal(data['id'])
+            if not current_user:
+                return jsonify({'message': 'Token is invalid!'}), 401
             if current_user.role != 'admin':
                 return jsonify({'message': 'Admin role required!'}), 403
         except jwt.ExpiredSignatureError:
@@ -791,38 +1608,81 @@ def admin_required(f):
 @app.route('/api/admin/donations', methods=['GET'])
 @admin_required
 def admin_get_donations(current_user):
-    # For now, we'll just return all donations without pagination
-    donations = Donation.query.all()
-    output = []
-    for donation in donations:
-        user = User.query.get(donation.user_id)
-        location = Location.query.get(donation.location_id)
-        
-        # Handle case where user or location might not exist
-        # For guest donations, use donor_info from the donation itself
-        if user:
-            donor_name = user.full_name
-            email = user.email
-        elif donation.email:  # Guest donation with email
-            donor_name = donation.donor_info.get('full_name', 'Guest Donor') if donation.donor_info else 'Guest Donor'
-            email = donation.email
-        else:  # Fallback for any other case
-            donor_name = 'Unknown User'
-            email = 'Unknown Email'
-        location_name = location.name if location else 'Unknown Location'
-        
-        donation_data = {
-            'id': donation.id,
-            'donor_name': donor_name,
-            'email': email,
-            'location': location_name,
-            'trees': donation.tree_count,
-            'amount': donation.amount,
-            'status': donation.status,
-            'date': donation.created_at.isoformat() + 'Z'
-        }
-        output.append(donation_data)
-    return jsonify({'donations': output})
+    limit, cursor = get_page_args(DEFAULT_PAGE_SIZE)
+    try:
+        query = filter_admin_donations(admin_donations_query(), request.args)
+    except ValueError:
+        return jsonify({'message': 'Invalid date format, expected YYYY-MM-DD'}), 400
+
+    query = apply_keyset(query, Donation, Donation.created_at, cursor)
+    stream_format = get_stream_format()
+    if stream_format:
+        return stream_rows(query, serialize_admin_donation, stream_format)
+
+    rows, next_cursor = fetch_page(query, limit, lambda row: row.Donation.id)
+    return jsonify({
+        'donations': [serialize_admin_donation(row) for row in rows],
+        'next_cursor': next_cursor
+    })
+
+def admin_donations_query():
+    """Donations with donor and location names pulled in by a single join"""
+    return db.session.query(
+        Donation,
+        User.full_name.label('user_name'),
+        User.email.label('user_email'),
+        Location.name.label('location_name')
+    ).outerjoin(User, User.id == Donation.user_id) \
+        .outerjoin(Location, Location.id == Donation.location_id)
+
+def parse_date_arg(value, end_of_day=False):
+    """Parse a YYYY-MM-DD (or full ISO) query argument, raising ValueError if malformed"""
+    if len(value) == 10:
+        date = datetime.datetime.combine(datetime.date.fromisoformat(value), datetime.time.min)
+        return date + datetime.timedelta(days=1) if end_of_day else date
+    return datetime.datetime.fromisoformat(value.replace('Z', ''))
+
+def filter_admin_donations(query, args):
+    """Apply the status, location, date range and email filters of the admin list"""
+    if args.get('status'):
+        query = query.filter(Donation.status == args['status'])
+    if args.get('location_id'):
+        query = query.filter(Donation.location_id == args['location_id'])
+    if args.get('date_from'):
+        query = query.filter(Donation.created_at >= parse_date_arg(args['date_from']))
+    if args.get('date_to'):
+        query = query.filter(Donation.created_at < parse_date_arg(args['date_to'], end_of_day=True))
+    if args.get('email'):
+        # Prefix match on the guest address or the donor account's, so either
+        # side can use its index on lower(email). The query must join User
+        prefix = args['email'].strip().lower() + '%'
+        query = query.filter(db.or_(db.func.lower(Donation.email).like(prefix),
+                                    db.func.lower(User.email).like(prefix)))
+    return query
+
+def serialize_admin_donation(row):
+    donation = row.Donation
+    # For guest donations, use donor_info from the donation itself
+    if row.user_email:
+        donor_name = row.user_name
+        email = row.user_email
+    elif donation.email:  # Guest donation with email
+        donor_name = donation.donor_info.get('full_name', 'Guest Donor') if donation.donor_info else 'Guest Donor'
+        email = donation.email
+    else:  # Fallback for any other case
+        donor_name = 'Unknown User'
+        email = 'Unknown Email'
+
+    return {
+        'id': donation.id,
+        'donor_name': donor_name,
+        'email': email,
+        'location': row.location_name or 'Unknown Location',
+        'trees': donation.tree_count,
+        'amount': donation.amount,
+        'status': donation.status,
+        'date': donation.created_at.isoformat() + 'Z'
+    }
 
 @app.route('/api/admin/donations/<string:donation_id>', methods=['PUT'])
 @admin_required
@@ -830,32 +1690,92 @@ def admin_update_donation(current_user, donation_id):
     donation = Donation.query.get_or_404(donation_id)
     data = request.get_json()
     donation.status = data.get('status', donation.status)
+    if donation.status == 'completed':
+        # Completed outside the payment flow: render its certificate in the background
+        enqueue_certificate_render(donation.id)
     db.session.commit()
+    certificate_worker.wake()
+    donation_notifier.publish(donation.id)
     return jsonify({'message': 'Donation updated successfully'})
 
 @app.route('/api/admin/users', methods=['GET'])
 @admin_required
 def admin_get_users(current_user):
-    # For now, we'll just return all users without pagination
-    users = User.query.all()
-    output = []
-    for user in users:
-        donations = Donation.query.filter_by(user_id=user.id).all()
-        user_data = {
-            'id': user.id,
-            'name': user.full_name,
-            'email': user.email,
-            'phone': user.phone or '',
-            'company_name': user.company_name or '',
-            'donations_count': len(donations),
-            'trees_planted': sum(d.tree_count for d in donations),
-            'total_amount': sum(d.amount for d in donations),
-            'status': 'active',  # Placeholder
-            'joined_date': user.created_at.isoformat() + 'Z',
-            'role': user.role
-        }
-        output.append(user_data)
-    return jsonify({'users': output})
+    limit, cursor = get_page_args(DEFAULT_PAGE_SIZE)
+    sort = request.args.get('sort', 'joined_date')
+    if sort not in USER_SORT_FIELDS:
+        return jsonify({'message': f"Unsupported sort field, expected one of: {', '.join(USER_SORT_FIELDS)}"}), 400
+    descending = request.args.get('order', 'desc') != 'asc'
+
+    # One LEFT JOIN + GROUP BY produces the per-user totals
+    sort_columns = user_directory_columns(User, Donation)
+    query = db.session.query(
+        User,
+        sort_columns['donations_count'].label('donations_count'),
+        sort_columns['trees_planted'].label('trees_planted'),
+        sort_columns['total_amount'].label('total_amount')
+    ).outerjoin(Donation, Donation.user_id == User.id).group_by(User.id)
+
+    search = request.args.get('q', '').strip().lower()
+    if search:
+        query = query.filter(db.or_(
+            db.func.lower(User.full_name).like(search + '%'),
+            db.func.lower(User.email).like(search + '%')
+        ))
+
+    sort_column = sort_columns[sort]
+    if cursor:
+        anchor_user = db.aliased(User)
+        anchor_donation = db.aliased(Donation)
+        anchor = db.session.query(user_directory_columns(anchor_user, anchor_donation)[sort]) \
+            .select_from(anchor_user) \
+            .outerjoin(anchor_donation, anchor_donation.user_id == anchor_user.id) \
+            .filter(anchor_user.id == cursor) \
+            .group_by(anchor_user.id) \
+            .scalar_subquery()
+        condition = keyset_condition(sort_column, anchor, User.id, cursor, descending)
+        query = query.having(condition) if sort in USER_AGGREGATE_FIELDS else query.filter(condition)
+    if descending:
+        query = query.order_by(sort_column.desc(), User.id.desc())
+    else:
+        query = query.order_by(sort_column.asc(), User.id.asc())
+
+    stream_format = get_stream_format()
+    if stream_format:
+        return stream_rows(query, serialize_admin_user, stream_format)
+
+    rows, next_cursor = fetch_page(query, limit, lambda row: row.User.id)
+    return jsonify({'users': [serialize_admin_user(row) for row in rows], 'next_cursor': next_cursor})
+
+def serialize_admin_user(row):
+    user = row.User
+    return {
+        'id': user.id,
+        'name': user.full_name,
+        'email': user.email,
+        'phone': user.phone or '',
+        'company_name': user.company_name or '',
+        'donations_count': row.donations_count,
+        'trees_planted': row.trees_planted,
+        'total_amount': row.total_amount,
+        'status': 'active',  # Placeholder
+        'joined_date': user.created_at.isoformat() + 'Z',
+        'role': user.role
+    }
+
+USER_AGGREGATE_FIELDS = ('donations_count', 'trees_planted', 'total_amount')
+USER_SORT_FIELDS = ('joined_date', 'name', 'email') + USER_AGGREGATE_FIELDS
+
+def user_directory_columns(user, donation):
+    """Sortable columns of the admin user directory, built on the given aliases"""
+    return {
+        'joined_date': user.created_at,
+        'name': db.func.coalesce(user.full_name, ''),
+        'email': user.email,
+        'donations_count': db.func.count(donation.id),
+        'trees_planted': db.func.coalesce(db.func.sum(donation.tree_count), 0),
+        'total_amount': db.func.coalesce(db.func.sum(donation.amount), 0)
+    }
 
 @app.route('/api/admin/users/<string:user_id>', methods=['PUT'])
 @admin_required
@@ -868,10 +1788,12 @@ def admin_update_user(current_user, user_id):
         user.full_name = data['full_name']
     if 'email' in data:
         # Check if email is already taken by another user
-        existing_user = User.query.filter(User.email == data['email'], User.id != user_id).first()
+        existing_user = User.query.filter(db.func.lower(User.email) == data['email'].lower(), User.id != user_id).first()
         if existing_user:
             return jsonify({'message': 'Email already exists'}), 400
-        user.email = data['email']
+        if user.email != data['email']:
+            user.email = data['email']
+            link_guest_donations(user, relink=True)
     if 'phone' in data:
         user.phone = data['phone']
     if 'company_name' in data:
@@ -882,6 +1804,7 @@ def admin_update_user(current_user, user_id):
             user.role = data['role']
     
     db.session.commit()
+    principal_cache.invalidate(user.id)
     return jsonify({'message': 'User updated successfully'})
 
 @app.route('/api/admin/users/<string:user_id>', methods=['DELETE'])
@@ -895,6 +1818,7 @@ def admin_delete_user(current_user, user_id):
     
     db.session.delete(user)
     db.session.commit()
+    principal_cache.invalidate(user_id)
     return jsonify({'message': 'User deleted successfully'})
 
 @app.route('/api/admin/users', methods=['POST'])
@@ -907,12 +1831,11 @@ def admin_create_user(current_user):
         return jsonify({'message': 'Full name, email, and password are required'}), 400
     
     # Check if user already exists
-    existing_user = User.query.filter_by(email=data['email']).first()
+    existing_user = find_user_by_email(data['email'])
     if existing_user:
         return jsonify({'message': 'User with this email already exists'}), 400
     
-    # Hash password with stronger settings
-    hashed_password = generate_password_hash(data['password'], method='pbkdf2:sha256', salt_length=12)
+    hashed_password = password_policy.hash(data['password'])
     
     # Create new user
     new_user = User(
@@ -929,32 +1852,89 @@ def admin_create_user(current_user):
     db.session.commit()
     return jsonify({'message': 'User created successfully', 'user_id': new_user.id}), 201
 
+@app.route('/api/admin/stats/principal-cache', methods=['GET'])
+@admin_required
+def admin_get_principal_cache_stats(current_user):
+    # Per worker process: each gunicorn worker keeps its own cache
+    stats = principal_cache.stats()
+    stats['pid'] = os.getpid()
+    return jsonify(stats)
+
+@app.route('/api/admin/stats/ioka', methods=['GET'])
+@admin_required
+def admin_get_ioka_stats(current_user):
+    # Per worker process: call latency of this worker's Ioka session
+    if not IOKA_ENABLED:
+        return jsonify({'message': 'Ioka payment gateway is not configured'}), 503
+    return jsonify({'pid': os.getpid(), 'operations': ioka_service.stats()})
+
+# Prometheus scrape endpoint; set METRICS_TOKEN to require "Authorization: Bearer <token>"
+from prometheus_client.core import GaugeMetricFamily
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+def queue_depth_metrics():
+    """Backlogs shared by every worker, read from the database at scrape time"""
+    jobs = GaugeMetricFamily('certificate_render_queue', 'Certificate render jobs not yet done, by status',
+                             labels=['status'])
+    counts = dict(db.session.query(CertificateRenderJob.status, db.func.count())
+                  .filter(CertificateRenderJob.status.in_(['queued', 'rendering', 'failed']))
+                  .group_by(CertificateRenderJob.status).all())
+    for status in ('queued', 'rendering', 'failed'):
+        jobs.add_metric([status], counts.get(status, 0))
+    yield jobs
+
+    awaiting = db.session.query(db.func.count(Donation.id)).filter(Donation.status == 'awaiting_payment').scalar()
+    yield GaugeMetricFamily('donations_awaiting_payment', 'Donations waiting for their Ioka payment to settle',
+                            value=awaiting)
+
+    pending = db.session.query(db.func.count(WebhookEvent.id)).filter(WebhookEvent.status == 'pending').scalar()
+    yield GaugeMetricFamily('webhook_inbox_pending', 'Stored webhook events not yet applied', value=pending)
+
+metrics_exporter.add_collector(queue_depth_metrics)
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    if METRICS_TOKEN and not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {METRICS_TOKEN}'):
+        return jsonify({'message': 'Token is invalid!'}), 401
+    return app.response_class(metrics_exporter.render(), mimetype=None, content_type=metrics_exporter.content_type)
+
 @app.route('/api/admin/reports/donations-summary', methods=['GET'])
 @admin_required
 def admin_get_donations_summary(current_user):
-    total_donations = Donation.query.count()
-    processing_count = Donation.query.filter_by(status='processing').count()
-    pending_count = Donation.query.filter_by(status='pending').count()
-    total_revenue = db.session.query(db.func.sum(Donation.amount)).scalar()
-    trees_planted = db.session.query(db.func.sum(Donation.tree_count)).scalar()
-    
-    locations = Location.query.all()
+    # One read of the rollup, plus every location so empty ones are listed too
+    summary_rows = db.session.query(
+        Location.id.label('location_key'), Location.name, DonationSummary.status,
+        DonationSummary.donations, DonationSummary.trees, DonationSummary.revenue
+    ).select_from(DonationSummary).outerjoin(Location, Location.id == DonationSummary.location_id)
+    empty_locations = db.session.query(
+        Location.id, Location.name, db.null(), db.literal(0), db.literal(0), db.literal(0)
+    )
+    rows = summary_rows.union_all(empty_locations).all()
+
     by_location = {}
-    for location in locations:
-        donations = Donation.query.filter_by(location_id=location.id).all()
-        by_location[location.name] = {
-            'donations': len(donations),
-            'trees': sum(d.tree_count for d in donations),
-            'revenue': sum(d.amount for d in donations)
-        }
-        
+    by_status = {}
+    total_donations = total_revenue = trees_planted = 0
+    for location_key, location_name, status, donations, trees, revenue in rows:
+        if location_key is not None:
+            location_totals = by_location.setdefault(location_name, {'donations': 0, 'trees': 0, 'revenue': 0})
+            location_totals['donations'] += donations
+            location_totals['trees'] += trees
+            location_totals['revenue'] += revenue
+        if status is None:
+            continue
+        by_status[status] = by_status.get(status, 0) + donations
+        total_donations += donations
+        total_revenue += revenue
+        trees_planted += trees
+
     response = {
         "total_donations": total_donations,
-        "processing_count": processing_count,
-        "pending_count": pending_count,
+        "processing_count": by_status.get('processing', 0),
+        "pending_count": by_status.get('pending', 0),
         "total_revenue": total_revenue,
         "trees_planted": trees_planted,
-        "by_location": by_location
+        "by_location": by_location,
+        "by_status": by_status
     }
     return jsonify(response)
 
@@ -963,22 +1943,24 @@ def admin_get_donations_summary(current_user):
 @app.route('/api/admin/locations', methods=['GET'])
 @admin_required
 def admin_get_locations(current_user):
-    locations = Location.query.all()
-    output = []
-    for location in locations:
-        location_data = {
-            'id': location.id,
-            'name': location.name,
-            'description': location.description,
-            'area_hectares': location.area_hectares,
-            'coordinates': location.coordinates,
-            'image_url': location.image_url,
-            'status': location.status,
-            'capacity_trees': location.capacity_trees,
-            'planted_trees': location.planted_trees
-        }
-        output.append(location_data)
-    return jsonify({'locations': output})
+    query = Location.query.order_by(Location.id)
+    stream_format = get_stream_format()
+    if stream_format:
+        return stream_rows(query, serialize_admin_location, stream_format)
+    return jsonify({'locations': [serialize_admin_location(location) for location in query]})
+
+def serialize_admin_location(location):
+    return {
+        'id': location.id,
+        'name': location.name,
+        'description': location.description,
+        'area_hectares': location.area_hectares,
+        'coordinates': location.coordinates,
+        'image_url': location.image_url,
+        'status': location.status,
+        'capacity_trees': location.capacity_trees,
+        'planted_trees': location.planted_trees
+    }
 
 @app.route('/api/admin/locations', methods=['POST'])
 @admin_required
@@ -1044,22 +2026,24 @@ def admin_delete_location(current_user, location_id):
 # News endpoints
 @app.route('/api/news', methods=['GET'])
 def get_news():
-    # Get all published news, ordered by creation date (newest first)
-    news_items = News.query.filter_by(published=True).order_by(News.created_at.desc()).all()
-    output = []
-    for news in news_items:
-        news_data = {
-            'id': news.id,
-            'title': news.title,
-            'content': news.content,
-            'image_url': news.image_url,
-            'author': news.author,
-            'created_at': news.created_at.isoformat() + 'Z',
-            'updated_at': news.updated_at.isoformat() + 'Z' if news.updated_at else None,
-            'category': news.category
-        }
-        output.append(news_data)
-    return jsonify(output)
+    def build():
+        # Get all published news, ordered by creation date (newest first)
+        news_items = News.query.filter_by(published=True).order_by(News.created_at.desc()).all()
+        output = []
+        for news in news_items:
+            news_data = {
+                'id': news.id,
+                'title': news.title,
+                'content': news.content,
+                'image_url': news.image_url,
+                'author': news.author,
+                'created_at': news.created_at.isoformat() + 'Z',
+                'updated_at': news.updated_at.isoformat() + 'Z' if news.updated_at else None,
+                'category': news.category
+            }
+            output.append(news_data)
+        return output
+    return catalog_response('news', build)
 
 @app.route('/api/news/<string:news_id>', methods=['GET'])
 def get_news_detail(news_id):
@@ -1073,7 +2057,7 @@ def get_news_detail(news_id):
             if not token:
                 return jsonify({'message': 'Authentication required'}), 401
             data = jwt.decode(token, app.config['SECRET_KEY'], algorithms=["HS256"])
-            current_user = User.query.filter_by(id=data['id']).first()
+            current_user = load_principal(data['id'])
             if not current_user or current_user.role != 'admin':
                 return jsonify({'message': 'Admin access required'}), 403
         except jwt.ExpiredSignatureError:
@@ -1098,22 +2082,24 @@ def get_news_detail(news_id):
 @admin_required
 def admin_get_all_news(current_user):
     # Admin can see all news (published and unpublished)
-    news_items = News.query.order_by(News.created_at.desc()).all()
-    output = []
-    for news in news_items:
-        news_data = {
-            'id': news.id,
-            'title': news.title,
-            'content': news.content,
-            'image_url': news.image_url,
-            'author': news.author,
-            'created_at': news.created_at.isoformat() + 'Z',
-            'updated_at': news.updated_at.isoformat() + 'Z' if news.updated_at else None,
-            'published': news.published,
-            'category': news.category
-        }
-        output.append(news_data)
-    return jsonify(output)
+    query = News.query.order_by(News.created_at.desc())
+    stream_format = get_stream_format()
+    if stream_format:
+        return stream_rows(query, serialize_admin_news, stream_format)
+    return jsonify([serialize_admin_news(news) for news in query])
+
+def serialize_admin_news(news):
+    return {
+        'id': news.id,
+        'title': news.title,
+        'content': news.content,
+        'image_url': news.image_url,
+        'author': news.author,
+        'created_at': news.created_at.isoformat() + 'Z',
+        'updated_at': news.updated_at.isoformat() + 'Z' if news.updated_at else None,
+        'published': news.published,
+        'category': news.category
+    }
 
 @app.route('/api/admin/news', methods=['POST'])
 @admin_required
@@ -1231,7 +2217,7 @@ def get_transparency_reports():
             'description': 'Интервью с участником проекта'
         }
     ]
-    return jsonify(reports)
+    return static_catalog_response(reports)
 
 # Contact form endpoint
 @app.route('/api/contact', methods=['POST'])
@@ -1244,28 +2230,19 @@ def submit_contact_form():
         if not data.get(field):
             return jsonify({'message': f'Поле {field} обязательно'}), 400
     
-    # Here you would typically send an email or save to a database
-    # For now, we'll just log the submission
-    print(f"Contact form received: {data}")
-    
-    # In a real application, you would save this to a database
-    # For now, we'll store in memory
-    if not hasattr(submit_contact_form, 'submissions'):
-        submit_contact_form.submissions = []
-    
     submission = {
         'id': f"contact_{int(time.time())}_{uuid.uuid4().hex[:8]}",
         'name': data.get('name'),
         'email': data.get('email'),
         'phone': data.get('phone', ''),
         'message': data.get('message'),
-        'created_at': datetime.datetime.utcnow().isoformat() + 'Z'
+        'created_at': datetime.datetime.utcnow()
     }
-    
-    submit_contact_form.submissions.append(submission)
+    if not save_form_row(ContactSubmission, submission):
+        return jsonify({'message': FORM_BUSY_MESSAGE}), 503
     
     # Here you would typically send an email notification
-    print(f"Contact submission saved: {submission}")
+    app.logger.info(f"Contact submission saved: {submission['id']}")
     
     return jsonify({'message': 'Сообщение успешно отправлено'}), 200
 
@@ -1279,7 +2256,6 @@ def submit_partnership_inquiry():
         if not data.get(field):
             return jsonify({'message': f'Поле {field} обязательно'}), 400
     
-    # Create partnership inquiry object
     inquiry = {
         'id': f"inquiry_{int(time.time())}_{uuid.uuid4().hex[:8]}",
         'company_name': data.get('companyName'),
@@ -1288,50 +2264,63 @@ def submit_partnership_inquiry():
         'phone': data.get('phone', ''),
         'partnership_type': data.get('partnershipType', ''),
         'message': data.get('message', ''),
-        'created_at': datetime.datetime.utcnow().isoformat() + 'Z',
+        'created_at': datetime.datetime.utcnow(),
         'status': 'pending'  # Default status
     }
-    
-    # In a real application, you would save this to the database
-    # For now, we'll store in memory
-    if not hasattr(submit_partnership_inquiry, 'inquiries'):
-        submit_partnership_inquiry.inquiries = []
-    
-    submit_partnership_inquiry.inquiries.append(inquiry)
+    if not save_form_row(PartnershipInquiry, inquiry):
+        return jsonify({'message': FORM_BUSY_MESSAGE}), 503
     
     # Here you would typically send an email notification
-    print(f"Partnership inquiry received: {inquiry}")
+    app.logger.info(f"Partnership inquiry received: {inquiry['id']}")
     
     return jsonify({'message': 'Заявка на партнерство успешно отправлена', 'inquiry_id': inquiry['id']}), 200
 
 @app.route('/api/admin/partnership-inquiries', methods=['GET'])
 @admin_required
 def admin_get_partnership_inquiries(current_user):
-    # Retrieve all partnership inquiries
-    if hasattr(submit_partnership_inquiry, 'inquiries'):
-        inquiries = submit_partnership_inquiry.inquiries
-    else:
-        inquiries = []
-    
-    # Sort by creation date (newest first)
-    sorted_inquiries = sorted(inquiries, key=lambda x: x['created_at'], reverse=True)
-    
-    return jsonify(sorted_inquiries)
+    # Newest first, one page at a time (ix_partnership_inquiry_created_at / _status_created_at)
+    limit, cursor = get_page_args(DEFAULT_PAGE_SIZE)
+    query = PartnershipInquiry.query
+    if request.args.get('status'):
+        query = query.filter(PartnershipInquiry.status == request.args['status'])
+    query = apply_keyset(query, PartnershipInquiry, PartnershipInquiry.created_at, cursor)
+    rows, next_cursor = fetch_page(query, limit, lambda row: row.id)
+
+    response = jsonify([{
+        'id': inquiry.id,
+        'company_name': inquiry.company_name,
+        'contact_person': inquiry.contact_person,
+        'email': inquiry.email,
+        'phone': inquiry.phone,
+        'partnership_type': inquiry.partnership_type,
+        'message': inquiry.message,
+        'created_at': inquiry.created_at.isoformat() + 'Z',
+        'status': inquiry.status
+    } for inquiry in rows])
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
 
 
 @app.route('/api/admin/contact-submissions', methods=['GET'])
 @admin_required
 def admin_get_contact_submissions(current_user):
-    # Retrieve all contact form submissions
-    if hasattr(submit_contact_form, 'submissions'):
-        submissions = submit_contact_form.submissions
-    else:
-        submissions = []
-    
-    # Sort by creation date (newest first)
-    sorted_submissions = sorted(submissions, key=lambda x: x['created_at'], reverse=True)
-    
-    return jsonify(sorted_submissions)
+    # Newest first, one page at a time (ix_contact_submission_created_at)
+    limit, cursor = get_page_args(DEFAULT_PAGE_SIZE)
+    query = apply_keyset(ContactSubmission.query, ContactSubmission, ContactSubmission.created_at, cursor)
+    rows, next_cursor = fetch_page(query, limit, lambda row: row.id)
+
+    response = jsonify([{
+        'id': submission.id,
+        'name': submission.name,
+        'email': submission.email,
+        'phone': submission.phone,
+        'message': submission.message,
+        'created_at': submission.created_at.isoformat() + 'Z'
+    } for submission in rows])
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
 
 # Ioka Webhook Endpoint
 @app.route('/api/webhooks/ioka', methods=['POST'])
@@ -1359,106 +2348,117 @@ def ioka_webhook():
         if not donation_id:
             return jsonify({'message': 'Missing external_id'}), 400
         
-        # Find donation
-        donation = Donation.query.filter_by(id=donation_id).first()
-        if not donation:
-            return jsonify({'message': 'Donation not found'}), 404
-        
-        # Handle different event types
-        if event_type == 'payment.succeeded':
-            # Payment successful - mark donation as completed
-            donation.status = 'completed'
-            
-            # Create certificate if it doesn't exist
-            existing_certificate = Certificate.query.filter_by(donation_id=donation.id).first()
-            if not existing_certificate:
-                # Generate physical PDF
-                pdf_path = generate_certificate_pdf(donation)
-                
-                new_certificate = Certificate(
-                    id=str(uuid.uuid4()),
-                    donation_id=donation.id,
-                    pdf_url=pdf_path or f"/certificates/{donation.id}.pdf"
-                )
-                db.session.add(new_certificate)
-            
-            db.session.commit()
-            print(f"Payment succeeded for donation {donation_id}")
-            
-        elif event_type == 'payment.failed':
-            # Payment failed
-            donation.status = 'failed'
-            db.session.commit()
-            print(f"Payment failed for donation {donation_id}")
-            
-        elif event_type == 'payment.cancelled':
-            # Payment cancelled
-            donation.status = 'cancelled'
-            db.session.commit()
-            print(f"Payment cancelled for donation {donation_id}")
+        # Store the delivery and acknowledge; webhook_worker applies it to the donation.
+        # A redelivery has the same key and is dropped here
+        stored = store_webhook_event(webhook_event_key(data, donation_id), donation_id, event_type,
+                                     payload.decode('utf-8'))
+        db.session.commit()
+        if stored:
+            if webhook_worker.running:
+                webhook_worker.wake()
+            else:
+                # No inbox thread in this process (tests): apply in line
+                while process_next_webhook_events():
+                    pass
         
         # Return success to Ioka
-        return jsonify({'success': True}), 200
+        return jsonify({'success': True, 'duplicate': not stored}), 200
         
     except Exception as e:
-        print(f"Webhook error: {str(e)}")
+        app.logger.exception(f"Webhook error: {str(e)}")
         return jsonify({'message': f'Webhook processing error: {str(e)}'}), 500
 
+# Certificate delivery: 'direct' sends the file from Python, 'x-accel-redirect' (nginx) and
+# 'x-sendfile' (Apache, lighttpd) only resolve it and leave the bytes to the front proxy
+CERTIFICATE_DELIVERY_MODES = ('direct', 'x-accel-redirect', 'x-sendfile')
+CERTIFICATE_DELIVERY = os.environ.get('CERTIFICATE_DELIVERY', 'direct').lower()
+if CERTIFICATE_DELIVERY not in CERTIFICATE_DELIVERY_MODES:
+    app.logger.warning(f"Unknown CERTIFICATE_DELIVERY {CERTIFICATE_DELIVERY!r}, sending certificates directly")
+    CERTIFICATE_DELIVERY = 'direct'
+CERTIFICATE_ACCEL_PREFIX = os.environ.get('CERTIFICATE_ACCEL_PREFIX', '/internal/certificates/')
+CERTIFICATE_CACHE_MAX_AGE = int(os.environ.get('CERTIFICATE_CACHE_MAX_AGE', 86400))
+CERTIFICATE_DIGEST_CACHE_SIZE = 4096
+
+_certificate_digests = {}  # file path -> ((mtime, size), sha256), per process, for old flat-layout files
+
+def certificate_etag(file_path, stat):
+    """Strong ETag from the file's content hash, rehashed only when its mtime or size changes"""
+    key = (stat.st_mtime_ns, stat.st_size)
+    cached = _certificate_digests.get(file_path)
+    if cached and cached[0] == key:
+        return cached[1]
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as pdf:
+        for chunk in iter(lambda: pdf.read(65536), b''):
+            digest.update(chunk)
+    etag = digest.hexdigest()[:32]
+    if len(_certificate_digests) >= CERTIFICATE_DIGEST_CACHE_SIZE:
+        _certificate_digests.clear()
+    _certificate_digests[file_path] = (key, etag)
+    return etag
+
+def resolve_certificate_file(filename):
+    """(absolute path, path below CERTIFICATES_DIR, ETag) of a certificate PDF, or None
+
+    Certificates in the store are found from their row, without touching the
+    filesystem; only files of the old flat layout are looked up on disk.
+    """
+    donation_id = filename[:-len('.pdf')] if filename.endswith('.pdf') else filename
+    digest = db.session.query(Certificate.file_sha256).filter(Certificate.donation_id == donation_id).scalar()
+    if digest:
+        return certificate_store.path(digest), certificate_store.key(digest), digest[:32]
+    file_path = os.path.join(CERTIFICATES_DIR, filename)
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return None
+    return file_path, filename, certificate_etag(file_path, stat)
+
 @app.route('/certificates/<path:filename>')
 @app.route('/api/certificates/<path:filename>')
 def serve_certificate(filename):
-    """Serve certificate PDF files from the static directory"""
+    """Serve a certificate PDF, or hand it to the front proxy"""
     # Remove any directory traversal or extra paths
     filename = os.path.basename(filename)
-    directory = os.path.join(app.root_path, 'static', 'certificates')
-    file_path = os.path.join(directory, filename)
-    
-    app.logger.debug(f"Serving certificate: {filename} from {directory}")
-    
-    if not os.path.exists(file_path):
-        app.logger.error(f"Certificate file not found: {file_path}")
+    app.logger.debug(f"Serving certificate: {filename}")
+
+    resolved = resolve_certificate_file(filename)
+    if not resolved:
+        app.logger.error(f"Certificate file not found: {filename}")
         return jsonify({"message": "Certificate file not found on server"}), 404
-        
-    return send_from_directory(directory, filename)
+    file_path, key, etag = resolved
+
+    if CERTIFICATE_DELIVERY == 'direct':
+        # Answers If-None-Match with 304 and Range with 206
+        try:
+            return send_file(file_path, mimetype='application/pdf', etag=etag, max_age=CERTIFICATE_CACHE_MAX_AGE)
+        except FileNotFoundError:
+            app.logger.error(f"Certificate file not found: {file_path}")
+            return jsonify({"message": "Certificate file not found on server"}), 404
+
+    if request.if_none_match and request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        # Empty body: the proxy sends the file, and answers Range requests itself
+        response = app.response_class(mimetype='application/pdf')
+        if CERTIFICATE_DELIVERY == 'x-accel-redirect':
+            response.headers['X-Accel-Redirect'] = CERTIFICATE_ACCEL_PREFIX.rstrip('/') + '/' + key
+        else:
+            response.headers['X-Sendfile'] = file_path
+        response.headers['Accept-Ranges'] = 'bytes'
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = CERTIFICATE_CACHE_MAX_AGE
+    return response
 
 @app.route('/api/donations/<string:donation_id>/status', methods=['GET'])
 def get_donation_status(donation_id):
     """Check donation status and provide info for the success page"""
+    # Read-only: the webhook and the payment reconciler move donations out of awaiting_payment
     donation = Donation.query.get_or_404(donation_id)
-    
-    # If it's still awaiting payment, we can optionally check Ioka directly 
-    # to be sure in case the webhook is delayed
-    if donation.status == 'awaiting_payment' and IOKA_ENABLED and donation.payment_order_id:
-        status_result = ioka_service.get_payment_status(donation.payment_order_id)
-        if status_result.get('success'):
-            ioka_status = status_result.get('status')
-            if ioka_status == 'PAID':
-                donation.status = 'completed'
-                # Ensure certificate is created and physical file exists
-                certificates_dir = os.path.join(app.root_path, 'static', 'certificates')
-                certificate_file = os.path.join(certificates_dir, f"{donation.id}.pdf")
-                
-                existing_certificate = Certificate.query.filter_by(donation_id=donation.id).first()
-                
-                if not existing_certificate or not os.path.exists(certificate_file):
-                    # Generate/Regenerate physical PDF
-                    pdf_path = generate_certificate_pdf(donation)
-                    
-                    if not existing_certificate:
-                        new_certificate = Certificate(
-                            id=str(uuid.uuid4()),
-                            donation_id=donation.id,
-                            pdf_url=pdf_path or f"/api/certificates/{donation.id}.pdf"
-                        )
-                        db.session.add(new_certificate)
-                db.session.commit()
-            elif ioka_status in ['CANCELLED', 'EXPIRED']:
-                donation.status = 'cancelled'
-                db.session.commit()
-            elif ioka_status == 'DECLINED':
-                donation.status = 'failed'
-                db.session.commit()
+    return jsonify(donation_status_payload(donation))
 
+def donation_status_payload(donation):
     user = User.query.get(donation.user_id) if donation.user_id else None
     is_guest = True
     has_account = False
@@ -1467,17 +2467,18 @@ def get_donation_status(donation_id):
         is_guest = (user.status == 'guest')
         has_account = (user.status == 'active')
     elif donation.email:
-        existing_user = User.query.filter_by(email=donation.email).first()
+        existing_user = find_user_by_email(donation.email)
         if existing_user:
             has_account = (existing_user.status == 'active')
             is_guest = (existing_user.status == 'guest')
 
     certificate = Certificate.query.filter_by(donation_id=donation.id).first()
+    certificate_status = certificate_render_state(donation.id, certificate)
     
     # Return frontend proxy URL instead of direct backend link
     certificate_url = f"/api/certificates/{donation.id}.pdf" if certificate else None
     
-    return jsonify({
+    return {
         'id': donation.id,
         'status': donation.status,
         'amount': donation.amount,
@@ -1486,8 +2487,365 @@ def get_donation_status(donation_id):
         'is_guest': is_guest,
         'has_account': has_account,
         'certificate_available': certificate is not None,
+        'certificate_status': certificate_status,
         'certificate_url': certificate_url
-    })
+    }
+
+# Donation event stream
+DONATION_EVENTS_TIMEOUT = float(os.environ.get('DONATION_EVENTS_TIMEOUT', 25))
+DONATION_EVENTS_MAX_TIMEOUT = 60
+DONATION_EVENTS_KEEPALIVE = 15
+
+def donation_event_id(payload):
+    return f"{payload['status']}:{payload['certificate_status'] or 'none'}"
+
+def donation_settled(payload):
+    """Nothing more will happen: payment failed or was cancelled, or the certificate is final"""
+    if payload['status'] == 'completed':
+        return payload['certificate_status'] != 'rendering'
+    return payload['status'] in ('failed', 'cancelled')
+
+def read_donation_state(donation_id):
+    """Fresh status payload, releasing the database connection before the caller waits"""
+    try:
+        donation = db.session.get(Donation, donation_id)
+        return donation_status_payload(donation) if donation else None
+    finally:
+        db.session.close()
+
+@app.route('/api/donations/<string:donation_id>/events', methods=['GET'])
+def get_donation_events(donation_id):
+    """Hold the request until the donation changes, as Server-Sent Events or a long-poll"""
+    Donation.query.get_or_404(donation_id)
+    timeout = min(max(request.args.get('timeout', DONATION_EVENTS_TIMEOUT, type=float), 0), DONATION_EVENTS_MAX_TIMEOUT)
+    since = request.headers.get('Last-Event-ID') or request.args.get('since')
+    deadline = time.monotonic() + timeout
+
+    if request.accept_mimetypes.best == 'text/event-stream':
+        def stream():
+            last_event_id = since
+            yield f"retry: {int(donation_notifier.poll_interval * 1000)}\n\n"
+            with donation_notifier.subscribe(donation_id) as subscription:
+                while True:
+                    subscription.clear()
+                    payload = read_donation_state(donation_id)
+                    if payload is None:
+                        return
+                    event_id = donation_event_id(payload)
+                    if event_id != last_event_id:
+                        yield f"id: {event_id}\nevent: status\ndata: {json.dumps(payload)}\n\n"
+                        last_event_id = event_id
+                    remaining = deadline - time.monotonic()
+                    if donation_settled(payload):
+                        yield "event: end\ndata: {}\n\n"
+                        return
+                    if remaining <= 0:
+                        return
+                    if not subscription.wait(min(remaining, DONATION_EVENTS_KEEPALIVE)):
+                        yield ": keep-alive\n\n"
+
+        response = app.response_class(stream_with_context(stream()), mimetype='text/event-stream')
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['X-Accel-Buffering'] = 'no'  # let nginx pass events through unbuffered
+        return response
+
+    with donation_notifier.subscribe(donation_id) as subscription:
+        while True:
+            subscription.clear()
+            payload = read_donation_state(donation_id)
+            if payload is None:
+                return jsonify({'message': 'Donation not found'}), 404
+            remaining = deadline - time.monotonic()
+            if donation_event_id(payload) != since or donation_settled(payload) or remaining <= 0:
+                payload['event_id'] = donation_event_id(payload)
+                return jsonify(payload)
+            subscription.wait(remaining)
+
+
+@app.cli.command('rebuild-donation-summary')
+@click.option('--check', is_flag=True, help='Only report drift, leave the rollup untouched.')
+def rebuild_donation_summary(check):
+    """Recompute the donation summary rollup from scratch and report drift"""
+    if db.engine.dialect.name == 'postgresql' and not check:
+        # Hold off concurrent donation writes so the rebuilt rollup is exact
+        db.session.execute(db.text('LOCK TABLE donation IN SHARE MODE'))
+
+    expected = compute_donation_summary()
+    actual = {
+        (row.location_id, row.status): (row.donations, row.trees, row.revenue)
+        for row in DonationSummary.query.all()
+    }
+    drift = sorted(key for key in expected.keys() | actual.keys()
+                   if expected.get(key, (0, 0, 0)) != actual.get(key, (0, 0, 0)))
+    for location_id, status in drift:
+        click.echo(f"Drift at location={location_id or '-'} status={status or '-'}: "
+                   f"rollup {actual.get((location_id, status), (0, 0, 0))}, "
+                   f"donations {expected.get((location_id, status), (0, 0, 0))}")
+
+    if check:
+        click.echo(f"{len(drift)} drifted rollup rows")
+        db.session.rollback()
+        sys.exit(1 if drift else 0)
+
+    DonationSummary.query.delete()
+    db.session.add_all([
+        DonationSummary(location_id=location_id, status=status, donations=donations, trees=trees, revenue=revenue)
+        for (location_id, status), (donations, trees, revenue) in expected.items()
+    ])
+    db.session.commit()
+    click.echo(f"Donation summary rebuilt: {len(expected)} rows, {len(drift)} corrected")
+
+
+@app.cli.command('link-guest-donations')
+def link_guest_donations_command():
+    """Attach every unowned donation to the account with its email and mark all accounts as linked"""
+    same_email = db.func.lower(User.email) == db.func.lower(Donation.email)
+    owner = db.session.query(User.id).filter(same_email).order_by(User.created_at, User.id) \
+        .limit(1).scalar_subquery()
+    linked = Donation.query.filter(
+        Donation.user_id.is_(None), Donation.email.isnot(None),
+        db.exists().where(same_email)
+    ).update({'user_id': owner}, synchronize_session=False)
+    marked = User.query.filter(User.guest_donations_linked_at.is_(None)) \
+        .update({'guest_donations_linked_at': datetime.datetime.utcnow()}, synchronize_session=False)
+    db.session.commit()
+    click.echo(f"Linked {linked} guest donations, marked {marked} accounts as linked")
+
+
+@app.cli.command('certificate-worker')
+@click.option('--once', is_flag=True, help='Render every due job and exit instead of polling.')
+@click.option('--poll-interval', default=2.0, show_default=True, help='Seconds to wait when the queue is empty.')
+def certificate_worker_command(once, poll_interval):
+    """Render queued certificates in a dedicated process"""
+    rendered = 0
+    while True:
+        if process_next_certificate_job():
+            rendered += 1
+        elif once:
+            break
+        else:
+            time.sleep(poll_interval)
+    click.echo(f"Rendered {rendered} certificate jobs")
+
+
+@app.cli.command('migrate-certificates')
+@click.option('--batch-size', default=500, show_default=True, help='Certificates recorded per transaction.')
+@click.option('--keep', is_flag=True, help='Leave the flat-layout files in place after copying them.')
+def migrate_certificates_command(batch_size, keep):
+    """Move <donation_id>.pdf files of the flat layout into the certificate store"""
+    moved = missing = 0
+    last_id = ''
+    while True:
+        certificates = Certificate.query.filter(Certificate.file_sha256.is_(None), Certificate.id > last_id) \
+            .order_by(Certificate.id).limit(batch_size).all()
+        if not certificates:
+            break
+        flat_files = []
+        for certificate in certificates:
+            flat_file = os.path.join(CERTIFICATES_DIR, f"{certificate.donation_id}.pdf")
+            if not os.path.exists(flat_file):
+                missing += 1
+                continue
+            stored = certificate_store.put(flat_file)
+            certificate.file_sha256, certificate.file_size = stored.digest, stored.size
+            flat_files.append(flat_file)
+        last_id = certificates[-1].id
+        db.session.commit()
+        # Only once the rows point at the stored copies
+        if not keep:
+            for flat_file in flat_files:
+                os.remove(flat_file)
+        moved += len(flat_files)
+    click.echo(f"Moved {moved} certificate files into the store, {missing} certificates have no file")
+
+
+@app.cli.command('reconcile-payments')
+@click.option('--once', is_flag=True, help='Check every due donation and exit instead of polling.')
+@click.option('--poll-interval', default=5.0, show_default=True, help='Seconds to wait when nothing is due.')
+def reconcile_payments_command(once, poll_interval):
+    """Settle awaiting_payment donations against Ioka in a dedicated process"""
+    if not IOKA_ENABLED:
+        click.echo("Ioka integration not enabled")
+        sys.exit(1)
+    checked = 0
+    while True:
+        batch = reconcile_awaiting_payments()
+        checked += batch
+        if batch < PAYMENT_RECONCILE_BATCH:
+            if once:
+                break
+            time.sleep(poll_interval)
+    click.echo(f"Checked {checked} awaiting payment donations")
+
+
+@app.cli.command('process-webhooks')
+@click.option('--once', is_flag=True, help='Apply every pending event and exit instead of polling.')
+@click.option('--poll-interval', default=2.0, show_default=True, help='Seconds to wait when the inbox is empty.')
+def process_webhooks_command(once, poll_interval):
+    """Apply stored Ioka webhook events in a dedicated process"""
+    donations = 0
+    while True:
+        if process_next_webhook_events():
+            donations += 1
+        elif once:
+            break
+        else:
+            time.sleep(poll_interval)
+    click.echo(f"Applied webhook events of {donations} donations")
+
+
+# Accounting export: one flat row per donation, streamed in created_at order
+EXPORT_COLUMNS = [
+    ('donation_id', Donation.id),
+    ('created_at', Donation.created_at),
+    ('status', Donation.status),
+    ('amount', Donation.amount),
+    ('tree_count', Donation.tree_count),
+    ('package_id', Donation.package_id),
+    ('location_id', Donation.location_id),
+    ('location_name', Location.name),
+    ('user_id', Donation.user_id),
+    ('donor_name', User.full_name),
+    ('donor_email', db.func.coalesce(User.email, Donation.email)),
+    ('company_name', User.company_name),
+    ('payment_order_id', Donation.payment_order_id),
+    ('certificate_id', Certificate.id),
+    ('certificate_issued_at', Certificate.created_date),
+]
+
+def donation_export_query(statuses=(), date_from=None, date_to=None):
+    query = db.session.query(*[column.label(name) for name, column in EXPORT_COLUMNS]) \
+        .select_from(Donation) \
+        .outerjoin(User, User.id == Donation.user_id) \
+        .outerjoin(Location, Location.id == Donation.location_id) \
+        .outerjoin(Certificate, Certificate.donation_id == Donation.id)
+    if statuses:
+        query = query.filter(Donation.status.in_(statuses))
+    query = filter_admin_donations(query, {'date_from': date_from, 'date_to': date_to})
+    return query.order_by(Donation.created_at, Donation.id)
+
+def export_value(value):
+    return value.isoformat() if isinstance(value, datetime.datetime) else value
+
+@app.cli.command('export-donations')
+@click.option('--format', 'output_format', type=click.Choice(['csv', 'jsonl']), default='csv', show_default=True)
+@click.option('--output', default='-', show_default=True, help='File to write, or - for stdout.')
+@click.option('--gzip', 'compress', is_flag=True, help='Gzip the output (implied by a .gz file name).')
+@click.option('--status', 'statuses', multiple=True, help='Only donations in this status; repeatable.')
+@click.option('--date-from', help='Created on or after this date (YYYY-MM-DD).')
+@click.option('--date-to', help='Created on or before this date (YYYY-MM-DD).')
+@click.option('--batch-size', default=1000, show_default=True, help='Rows fetched from the database at a time.')
+def export_donations(output_format, output, compress, statuses, date_from, date_to, batch_size):
+    """Stream donations with donor, location and certificate details to CSV or JSON lines"""
+    try:
+        query = donation_export_query(statuses, date_from, date_to)
+    except ValueError:
+        raise click.BadParameter('dates must be YYYY-MM-DD')
+    compress = compress or output.endswith('.gz')
+    to_stdout = output == '-'
+    raw = sys.stdout.buffer if to_stdout else open(output, 'wb')
+    binary = gzip.GzipFile(fileobj=raw, mode='wb') if compress else raw
+    stream = io.TextIOWrapper(binary, encoding='utf-8', newline='')
+    names = [name for name, _ in EXPORT_COLUMNS]
+    exported = 0
+    try:
+        if output_format == 'csv':
+            writer = csv.writer(stream)
+            writer.writerow(names)
+        # yield_per streams rows through a server-side cursor on PostgreSQL
+        for row in query.yield_per(batch_size):
+            values = [export_value(value) for value in row]
+            if output_format == 'csv':
+                writer.writerow(values)
+            else:
+                stream.write(json.dumps(dict(zip(names, values)), ensure_ascii=False) + '\n')
+            exported += 1
+    finally:
+        stream.detach()  # flushes, and leaves closing the underlying files to us
+        if compress:
+            binary.close()  # writes the gzip trailer; raw stays open
+        if to_stdout:
+            raw.flush()
+        else:
+            raw.close()
+        db.session.rollback()
+    click.echo(f"Exported {exported} donations", err=True)
+
+
+def hot_queries():
+    """The lookups app.py issues on every request of its busiest endpoints"""
+    sample = 'explain@example.com'
+    return [
+        ('user by email (login, register, guest checkout)',
+         User.query.filter(db.func.lower(User.email) == sample)),
+        ('guest donations to link',
+         Donation.query.filter(db.func.lower(Donation.email) == sample, Donation.user_id.is_(None))),
+        ('donation by payment order', Donation.query.filter_by(payment_order_id='order')),
+        ('certificate by donation', Certificate.query.filter_by(donation_id='donation')),
+        ('awaiting payment donations due for reconciliation',
+         Donation.query.filter(Donation.status == 'awaiting_payment',
+                               Donation.payment_checked_at < datetime.datetime(2024, 1, 1))
+         .order_by(Donation.payment_checked_at).limit(PAYMENT_RECONCILE_BATCH)),
+        ('admin contact submissions page',
+         apply_keyset(ContactSubmission.query, ContactSubmission, ContactSubmission.created_at, 'cursor')
+         .limit(DEFAULT_PAGE_SIZE)),
+        ('admin partnership inquiries by status',
+         apply_keyset(PartnershipInquiry.query.filter(PartnershipInquiry.status == 'pending'), PartnershipInquiry,
+                      PartnershipInquiry.created_at, None).limit(DEFAULT_PAGE_SIZE)),
+        ('due certificate render jobs',
+         CertificateRenderJob.query.filter(CertificateRenderJob.status == 'queued',
+                                           CertificateRenderJob.next_attempt_at <= datetime.datetime(2024, 1, 1))),
+        ('cabinet donations page',
+         apply_keyset(user_donations_query('user'), Donation, Donation.created_at, 'cursor').limit(DEFAULT_PAGE_SIZE)),
+        ('cabinet certificates page',
+         apply_keyset(db.session.query(Certificate.id).join(Donation, Donation.id == Certificate.donation_id)
+                      .filter(Donation.user_id == 'user'), Certificate, Certificate.created_date, 'cursor')
+         .limit(DEFAULT_PAGE_SIZE)),
+        ('admin donations page',
+         apply_keyset(admin_donations_query(), Donation, Donation.created_at, 'cursor').limit(DEFAULT_PAGE_SIZE)),
+        ('admin donations by status',
+         apply_keyset(filter_admin_donations(admin_donations_query(), {'status': 'pending'}),
+                      Donation, Donation.created_at, None).limit(DEFAULT_PAGE_SIZE)),
+        ('admin donations by location',
+         apply_keyset(filter_admin_donations(admin_donations_query(), {'location_id': 'location'}),
+                      Donation, Donation.created_at, None).limit(DEFAULT_PAGE_SIZE)),
+        ('admin donations by email prefix',
+         apply_keyset(filter_admin_donations(admin_donations_query(), {'email': 'explain'}),
+                      Donation, Donation.created_at, None).limit(DEFAULT_PAGE_SIZE)),
+    ]
+
+def explain_query(query):
+    """Return (uses_index, plan lines) for a query on the current database"""
+    dialect = db.engine.dialect
+    sql = str(query.statement.compile(dialect=dialect, compile_kwargs={'literal_binds': True}))
+    connection = db.session.connection()
+    if dialect.name == 'sqlite':
+        plan = [row[-1] for row in connection.exec_driver_sql('EXPLAIN QUERY PLAN ' + sql)]
+        full_scans = [line for line in plan if line.startswith('SCAN ') and 'USING' not in line]
+        return not full_scans, plan
+    if dialect.name == 'postgresql':
+        # Small tables make sequential scans cheaper; we want to know whether an index is usable
+        connection.exec_driver_sql('SET LOCAL enable_seqscan = off')
+        plan = [row[0] for row in connection.exec_driver_sql('EXPLAIN ' + sql)]
+        return not any('Seq Scan' in line for line in plan), plan
+    raise click.ClickException(f'EXPLAIN check is not supported on {dialect.name}')
+
+@app.cli.command('explain-hot-queries')
+@click.option('--verbose', is_flag=True, help='Print the full plan of every query.')
+def explain_hot_queries(verbose):
+    """Check with EXPLAIN that each hot query in app.py is served by an index"""
+    failures = 0
+    for name, query in hot_queries():
+        uses_index, plan = explain_query(query)
+        failures += not uses_index
+        click.echo(f"{'OK  ' if uses_index else 'SCAN'} {name}")
+        if verbose or not uses_index:
+            for line in plan:
+                click.echo(f'       {line}')
+    db.session.rollback()
+    if failures:
+        click.echo(f'{failures} hot queries are not using an index')
+        sys.exit(1)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,70 @@
+"""
+Background worker threads
+Runs a unit-of-work function repeatedly on daemon threads inside the web
+process, each iteration inside its own Flask app context
+"""
+
+import threading
+import time
+from typing import Callable, List
+
+
+class BackgroundWorker:
+    """Pool of daemon threads that call process_next() until it reports no work
+
+    process_next returns True when it handled something (the thread then
+    immediately asks for more) and False when it is idle (the thread sleeps
+    for poll_interval seconds or until wake() is called).
+    """
+
+    def __init__(self, name: str, app, process_next: Callable[[], bool], threads: int = 1,
+                 poll_interval: float = 2.0):
+        self.name = name
+        self.app = app
+        self.process_next = process_next
+        self.threads = threads
+        self.poll_interval = poll_interval
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._threads: List[threading.Thread] = []
+
+    @property
+    def running(self) -> bool:
+        return any(thread.is_alive() for thread in self._threads)
+
+    def start(self) -> None:
+        """Start the threads once per process; later calls do nothing"""
+        with self._lock:
+            if self._threads or self.threads <= 0:
+                return
+            self._stopping.clear()
+            for index in range(self.threads):
+                thread = threading.Thread(target=self._run, name=f'{self.name}-{index}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self, timeout: float = 5.0) -> None:
+        with self._lock:
+            self._stopping.set()
+            self._wakeup.set()
+            for thread in self._threads:
+                thread.join(timeout)
+            self._threads = []
+
+    def wake(self) -> None:
+        """Ask idle threads to look for work now instead of at the next poll"""
+        self._wakeup.set()
+
+    def _run(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                with self.app.app_context():
+                    did_work = self.process_next()
+            except Exception as e:
+                self.app.logger.exception(f'{self.name} iteration failed: {e}')
+                did_work = False
+                time.sleep(self.poll_interval)
+            if not did_work:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
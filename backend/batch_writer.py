@@ -0,0 +1,102 @@
+"""
+Buffered batch writer
+Group commit for small, independent inserts: request threads submit rows and
+wait while a single writer stores everything queued so far in one transaction
+"""
+
+import threading
+from collections import deque
+from typing import Any, Callable, List, Optional
+
+
+class PendingWrite:
+    """Handle returned by BatchWriter.submit(); wait() blocks until the row is stored"""
+
+    def __init__(self, item: Any):
+        self.item = item
+        self.error: Optional[Exception] = None
+        self._done = threading.Event()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """True once the row was written (re-raises the write error), False on timeout"""
+        if not self._done.wait(timeout):
+            return False
+        if self.error:
+            raise self.error
+        return True
+
+    def _finish(self, error: Optional[Exception] = None) -> None:
+        self.error = error
+        self._done.set()
+
+
+class BatchWriter:
+    """Queue of rows written in batches by write_batch(items)
+
+    drain() is the unit of work for a BackgroundWorker: it writes up to
+    max_batch queued rows in one call. If a batch fails, its rows are retried
+    one by one so a single bad row does not fail the others.
+    """
+
+    def __init__(self, write_batch: Callable[[List[Any]], None], max_batch: int = 100,
+                 on_error: Optional[Callable[[], None]] = None):
+        self.write_batch = write_batch
+        self.max_batch = max_batch
+        self.on_error = on_error
+        self._queue: deque = deque()
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.rows = 0
+
+    def submit(self, item: Any) -> PendingWrite:
+        pending = PendingWrite(item)
+        with self._lock:
+            self._queue.append(pending)
+        return pending
+
+    def withdraw(self, pending: PendingWrite) -> bool:
+        """Take a row back out of the queue; False if a drain() already picked it up"""
+        with self._lock:
+            try:
+                self._queue.remove(pending)
+            except ValueError:
+                return False
+        return True
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._queue)
+
+    def drain(self) -> bool:
+        """Write one batch; returns False when nothing was queued"""
+        with self._lock:
+            batch = [self._queue.popleft() for _ in range(min(self.max_batch, len(self._queue)))]
+        if not batch:
+            return False
+        try:
+            self.write_batch([pending.item for pending in batch])
+        except Exception:
+            self._rolled_back()
+            for pending in batch:
+                try:
+                    self.write_batch([pending.item])
+                except Exception as e:
+                    self._rolled_back()
+                    pending._finish(e)
+                else:
+                    self._written(1)
+                    pending._finish()
+        else:
+            self._written(len(batch))
+            for pending in batch:
+                pending._finish()
+        return True
+
+    def _written(self, rows: int) -> None:
+        with self._lock:
+            self.batches += 1
+            self.rows += rows
+
+    def _rolled_back(self) -> None:
+        if self.on_error:
+            self.on_error()
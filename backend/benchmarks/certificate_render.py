@@ -0,0 +1,60 @@
+"""
+Certificate rendering micro-benchmark
+Measures certificates per second with the fonts registered once per process
+(warm) against registering them for every certificate (cold), which is how
+generate_certificate_pdf used to behave. Both modes draw the whole page into
+every PDF.
+
+Usage: python benchmarks/certificate_render.py [--count 200]
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from certificate_renderer import CertificateRenderer  # noqa: E402
+
+
+def render_many(count, output_dir, shared_renderer=None):
+    started = time.perf_counter()
+    for index in range(count):
+        renderer = shared_renderer or CertificateRenderer()
+        renderer.render(
+            os.path.join(output_dir, f'bench_{index}.pdf'),
+            donor_name='Асем Нурланова',
+            tree_count=index % 50 + 1,
+            location_name='Mukhatay Ormany',
+            date_str='17.10.2026',
+            certificate_id=f'bench_{index}'
+        )
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--count', type=int, default=200, help='certificates to render per mode')
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as output_dir:
+        warm_renderer = CertificateRenderer()
+        warm_renderer.template  # exclude the one-off font load from the warm run
+        for mode, renderer in (('cold', None), ('warm', warm_renderer)):
+            elapsed = render_many(args.count, output_dir, renderer)
+            results[mode] = {
+                'certificates': args.count,
+                'seconds': round(elapsed, 3),
+                'certificates_per_second': round(args.count / elapsed, 1),
+                'ms_per_certificate': round(elapsed / args.count * 1000, 2)
+            }
+    results['speedup'] = round(results['cold']['seconds'] / results['warm']['seconds'], 2)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,418 @@
+"""
+Endpoint benchmark
+Seeds a synthetic dataset, drives the public, cabinet, admin, payment and
+webhook routes and reports latency percentiles and requests per second per
+scenario and route, as JSON that can be compared between commits.
+
+Requests go through the Flask test client by default, or over HTTP to a
+running server with --url (the server must use the same DATABASE_URL and
+SECRET_KEY). Payment and webhook scenarios use an in-process stand-in for
+Ioka with the test client; over HTTP the server's own Ioka settings apply,
+so the payment scenario is skipped unless requested with --scenarios.
+
+Usage:
+    python benchmarks/endpoints.py [--database-url sqlite:////tmp/bench.db] [--users 10000]
+        [--donations 500000] [--certificates 200000] [--requests 500] [--concurrency 8]
+        [--url http://127.0.0.1:5000] [--output results.json] [--compare baseline.json]
+"""
+
+import argparse
+import datetime
+import hashlib
+import hmac
+import json
+import math
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+SCENARIOS = ('public', 'cabinet', 'admin', 'payment', 'webhook')
+STATUSES = [('completed', 70), ('awaiting_payment', 10), ('pending', 10), ('failed', 5), ('cancelled', 5)]
+SEED_CHUNK = 5000
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--database-url', help='database to seed and query (default: a temporary SQLite file)')
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--donations', type=int, default=500000)
+    parser.add_argument('--certificates', type=int, default=200000)
+    parser.add_argument('--locations', type=int, default=20)
+    parser.add_argument('--reuse', action='store_true', help='skip seeding when the database already has users')
+    parser.add_argument('--requests', type=int, default=500, help='requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=8, help='client threads')
+    parser.add_argument('--scenarios', default=None, help=f'comma-separated subset of {",".join(SCENARIOS)}')
+    parser.add_argument('--url', help='base URL of a running server instead of the Flask test client')
+    parser.add_argument('--seed', type=int, default=1, help='random seed for data and request order')
+    parser.add_argument('--output', help='write the JSON results to this file as well as stdout')
+    parser.add_argument('--compare', help='JSON results of an earlier run to compare against')
+    return parser.parse_args()
+
+
+def weighted_statuses(rng, count):
+    names = [name for name, _ in STATUSES]
+    weights = [weight for _, weight in STATUSES]
+    return rng.choices(names, weights, k=count)
+
+
+def seed(app_module, args, rng):
+    """Bulk-insert the synthetic dataset; returns the ids the scenarios pick from"""
+    db = app_module.db
+    db.create_all()
+    if args.reuse and db.session.query(app_module.User.id).first():
+        return load_ids(app_module)
+
+    password = app_module.password_policy.hash('benchmark')
+    base = datetime.datetime(2024, 1, 1)
+    span = 2 * 365 * 24 * 3600
+
+    def insert(model, rows):
+        for start in range(0, len(rows), SEED_CHUNK):
+            db.session.execute(db.insert(model), rows[start:start + SEED_CHUNK])
+        db.session.commit()
+
+    locations = [{'id': f'loc_bench_{i:03d}', 'name': f'Benchmark grove {i}', 'status': 'active',
+                  'capacity_trees': 100000, 'planted_trees': 0} for i in range(args.locations)]
+    insert(app_module.Location, locations)
+    insert(app_module.Package, [{'id': f'pkg_bench_{n}', 'name': f'{n} trees', 'tree_count': n, 'price': n * 999,
+                                 'popular': n == 10} for n in (1, 10, 50, 100)])
+    insert(app_module.News, [{'id': f'news_bench_{i:03d}', 'title': f'Planting update {i}', 'content': 'x' * 400,
+                              'published': True, 'created_at': base + datetime.timedelta(days=i)}
+                             for i in range(50)])
+
+    users = [{'id': f'usr_bench_{i:06d}', 'full_name': f'Donor {i}', 'email': f'donor{i}@bench.example.com',
+              'password': password, 'role': 'user', 'status': 'guest' if i % 5 == 0 else 'active',
+              'created_at': base + datetime.timedelta(seconds=rng.randrange(span))} for i in range(args.users)]
+    users.append({'id': 'usr_bench_admin', 'full_name': 'Benchmark Admin', 'email': 'admin@bench.example.com',
+                  'password': password, 'role': 'admin', 'status': 'active', 'created_at': base})
+    insert(app_module.User, users)
+
+    statuses = weighted_statuses(rng, args.donations)
+    donations, certificates = [], []
+    for i in range(args.donations):
+        user = users[rng.randrange(args.users)]
+        trees = rng.choice((1, 10, 50, 100))
+        created_at = base + datetime.timedelta(seconds=rng.randrange(span))
+        donations.append({
+            'id': f'don_bench_{i:07d}', 'location_id': locations[rng.randrange(len(locations))]['id'],
+            'package_id': f'pkg_bench_{trees}', 'user_id': user['id'], 'email': user['email'],
+            'tree_count': trees, 'amount': trees * 999, 'status': statuses[i], 'created_at': created_at,
+            'payment_checked_at': created_at, 'payment_order_id': f'ord_bench_{i:07d}',
+            'donor_info': {'full_name': user['full_name'], 'email': user['email']}
+        })
+        if statuses[i] == 'completed' and len(certificates) < args.certificates:
+            certificates.append({'id': f'cert_bench_{i:07d}', 'donation_id': donations[-1]['id'],
+                                 'pdf_url': f'/certificates/don_bench_{i:07d}.pdf', 'created_date': created_at})
+        if len(donations) >= SEED_CHUNK:
+            insert(app_module.Donation, donations)
+            donations = []
+    insert(app_module.Donation, donations)
+    insert(app_module.Certificate, certificates)
+
+    # Bulk inserts bypass the flush listener that maintains the rollup
+    db.session.query(app_module.DonationSummary).delete()
+    insert(app_module.DonationSummary, [
+        {'location_id': location_id, 'status': status, 'donations': donations, 'trees': trees, 'revenue': revenue}
+        for (location_id, status), (donations, trees, revenue) in app_module.compute_donation_summary().items()
+    ])
+    return load_ids(app_module)
+
+
+def load_ids(app_module):
+    db = app_module.db
+    Donation = app_module.Donation
+    return {
+        'users': [row[0] for row in db.session.query(app_module.User.id).filter(
+            app_module.User.role == 'user').limit(2000)],
+        'admin': db.session.query(app_module.User.id).filter(app_module.User.role == 'admin').limit(1).scalar(),
+        'locations': [row[0] for row in db.session.query(app_module.Location.id)],
+        'packages': [row[0] for row in db.session.query(app_module.Package.id)],
+        'donations': [row[0] for row in db.session.query(Donation.id).order_by(Donation.created_at.desc())
+                      .limit(2000)],
+        'awaiting': [row[0] for row in db.session.query(Donation.id).filter(
+            Donation.status == 'awaiting_payment').limit(5000)],
+    }
+
+
+def token_for(app_module, user_id):
+    import jwt
+    return jwt.encode({'id': user_id, 'exp': datetime.datetime.utcnow() + datetime.timedelta(hours=2)},
+                      app_module.app.config['SECRET_KEY'], algorithm='HS256')
+
+
+class FakeIoka:
+    """Answers the payment and webhook routes instantly, so only this app is measured"""
+
+    def create_payment_order(self, amount, description, donation_id, customer_email=None, customer_name=None):
+        order_id = f'ord_{uuid.uuid4().hex[:12]}'
+        return {'success': True, 'order_id': order_id, 'checkout_url': f'https://pay.example.com/{order_id}'}
+
+    def verify_webhook_signature(self, payload, signature):
+        return True
+
+    def stats(self):
+        return {}
+
+
+def build_scenarios(app_module, ids, rng):
+    """Each scenario is a list of request factories, called round-robin: () -> (label, method, path, headers, body)"""
+    user_headers = {user_id: {'Authorization': f'Bearer {token_for(app_module, user_id)}'}
+                    for user_id in ids['users'][:200]}
+    admin_headers = {'Authorization': f'Bearer {token_for(app_module, ids["admin"])}'}
+    webhook_secret = os.environ.get('IOKA_WEBHOOK_SECRET', '')
+    awaiting = list(ids['awaiting'])
+    rng.shuffle(awaiting)
+    awaiting_lock = threading.Lock()
+
+    def any_user():
+        return user_headers[rng.choice(list(user_headers))]
+
+    def get(label, path, headers=None):
+        def make():
+            return (label, 'GET', path() if callable(path) else path,
+                    headers() if callable(headers) else headers or {}, None)
+        return make
+
+    def create_and_pay():
+        headers = any_user()
+        return ('POST /api/donations', 'POST', '/api/donations', headers, {
+            'location_id': rng.choice(ids['locations']), 'package_id': rng.choice(ids['packages']),
+            'tree_count': 10, 'amount': 9990, 'donor_info': {'full_name': 'Benchmark Donor'}
+        })
+
+    def webhook():
+        with awaiting_lock:
+            donation_id = awaiting.pop() if awaiting else rng.choice(ids['donations'])
+        body = json.dumps({'event': 'payment.succeeded', 'object': {'external_id': donation_id}}).encode()
+        signature = hmac.new(webhook_secret.encode(), body, hashlib.sha256).hexdigest() if webhook_secret else ''
+        return ('POST /api/webhooks/ioka', 'POST', '/api/webhooks/ioka',
+                {'X-Ioka-Signature': signature, 'Content-Type': 'application/json'}, body)
+
+    return {
+        'public': [
+            get('GET /api/locations', '/api/locations'),
+            get('GET /api/locations/<id>', lambda: f'/api/locations/{rng.choice(ids["locations"])}'),
+            get('GET /api/packages', '/api/packages'),
+            get('GET /api/news', '/api/news'),
+            get('GET /api/donations/<id>/status', lambda: f'/api/donations/{rng.choice(ids["donations"])}/status'),
+        ],
+        'cabinet': [
+            get('GET /api/users/me', '/api/users/me', any_user),
+            get('GET /api/users/me/donations', '/api/users/me/donations', any_user),
+            get('GET /api/users/me/certificates', '/api/users/me/certificates', any_user),
+            get('GET /api/users/me/dashboard', '/api/users/me/dashboard', any_user),
+        ],
+        'admin': [
+            get('GET /api/admin/donations', '/api/admin/donations', admin_headers),
+            get('GET /api/admin/donations?status', '/api/admin/donations?status=completed', admin_headers),
+            get('GET /api/admin/users', '/api/admin/users', admin_headers),
+            get('GET /api/admin/reports/donations-summary', '/api/admin/reports/donations-summary', admin_headers),
+        ],
+        'payment': [create_and_pay],
+        'webhook': [webhook],
+    }
+
+
+class TestClientTransport:
+    def __init__(self, app):
+        self.app = app
+        self._local = threading.local()
+
+    def send(self, method, path, headers, body):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        kwargs = {'data': body} if isinstance(body, bytes) else {'json': body}
+        response = client.open(path, method=method, headers=headers, **kwargs)
+        response.close()
+        return response.status_code, response.get_json(silent=True)
+
+
+class HttpTransport:
+    def __init__(self, base_url):
+        import requests
+        self.base_url = base_url.rstrip('/')
+        self._requests = requests
+        self._local = threading.local()
+
+    def send(self, method, path, headers, body):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = self._requests.Session()
+        kwargs = {'data': body} if isinstance(body, bytes) else {'json': body}
+        response = session.request(method, self.base_url + path, headers=headers, timeout=60, **kwargs)
+        try:
+            return response.status_code, response.json()
+        except ValueError:
+            return response.status_code, None
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile"""
+    return sorted_values[max(0, math.ceil(fraction * len(sorted_values)) - 1)]
+
+
+def summarize(samples, elapsed):
+    latencies = sorted(ms for ms, _ in samples)
+    errors = sum(1 for _, ok in samples if not ok)
+    return {
+        'requests': len(samples),
+        'errors': errors,
+        'rps': round(len(samples) / elapsed, 1) if elapsed else None,
+        'mean_ms': round(statistics.fmean(latencies), 2) if latencies else None,
+        'p50_ms': round(percentile(latencies, 0.50), 2) if latencies else None,
+        'p95_ms': round(percentile(latencies, 0.95), 2) if latencies else None,
+        'p99_ms': round(percentile(latencies, 0.99), 2) if latencies else None,
+        'max_ms': round(latencies[-1], 2) if latencies else None,
+    }
+
+
+def timed_send(transport, method, path, headers, body):
+    """(status, json body, milliseconds); an exception counts as a failed request"""
+    started = time.perf_counter()
+    try:
+        status, data = transport.send(method, path, headers, body)
+    except Exception as e:
+        print(f'{method} {path} failed: {e}', file=sys.stderr)
+        status, data = 599, None
+    return status, data, (time.perf_counter() - started) * 1000
+
+
+def run_scenario(transport, factories, requests, concurrency):
+    """Send requests from concurrency threads; returns (overall, per route) summaries"""
+    counter = iter(range(requests))
+    counter_lock = threading.Lock()
+    samples = []
+    samples_lock = threading.Lock()
+
+    def client():
+        while True:
+            with counter_lock:
+                index = next(counter, None)
+            if index is None:
+                return
+            label, method, path, headers, body = factories[index % len(factories)]()
+            status, data, elapsed_ms = timed_send(transport, method, path, headers, body)
+            results = [(label, elapsed_ms, status < 400)]
+            if label == 'POST /api/donations' and status == 201:
+                # Follow the created donation through to checkout, as the frontend does
+                status, _, elapsed_ms = timed_send(transport, 'POST', f'/api/donations/{data["id"]}/payment',
+                                                   headers, {})
+                results.append(('POST /api/donations/<id>/payment', elapsed_ms, status < 400))
+            with samples_lock:
+                samples.extend(results)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(client)
+    elapsed = time.perf_counter() - started
+
+    by_route = {}
+    for label, elapsed_ms, ok in samples:
+        by_route.setdefault(label, []).append((elapsed_ms, ok))
+    return (summarize([(ms, ok) for _, ms, ok in samples], elapsed),
+            {label: summarize(route_samples, elapsed) for label, route_samples in sorted(by_route.items())})
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline):
+    """Relative change of p95 and rps per scenario against an earlier run"""
+    changes = {}
+    for name, current in results['scenarios'].items():
+        before = baseline.get('scenarios', {}).get(name)
+        if not before:
+            continue
+        changes[name] = {
+            metric: round((current[metric] - before[metric]) / before[metric] * 100, 1)
+            for metric in ('p50_ms', 'p95_ms', 'p99_ms', 'rps')
+            if current.get(metric) is not None and before.get(metric)
+        }
+    return {'baseline_commit': baseline.get('meta', {}).get('commit'), 'percent_change': changes}
+
+
+def main():
+    args = parse_args()
+    rng = random.Random(args.seed)
+    temp_dir = None
+    if not args.database_url:
+        temp_dir = tempfile.TemporaryDirectory()
+        args.database_url = f'sqlite:///{os.path.join(temp_dir.name, "bench.db")}'
+    os.environ['DATABASE_URL'] = args.database_url
+    os.environ.setdefault('LOG_LEVEL', 'ERROR')
+    os.environ.setdefault('SECRET_KEY', 'benchmark-secret')
+
+    import app as app_module
+    from logging_setup import configure_logging
+    configure_logging(stream=sys.stderr)  # keep stdout for the results
+    app = app_module.app
+    app.config['TESTING'] = True  # no background workers: measure the request path only
+
+    scenarios = args.scenarios.split(',') if args.scenarios else [
+        name for name in SCENARIOS if not (args.url and name == 'payment')]
+    if not args.url:
+        app_module.IOKA_ENABLED = True
+        app_module.ioka_service = FakeIoka()
+
+    with app.app_context():
+        seed_started = time.perf_counter()
+        ids = seed(app_module, args, rng)
+        seed_seconds = time.perf_counter() - seed_started
+        dialect = app_module.db.engine.dialect.name
+        factories = build_scenarios(app_module, ids, rng)
+
+    transport = HttpTransport(args.url) if args.url else TestClientTransport(app)
+    results = {
+        'meta': {
+            'commit': git_commit(),
+            'started_at': datetime.datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+            'python': platform.python_version(),
+            'database': dialect,
+            'target': args.url or 'flask-test-client',
+            'volumes': {'users': args.users, 'donations': args.donations, 'certificates': args.certificates,
+                        'locations': args.locations},
+            'seed_seconds': round(seed_seconds, 1),
+            'requests_per_scenario': args.requests,
+            'concurrency': args.concurrency,
+        },
+        'scenarios': {},
+        'routes': {},
+    }
+    for name in scenarios:
+        overall, routes = run_scenario(transport, factories[name], args.requests, args.concurrency)
+        results['scenarios'][name] = overall
+        results['routes'].update(routes)
+
+    if args.compare:
+        with open(args.compare) as baseline:
+            results['comparison'] = compare(results, json.load(baseline))
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    if temp_dir:
+        temp_dir.cleanup()
+
+
+if __name__ == '__main__':
+    main()
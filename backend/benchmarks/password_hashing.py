@@ -0,0 +1,102 @@
+"""
+Password hashing CPU benchmark
+Measures the CPU time per request of guest checkout (unusable-password
+marker, the current behaviour, against hashing a random password, the old
+one) and of login (verifying under the configured PASSWORD_HASH_METHOD, and
+verifying plus rehashing a hash made under an older method), and the cost of
+hashing once with each candidate method.
+
+Usage: python benchmarks/password_hashing.py [--count 20] [--methods pbkdf2:sha256,scrypt]
+"""
+
+import argparse
+import base64
+import json
+import os
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def cpu_ms_per_call(count, call):
+    started = time.process_time()
+    for index in range(count):
+        call(index)
+    return round((time.process_time() - started) / count * 1000, 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--count', type=int, default=20, help='requests per measurement')
+    parser.add_argument('--methods', default='pbkdf2:sha256:600000,pbkdf2:sha256,scrypt',
+                        help='comma-separated hash methods to time')
+    parser.add_argument('--old-method', default='pbkdf2:sha256:260000',
+                        help='method of the stored hashes in the rehash-on-login run')
+    args = parser.parse_args()
+
+    database = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+    os.environ['DATABASE_URL'] = f'sqlite:///{database.name}'
+    os.environ.setdefault('LOG_LEVEL', 'ERROR')
+
+    import app as app_module
+    from password_policy import PasswordPolicy, password_policy
+    app = app_module.app
+    app.config['TESTING'] = True
+    client = app.test_client()
+    run = uuid.uuid4().hex[:8]
+
+    with app.app_context():
+        app_module.db.create_all()
+
+    def guest_checkout(index):
+        response = client.post('/api/guest-donations', json={
+            'location_id': 'loc_bench', 'package_id': 'pkg_bench', 'tree_count': 1, 'amount': 999,
+            'donor_info': {'email': f'guest{index}.{run}@bench.example.com', 'full_name': 'Guest'}})
+        assert response.status_code == 201, response.get_data(as_text=True)
+
+    def hashed_guest_password():
+        return password_policy.hash(str(uuid.uuid4()))
+
+    def add_users(prefix, policy):
+        with app.app_context():
+            stored = policy.hash('benchmark')
+            app_module.db.session.execute(app_module.db.insert(app_module.User), [
+                {'id': f'usr_{prefix}_{run}_{i}', 'email': f'{prefix}{i}.{run}@bench.example.com',
+                 'password': stored, 'guest_donations_linked_at': app_module.datetime.datetime.utcnow()}
+                for i in range(args.count)])
+            app_module.db.session.commit()
+
+    def login(prefix):
+        def call(index):
+            credentials = base64.b64encode(f'{prefix}{index}.{run}@bench.example.com:benchmark'.encode()).decode()
+            response = client.post('/api/auth/login', headers={'Authorization': f'Basic {credentials}'})
+            assert response.status_code == 200, response.get_data(as_text=True)
+        return call
+
+    results = {'configured_method': password_policy.method, 'requests_cpu_ms': {}, 'hash_cpu_ms': {}}
+    requests = results['requests_cpu_ms']
+    requests['guest_checkout'] = cpu_ms_per_call(args.count, guest_checkout)
+    # The old checkout hashed a random password for every new guest
+    requests['guest_checkout_hashed_password'] = cpu_ms_per_call(
+        args.count, lambda index: (hashed_guest_password(), guest_checkout(args.count + index)))
+
+    add_users('current', password_policy)
+    requests['login'] = cpu_ms_per_call(args.count, login('current'))
+    add_users('old', PasswordPolicy(args.old_method))
+    requests['login_with_rehash'] = cpu_ms_per_call(args.count, login('old'))
+    requests['login_after_rehash'] = cpu_ms_per_call(args.count, login('old'))
+
+    for method in args.methods.split(','):
+        policy = PasswordPolicy(method)
+        results['hash_cpu_ms'][policy.method] = cpu_ms_per_call(max(1, args.count // 4),
+                                                                lambda index: policy.hash('benchmark'))
+
+    print(json.dumps(results, indent=2))
+    os.unlink(database.name)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+"""
+Certificate PDF renderer
+Finds and registers the Cyrillic certificate fonts once per process; each
+render then only opens a canvas and draws the page
+"""
+
+import logging
+import os
+import threading
+from typing import Optional, Tuple
+
+from reportlab.pdfgen import canvas
+from reportlab.lib.pagesizes import A4, landscape
+from reportlab.lib import colors
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+
+
+FONT_PATHS = [
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",  # fonts-dejavu-core in the Docker image
+    "/usr/share/fonts/TTF/DejaVuSans.ttf",
+    "C:\\Windows\\Fonts\\arial.ttf",  # Local Windows testing
+]
+LIBERATION_PATH = '/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf'
+LIBERATION_BOLD_PATH = '/usr/share/fonts/truetype/liberation/LiberationSans-Bold.ttf'
+
+logger = logging.getLogger(__name__)
+
+
+class CertificateTemplate:
+    """Page layout shared by every certificate
+
+    Holds the registered font names, page size and colours. Every PDF is a
+    separate document, so draw_static() draws the background, border, title
+    and fixed wording into each one; draw_details() adds the per-donation lines.
+    """
+
+    def __init__(self, font_name: str, font_bold: str):
+        self.font_name = font_name
+        self.font_bold = font_bold
+        self.page_size = landscape(A4)
+        self.width, self.height = self.page_size
+        self.center = self.width / 2
+        self.background_color = colors.HexColor('#F9FDF9')
+        self.border_color = colors.HexColor('#10B981')
+        self.text_color = colors.HexColor('#064E3B')
+
+    def draw_static(self, c) -> None:
+        c.setFillColor(self.background_color)
+        c.rect(0, 0, self.width, self.height, fill=1)
+
+        c.setStrokeColor(self.border_color)
+        c.setLineWidth(10)
+        c.rect(20, 20, self.width - 40, self.height - 40)
+
+        c.setFillColor(self.text_color)
+        c.setFont(self.font_bold, 40)
+        c.drawCentredString(self.center, self.height - 100, "СЕРТИФИКАТ ПОСАДКИ")
+        c.setFont(self.font_name, 20)
+        c.drawCentredString(self.center, self.height - 160, "Настоящим подтверждается, что")
+
+    def draw_details(self, c, donor_name: str, tree_count: int, location_name: str,
+                     date_str: str, certificate_id: str) -> None:
+        c.setFillColor(self.text_color)
+        c.setFont(self.font_bold, 30)
+        c.drawCentredString(self.center, self.height - 220, donor_name)
+
+        c.setFont(self.font_name, 20)
+        c.drawCentredString(self.center, self.height - 280, f"внес(ла) вклад в посадку {tree_count} деревьев")
+        c.drawCentredString(self.center, self.height - 320, f"в локации {location_name}")
+
+        c.setFont(self.font_name, 14)
+        c.drawCentredString(self.center, 100, f"Дата: {date_str}")
+
+        c.setFont(self.font_name, 10)
+        c.drawCentredString(self.center, 60, f"ID Сертификата: {certificate_id}")
+
+
+class CertificateRenderer:
+    """Renders certificate PDFs, registering the fonts lazily once"""
+
+    def __init__(self, fonts_dir: Optional[str] = None):
+        self.font_paths = list(FONT_PATHS)
+        if fonts_dir:
+            self.font_paths.append(os.path.join(fonts_dir, 'DejaVuSans.ttf'))
+        self._lock = threading.Lock()
+        self._template: Optional[CertificateTemplate] = None
+
+    def register_fonts(self) -> Tuple[str, str]:
+        """Register fonts that support Cyrillic characters, returning (regular, bold) names"""
+        try:
+            for path in self.font_paths:
+                if os.path.exists(path):
+                    bold_path = path.replace('.ttf', '-Bold.ttf')
+                    if not os.path.exists(bold_path):
+                        bold_path = path  # fallback to regular if bold not found
+
+                    pdfmetrics.registerFont(TTFont('DejaVu', path))
+                    pdfmetrics.registerFont(TTFont('DejaVu-Bold', bold_path))
+                    logger.info(f"Registered Cyrillic fonts from {path}")
+                    return 'DejaVu', 'DejaVu-Bold'
+
+            if os.path.exists(LIBERATION_PATH):
+                bold_path = LIBERATION_BOLD_PATH if os.path.exists(LIBERATION_BOLD_PATH) else LIBERATION_PATH
+                pdfmetrics.registerFont(TTFont('Arial', LIBERATION_PATH))
+                pdfmetrics.registerFont(TTFont('Arial-Bold', bold_path))
+                return 'Arial', 'Arial-Bold'
+
+            logger.warning("No Cyrillic fonts available, text may not display correctly")
+            return 'Helvetica', 'Helvetica-Bold'
+        except Exception as e:
+            logger.exception(f"Error registering fonts: {e}")
+            return 'Helvetica', 'Helvetica-Bold'
+
+    @property
+    def template(self) -> CertificateTemplate:
+        """The page template, registering fonts on first use"""
+        if self._template is None:
+            with self._lock:
+                if self._template is None:
+                    self._template = CertificateTemplate(*self.register_fonts())
+        return self._template
+
+    def render(self, file_path: str, donor_name: str, tree_count: int, location_name: str,
+               date_str: str, certificate_id: str) -> None:
+        """Write one certificate to file_path (a path or a binary file object)"""
+        template = self.template
+        c = canvas.Canvas(file_path, pagesize=template.page_size)
+        template.draw_static(c)
+        template.draw_details(c, donor_name, tree_count, location_name, date_str, certificate_id)
+        c.save()
+
+
+certificate_renderer = CertificateRenderer(
+    fonts_dir=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'fonts')
+)
@@ -0,0 +1,67 @@
+"""
+Certificate file store
+Keeps certificate PDFs under the SHA-256 of their content, sharded into two
+levels of sub-directories (ab/cd/abcd....pdf) so no directory grows past a
+few thousand entries. Files are written to a temporary name and renamed into
+place, so a reader never sees a partly written PDF. The digest and size are
+recorded on the Certificate row, which is what requests look up
+"""
+
+import hashlib
+import os
+import shutil
+import tempfile
+from typing import Callable, NamedTuple
+
+
+class StoredFile(NamedTuple):
+    digest: str  # hex SHA-256 of the content
+    size: int
+
+
+class CertificateStore:
+    """Content-addressed PDF files below root"""
+
+    suffix = '.pdf'
+
+    def __init__(self, root: str):
+        self.root = root
+        self.tmp_dir = os.path.join(root, '.tmp')  # same filesystem as the shards, so rename is atomic
+
+    def key(self, digest: str) -> str:
+        """Path of a stored file relative to root, e.g. 'ab/cd/abcd....pdf'"""
+        return f'{digest[:2]}/{digest[2:4]}/{digest}{self.suffix}'
+
+    def path(self, digest: str) -> str:
+        return os.path.join(self.root, *self.key(digest).split('/'))
+
+    def write(self, produce: Callable[[str], None]) -> StoredFile:
+        """Store the file produce(path) writes at a temporary path"""
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        handle, tmp_path = tempfile.mkstemp(suffix=self.suffix, dir=self.tmp_dir)
+        os.close(handle)
+        try:
+            produce(tmp_path)
+            digest = hashlib.sha256()
+            with open(tmp_path, 'rb') as tmp:
+                for chunk in iter(lambda: tmp.read(65536), b''):
+                    digest.update(chunk)
+                os.fsync(tmp.fileno())
+            stored = StoredFile(digest.hexdigest(), os.path.getsize(tmp_path))
+            target = self.path(stored.digest)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(tmp_path, target)
+            return stored
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def put(self, source_path: str) -> StoredFile:
+        """Copy an existing file into the store"""
+        return self.write(lambda tmp_path: shutil.copyfile(source_path, tmp_path))
+
+    def delete(self, digest: str) -> None:
+        try:
+            os.remove(self.path(digest))
+        except FileNotFoundError:
+            pass
@@ -1,6 +1,6 @@
 from app import app, db, User
 import sys
-from werkzeug.security import generate_password_hash
+from password_policy import password_policy
 import uuid
 
 def create_admin_user():
@@ -18,7 +18,7 @@ def create_admin_user():
                 id=str(uuid.uuid4()),
                 full_name="Administrator",
                 email="admin@example.com",
-                password=generate_password_hash("StrongPass123!", method='pbkdf2:sha256'),
+                password=password_policy.hash("StrongPass123!"),
                 phone="+77001234567",
                 role="admin"  # Set role to admin
             )
@@ -0,0 +1,138 @@
+"""
+Donation change notifications
+Wakes requests waiting on /api/donations/<id>/events when a donation or its
+certificate changes, in this process directly and in other worker processes
+through PostgreSQL LISTEN/NOTIFY
+"""
+
+import logging
+import select
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+
+class Subscription:
+    """Interest of one waiting request in one donation"""
+
+    def __init__(self, notifier: 'DonationNotifier', donation_id: str):
+        self.notifier = notifier
+        self.donation_id = donation_id
+        self._event = threading.Event()
+
+    def clear(self) -> None:
+        """Forget earlier notifications; call before re-reading the donation"""
+        self._event.clear()
+
+    def wait(self, timeout: float) -> bool:
+        """Block until notified or timeout; True if a notification arrived
+
+        Without a cross-process listener the wait is capped at poll_interval,
+        so changes committed by other workers are still seen promptly.
+        """
+        if not self.notifier.listening:
+            timeout = min(timeout, self.notifier.poll_interval)
+        return self._event.wait(max(timeout, 0))
+
+
+class DonationNotifier:
+    """Fan-out of donation ids to the Subscriptions waiting on them
+
+    connect() returns a psycopg2 connection for LISTEN, or None when the
+    database cannot deliver notifications (e.g. SQLite); execute_notify(id)
+    sends NOTIFY to the other processes.
+    """
+
+    def __init__(self, channel: str = 'donation_events', poll_interval: float = 2.0,
+                 connect: Optional[Callable[[], object]] = None,
+                 execute_notify: Optional[Callable[[str, str], None]] = None):
+        self.channel = channel
+        self.poll_interval = poll_interval
+        self.connect = connect
+        self.execute_notify = execute_notify
+        self.listening = False
+        self._subscriptions: Dict[str, Set[Subscription]] = {}
+        self._lock = threading.Lock()
+        self._listener: Optional[threading.Thread] = None
+
+    @contextmanager
+    def subscribe(self, donation_id: str):
+        self._ensure_listener()
+        subscription = Subscription(self, donation_id)
+        with self._lock:
+            self._subscriptions.setdefault(donation_id, set()).add(subscription)
+        try:
+            yield subscription
+        finally:
+            with self._lock:
+                waiting = self._subscriptions.get(donation_id)
+                waiting.discard(subscription)
+                if not waiting:
+                    del self._subscriptions[donation_id]
+
+    def publish(self, donation_id: str) -> None:
+        """Announce a committed change to every process; call after commit"""
+        self._wake(donation_id)
+        if self.execute_notify:
+            try:
+                self.execute_notify(self.channel, donation_id)
+            except Exception as e:
+                logger.warning(f"Donation notification for {donation_id} failed: {e}")
+
+    def waiting(self) -> int:
+        with self._lock:
+            return sum(len(subscriptions) for subscriptions in self._subscriptions.values())
+
+    def _wake(self, donation_id: str) -> None:
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(donation_id, ()))
+        for subscription in subscriptions:
+            subscription._event.set()
+
+    def _ensure_listener(self) -> None:
+        if self.connect is None or self._listener is not None:
+            return
+        with self._lock:
+            if self._listener is None:
+                self._listener = threading.Thread(target=self._listen, name='donation-events-listener', daemon=True)
+                self._listener.start()
+
+    def _listen(self) -> None:
+        """Relay NOTIFY payloads from other processes to local subscriptions, reconnecting on errors"""
+        while True:
+            connection = None
+            try:
+                connection = self.connect()
+                if connection is None:
+                    return
+                connection.autocommit = True
+                with connection.cursor() as cursor:
+                    cursor.execute(f'LISTEN {self.channel}')
+                self.listening = True
+                while True:
+                    if select.select([connection], [], [], 30) == ([], [], []):
+                        continue
+                    connection.poll()
+                    while connection.notifies:
+                        self._wake(connection.notifies.pop(0).payload)
+            except Exception as e:
+                logger.warning(f"Donation events listener error: {e}")
+            finally:
+                self.listening = False
+                if connection is not None:
+                    try:
+                        connection.close()
+                    except Exception:
+                        pass
+            # Waiters fall back to polling until the listener is back
+            self._wake_all()
+            time.sleep(self.poll_interval)
+
+    def _wake_all(self) -> None:
+        with self._lock:
+            subscriptions = [s for waiting in self._subscriptions.values() for s in waiting]
+        for subscription in subscriptions:
+            subscription._event.set()
@@ -3,14 +3,29 @@ Ioka Payment Gateway Integration Service
 Handles payment processing through Ioka API
 """
 
+import logging
 import os
+import random
+import threading
+import time
 import requests
+from requests.adapters import HTTPAdapter
 import hmac
 import hashlib
 import json
 from typing import Dict, Any, Optional
 from datetime import datetime
 
+from metrics import IOKA_LATENCY, IOKA_ERRORS, IOKA_RETRIES
+
+
+# Responses worth retrying: rate limiting and gateway/availability errors
+RETRY_STATUSES = {429, 502, 503, 504}
+# Statuses where the request was rejected before Ioka acted on it, so even a POST can be resent
+UNPROCESSED_STATUSES = {429}
+
+logger = logging.getLogger(__name__)
+
 
 class IokaService:
     """Service for interacting with Ioka payment gateway"""
@@ -25,6 +40,112 @@ class IokaService:
         
         if not self.api_key:
             raise ValueError("IOKA_API_KEY is not set in environment variables")
+
+        # (connect, read) timeouts in seconds
+        self.timeout = (
+            float(os.environ.get('IOKA_CONNECT_TIMEOUT', 3.05)),
+            float(os.environ.get('IOKA_READ_TIMEOUT', 10))
+        )
+        self.max_retries = int(os.environ.get('IOKA_MAX_RETRIES', 2))
+        self.retry_backoff = float(os.environ.get('IOKA_RETRY_BACKOFF', 0.3))
+        self.retry_max_delay = float(os.environ.get('IOKA_RETRY_MAX_DELAY', 5))
+        self.pool_size = int(os.environ.get('IOKA_POOL_SIZE', 10))
+
+        self._session = None
+        self._session_pid = None
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, float]] = {}
+
+    @property
+    def session(self) -> requests.Session:
+        """Keep-alive session shared by every call in this process
+
+        Rebuilt after a fork so worker processes never share pooled sockets.
+        """
+        pid = os.getpid()
+        if self._session is None or self._session_pid != pid:
+            with self._lock:
+                if self._session is None or self._session_pid != pid:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=0)
+                    session.mount('https://', adapter)
+                    session.mount('http://', adapter)
+                    session.headers.update(self._get_headers())
+                    self._session = session
+                    self._session_pid = pid
+        return self._session
+
+    def _retry_delay(self, attempt: int, response: Optional[requests.Response] = None) -> float:
+        """Full-jitter exponential backoff, honouring a numeric Retry-After header"""
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), self.retry_max_delay)
+        return random.uniform(0, min(self.retry_max_delay, self.retry_backoff * (2 ** attempt)))
+
+    def _request(self, operation: str, method: str, url: str, idempotent: bool, **kwargs) -> requests.Response:
+        """
+        Send a request through the shared session, retrying transient failures
+
+        Idempotent calls are retried on connection errors, timeouts and
+        RETRY_STATUSES. Non-idempotent calls (creating orders, refunds) are only
+        retried when the request cannot have reached Ioka: a connect timeout or
+        a rate-limit rejection.
+        """
+        attempt = 0
+        while True:
+            started = time.perf_counter()
+            response = None
+            try:
+                response = self.session.request(method, url, timeout=self.timeout, **kwargs)
+            except requests.exceptions.RequestException as e:
+                self._record(operation, time.perf_counter() - started, error=True)
+                retryable = isinstance(e, requests.exceptions.ConnectTimeout) or (
+                    idempotent and isinstance(e, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+                )
+                if not retryable or attempt >= self.max_retries:
+                    raise
+            else:
+                retryable = response.status_code in (RETRY_STATUSES if idempotent else UNPROCESSED_STATUSES)
+                self._record(operation, time.perf_counter() - started, error=not response.ok)
+                if not retryable or attempt >= self.max_retries:
+                    return response
+                response.close()
+
+            time.sleep(self._retry_delay(attempt, response))
+            attempt += 1
+            with self._lock:
+                self._stats[operation]['retries'] += 1
+            IOKA_RETRIES.labels(operation).inc()
+
+    def _record(self, operation: str, elapsed: float, error: bool) -> None:
+        IOKA_LATENCY.labels(operation).observe(elapsed)
+        if error:
+            IOKA_ERRORS.labels(operation).inc()
+        with self._lock:
+            stats = self._stats.setdefault(operation, {
+                'calls': 0, 'errors': 0, 'retries': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'last_ms': 0.0
+            })
+            elapsed_ms = elapsed * 1000
+            stats['calls'] += 1
+            stats['errors'] += int(error)
+            stats['total_ms'] += elapsed_ms
+            stats['max_ms'] = max(stats['max_ms'], elapsed_ms)
+            stats['last_ms'] = elapsed_ms
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Per-operation call counts and latency for this process (one entry per HTTP attempt)"""
+        with self._lock:
+            return {
+                operation: {
+                    'calls': int(stats['calls']),
+                    'errors': int(stats['errors']),
+                    'retries': int(stats['retries']),
+                    'avg_ms': round(stats['total_ms'] / stats['calls'], 2) if stats['calls'] else None,
+                    'max_ms': round(stats['max_ms'], 2),
+                    'last_ms': round(stats['last_ms'], 2)
+                }
+                for operation, stats in self._stats.items()
+            }
     
     def _get_headers(self) -> Dict[str, str]:
         """Get headers for Ioka API requests"""
@@ -81,17 +202,11 @@ class IokaService:
                 payload["customer"]["name"] = customer_name
         
         try:
-            print(f"Creating payment to Ioka with data: {payload}")
-            response = requests.post(
-                url,
-                headers=self._get_headers(),
-                json=payload,
-                timeout=10
-            )
+            logger.info(f"Creating Ioka payment order for donation {donation_id}", extra={'amount_tiyn': amount_tiyn})
+            response = self._request('create_payment_order', 'POST', url, idempotent=False, json=payload)
             
             if not response.ok:
-                print(f"IOKA API ERROR: Status {response.status_code}")
-                print(f"Response Body: {response.text}")
+                logger.warning(f"Ioka create order error: status {response.status_code}: {response.text[:500]}")
                 
             response.raise_for_status()
             
@@ -129,15 +244,10 @@ class IokaService:
         url = f"{self.base_url}/v2/orders/{order_id}"
         
         try:
-            response = requests.get(
-                url,
-                headers=self._get_headers(),
-                timeout=10
-            )
+            response = self._request('get_payment_status', 'GET', url, idempotent=True)
             
             if not response.ok:
-                print(f"IOKA GET STATUS ERROR: Status {response.status_code}")
-                print(f"Response Body: {response.text}")
+                logger.warning(f"Ioka get status error: status {response.status_code}: {response.text[:500]}")
                 
             response.raise_for_status()
             
@@ -205,17 +315,12 @@ class IokaService:
             payload['amount'] = amount
         
         try:
-            print(f"Refunding payment to Ioka with data: {payload}")
-            response = requests.post(
-                url,
-                headers=self._get_headers(),
-                json=payload if payload else None,
-                timeout=10
-            )
+            logger.info(f"Refunding Ioka order {order_id}", extra={'amount': amount})
+            response = self._request('refund_payment', 'POST', url, idempotent=False,
+                                     json=payload if payload else None)
             
             if not response.ok:
-                print(f"IOKA REFUND ERROR: Status {response.status_code}")
-                print(f"Response Body: {response.text}")
+                logger.warning(f"Ioka refund error: status {response.status_code}: {response.text[:500]}")
                 
             response.raise_for_status()
             
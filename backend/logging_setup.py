@@ -0,0 +1,117 @@
+"""
+Logging setup
+JSON-line logs written to stdout by a QueueListener thread, so request
+threads never block on log I/O, and per-route sampling of request log lines
+"""
+
+import atexit
+import datetime
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+from typing import Dict, Optional
+
+# Attributes every LogRecord has; anything else on a record came in through extra={}
+RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'taskName'}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line with the message, its level and logger, and any extra={} fields"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc)
+            .isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class StructuredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that keeps the traceback apart from the message instead of merging them"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def configure_logging(level: Optional[str] = None, log_format: Optional[str] = None,
+                      stream=None) -> logging.handlers.QueueListener:
+    """Route the root logger through a queue to a single writer thread
+
+    LOG_LEVEL (default INFO) sets the level and LOG_FORMAT picks 'json'
+    (default) or 'text' output.
+    """
+    level = (level or os.environ.get('LOG_LEVEL', 'INFO')).upper()
+    log_format = (log_format or os.environ.get('LOG_FORMAT', 'json')).lower()
+
+    output = logging.StreamHandler(stream or sys.stdout)
+    if log_format == 'json':
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(StructuredQueueHandler(log_queue))
+    root.setLevel(level)
+
+    listener = logging.handlers.QueueListener(log_queue, output)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+
+class RequestLogSampler:
+    """Decides which requests get a log line
+
+    rates maps a route rule (e.g. '/api/locations') to the fraction of its
+    requests to log; other routes use default_rate. Server errors and
+    requests slower than slow_ms are always logged.
+    """
+
+    def __init__(self, rates: Optional[Dict[str, float]] = None, default_rate: float = 1.0,
+                 slow_ms: float = 1000.0, rng=random.random):
+        self.rates = rates or {}
+        self.default_rate = default_rate
+        self.slow_ms = slow_ms
+        self._rng = rng
+
+    @classmethod
+    def from_env(cls) -> 'RequestLogSampler':
+        """LOG_SAMPLE_RATES='/api/locations=0.05,/api/news=0.05', LOG_SAMPLE_DEFAULT, LOG_SLOW_MS"""
+        rates = {}
+        for item in os.environ.get('LOG_SAMPLE_RATES', '').split(','):
+            route, _, rate = item.strip().rpartition('=')
+            if route:
+                rates[route] = float(rate)
+        return cls(rates, float(os.environ.get('LOG_SAMPLE_DEFAULT', 1.0)), float(os.environ.get('LOG_SLOW_MS', 1000)))
+
+    def rate_for(self, route: Optional[str]) -> float:
+        return self.rates.get(route, self.default_rate)
+
+    def should_log(self, route: Optional[str], status: int, duration_ms: float) -> bool:
+        if status >= 500 or duration_ms >= self.slow_ms:
+            return True
+        rate = self.rate_for(route)
+        return rate >= 1 or (rate > 0 and self._rng() < rate)
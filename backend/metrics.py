@@ -0,0 +1,156 @@
+"""
+Prometheus metrics
+Request latency, SQL work per request, Ioka calls and certificate rendering,
+exported in the Prometheus text format by /metrics. Under gunicorn, point
+PROMETHEUS_MULTIPROC_DIR at an empty directory shared by the workers: each
+process then writes its samples to memory-mapped files there and a scrape
+served by any worker reports the sum over all of them
+"""
+
+import os
+import threading
+import time
+from typing import Callable, Iterable, List, Tuple
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, generate_latest
+from prometheus_client import multiprocess
+from sqlalchemy import event
+
+MULTIPROCESS = bool(os.environ.get('PROMETHEUS_MULTIPROC_DIR'))
+
+# In multiprocess mode samples live in the shared files, not in a registry
+registry = None if MULTIPROCESS else CollectorRegistry()
+
+LATENCY_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds', 'Time spent handling a request',
+    ['method', 'route', 'status'], buckets=LATENCY_BUCKETS, registry=registry
+)
+REQUEST_DB_QUERIES = Histogram(
+    'http_request_db_queries', 'SQL statements executed while handling a request',
+    ['route'], buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100), registry=registry
+)
+REQUEST_DB_SECONDS = Histogram(
+    'http_request_db_duration_seconds', 'Time spent in SQL statements while handling a request',
+    ['route'], buckets=LATENCY_BUCKETS, registry=registry
+)
+IOKA_LATENCY = Histogram(
+    'ioka_request_duration_seconds', 'Duration of one HTTP attempt against the Ioka API',
+    ['operation'], buckets=LATENCY_BUCKETS, registry=registry
+)
+IOKA_ERRORS = Counter(
+    'ioka_request_errors_total', 'Ioka API attempts that failed or returned an error status',
+    ['operation'], registry=registry
+)
+IOKA_RETRIES = Counter(
+    'ioka_request_retries_total', 'Ioka API attempts that were retried',
+    ['operation'], registry=registry
+)
+CERTIFICATE_RENDER_SECONDS = Histogram(
+    'certificate_render_duration_seconds', 'Time spent rendering one certificate PDF',
+    buckets=(.01, .025, .05, .1, .25, .5, 1, 2.5, 5), registry=registry
+)
+CERTIFICATE_JOBS = Counter(
+    'certificate_render_jobs_total', 'Certificate render jobs processed, by outcome',
+    ['outcome'], registry=registry
+)
+
+
+class QueryStats:
+    """Counts SQL statements and their time for the code between start() and stop()
+
+    Tracking is per thread, so background workers sharing the engine with
+    request threads are not counted against any request. Recorders attached
+    with attach() are handed every statement the thread runs through the same
+    listeners (see query_recorder.QueryRecorder).
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._targets: list = []
+
+    def install(self, target) -> None:
+        """Listen on an Engine, or on the Engine class for every engine; installing twice is a no-op"""
+        with self._lock:
+            if any(installed is target for installed in self._targets):
+                return
+            event.listen(target, 'before_cursor_execute', self._before_execute)
+            event.listen(target, 'after_cursor_execute', self._after_execute)
+            self._targets.append(target)
+
+    def start(self) -> None:
+        self._local.count = 0
+        self._local.seconds = 0.0
+        self._local.active = True
+
+    def stop(self) -> Tuple[int, float]:
+        """(statements, seconds) since start()"""
+        self._local.active = False
+        return getattr(self._local, 'count', 0), getattr(self._local, 'seconds', 0.0)
+
+    def attach(self, recorder) -> None:
+        """Call recorder.record(statement, seconds) for each statement this thread runs until detach()"""
+        self._recorders().append(recorder)
+
+    def detach(self, recorder) -> None:
+        recorders = self._recorders()
+        if recorder in recorders:
+            recorders.remove(recorder)
+
+    def _recorders(self) -> list:
+        recorders = getattr(self._local, 'recorders', None)
+        if recorders is None:
+            recorders = self._local.recorders = []
+        return recorders
+
+    def _tracking(self) -> bool:
+        return getattr(self._local, 'active', False) or bool(getattr(self._local, 'recorders', None))
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if self._tracking():
+            self._local.started = time.perf_counter()
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = getattr(self._local, 'started', None)
+        if started is None:
+            return
+        self._local.started = None
+        elapsed = time.perf_counter() - started
+        if getattr(self._local, 'active', False):
+            self._local.count += 1
+            self._local.seconds += elapsed
+        for recorder in list(getattr(self._local, 'recorders', ())):
+            recorder.record(statement, elapsed)
+
+
+class MetricsExporter:
+    """Collects the samples of this process (or of every process) plus scrape-time collectors
+
+    add_collector(fn) registers a function returning metric families that are
+    computed when scraped, such as queue depths read from the database.
+    """
+
+    content_type = CONTENT_TYPE_LATEST
+
+    def __init__(self):
+        self._collectors: List[Callable[[], Iterable]] = []
+
+    def add_collector(self, collector: Callable[[], Iterable]) -> None:
+        self._collectors.append(collector)
+
+    def collect(self):
+        if MULTIPROCESS:
+            yield from multiprocess.MultiProcessCollector(None).collect()
+        else:
+            yield from registry.collect()
+        for collector in self._collectors:
+            yield from collector()
+
+    def render(self) -> bytes:
+        return generate_latest(self)
+
+
+query_stats = QueryStats()
+metrics_exporter = MetricsExporter()
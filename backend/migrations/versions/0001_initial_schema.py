@@ -0,0 +1,118 @@
+"""initial schema
+
+Creates the tables that existed before migrations were kept in the repository.
+Tables that are already present (databases created with db.create_all() or an
+earlier autogenerated migration) are left untouched.
+
+Revision ID: 0001_initial_schema
+Revises:
+Create Date: 2026-10-17 12:28:23.976925
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0001_initial_schema'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def create_table_if_missing(name, *columns):
+    if not sa.inspect(op.get_bind()).has_table(name):
+        op.create_table(name, *columns)
+
+
+def upgrade():
+    create_table_if_missing('donation_summary',
+    sa.Column('location_id', sa.String(), nullable=False),
+    sa.Column('status', sa.String(), nullable=False),
+    sa.Column('donations', sa.Integer(), nullable=False),
+    sa.Column('trees', sa.Integer(), nullable=False),
+    sa.Column('revenue', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('location_id', 'status')
+    )
+    create_table_if_missing('location',
+    sa.Column('id', sa.String(), nullable=False),
+    sa.Column('name', sa.String(), nullable=True),
+    sa.Column('description', sa.String(), nullable=True),
+    sa.Column('area_hectares', sa.Float(), nullable=True),
+    sa.Column('coordinates', sa.String(), nullable=True),
+    sa.Column('image_url', sa.String(), nullable=True),
+    sa.Column('status', sa.String(), nullable=True),
+    sa.Column('capacity_trees', sa.Integer(), nullable=True),
+    sa.Column('planted_trees', sa.Integer(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    create_table_if_missing('news',
+    sa.Column('id', sa.String(), nullable=False),
+    sa.Column('title', sa.String(), nullable=False),
+    sa.Column('content', sa.Text(), nullable=False),
+    sa.Column('image_url', sa.String(), nullable=True),
+    sa.Column('author', sa.String(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+    sa.Column('published', sa.Boolean(), nullable=True),
+    sa.Column('category', sa.String(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    create_table_if_missing('package',
+    sa.Column('id', sa.String(), nullable=False),
+    sa.Column('name', sa.String(), nullable=True),
+    sa.Column('tree_count', sa.Integer(), nullable=True),
+    sa.Column('price', sa.Integer(), nullable=True),
+    sa.Column('description', sa.String(), nullable=True),
+    sa.Column('popular', sa.Boolean(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    create_table_if_missing('user',
+    sa.Column('id', sa.String(), nullable=False),
+    sa.Column('full_name', sa.String(), nullable=True),
+    sa.Column('email', sa.String(), nullable=False),
+    sa.Column('password', sa.String(), nullable=False),
+    sa.Column('phone', sa.String(), nullable=True),
+    sa.Column('company_name', sa.String(), nullable=True),
+    sa.Column('role', sa.String(), nullable=True),
+    sa.Column('status', sa.String(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+    sa.Column('last_login', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('email')
+    )
+    create_table_if_missing('donation',
+    sa.Column('id', sa.String(), nullable=False),
+    sa.Column('location_id', sa.String(), nullable=True),
+    sa.Column('package_id', sa.String(), nullable=True),
+    sa.Column('user_id', sa.String(), nullable=True),
+    sa.Column('email', sa.String(), nullable=True),
+    sa.Column('tree_count', sa.Integer(), nullable=True),
+    sa.Column('amount', sa.Integer(), nullable=True),
+    sa.Column('status', sa.String(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+    sa.Column('donor_info', sa.JSON(), nullable=True),
+    sa.Column('payment_order_id', sa.String(), nullable=True),
+    sa.ForeignKeyConstraint(['location_id'], ['location.id'], ),
+    sa.ForeignKeyConstraint(['package_id'], ['package.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    create_table_if_missing('certificate',
+    sa.Column('id', sa.String(), nullable=False),
+    sa.Column('donation_id', sa.String(), nullable=True),
+    sa.Column('pdf_url', sa.String(), nullable=True),
+    sa.Column('created_date', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+    sa.ForeignKeyConstraint(['donation_id'], ['donation.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('certificate')
+    op.drop_table('donation')
+    op.drop_table('user')
+    op.drop_table('package')
+    op.drop_table('news')
+    op.drop_table('location')
+    op.drop_table('donation_summary')
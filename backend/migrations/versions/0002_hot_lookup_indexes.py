@@ -0,0 +1,77 @@
+"""indexes for hot lookup columns
+
+Adds the single-column and composite indexes behind the donation lists,
+guest-donation linking, payment order lookups and case-insensitive email
+lookups, and makes certificate.donation_id unique (keeping the oldest
+certificate of any donation that has duplicates).
+
+Revision ID: 0002_hot_lookup_indexes
+Revises: 0001_initial_schema
+Create Date: 2026-10-17 12:45:10.418231
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0002_hot_lookup_indexes'
+down_revision = '0001_initial_schema'
+branch_labels = None
+depends_on = None
+
+
+COLUMN_INDEXES = [
+    ('ix_donation_created_at', 'donation', ['created_at', 'id']),
+    ('ix_donation_user_id_created_at', 'donation', ['user_id', 'created_at', 'id']),
+    ('ix_donation_status_created_at', 'donation', ['status', 'created_at', 'id']),
+    ('ix_donation_location_id_created_at', 'donation', ['location_id', 'created_at', 'id']),
+    ('ix_donation_email_user_id', 'donation', ['email', 'user_id']),
+    ('ix_donation_payment_order_id', 'donation', ['payment_order_id']),
+]
+
+LOWER_EMAIL_INDEXES = [
+    ('ix_user_email_lower', 'user'),
+    ('ix_donation_email_lower', 'donation'),
+]
+
+
+def existing_indexes(table):
+    return {index['name'] for index in sa.inspect(op.get_bind()).get_indexes(table)}
+
+
+def upgrade():
+    is_postgresql = op.get_bind().dialect.name == 'postgresql'
+
+    for name, table, columns in COLUMN_INDEXES:
+        if name not in existing_indexes(table):
+            op.create_index(name, table, columns)
+
+    for name, table in LOWER_EMAIL_INDEXES:
+        if name in existing_indexes(table):
+            continue
+        if is_postgresql:
+            # text_pattern_ops lets LIKE 'prefix%' searches use the index too
+            op.execute(f'CREATE INDEX {name} ON "{table}" (lower(email) text_pattern_ops)')
+        else:
+            op.create_index(name, table, [sa.text('lower(email)')])
+
+    if 'ix_certificate_donation_id' not in existing_indexes('certificate'):
+        # Ids are random, so age decides which certificate survives; the id only breaks ties.
+        # Undated rows count as the newest.
+        op.execute(
+            'DELETE FROM certificate WHERE EXISTS ('
+            'SELECT 1 FROM certificate AS older '
+            'WHERE older.donation_id = certificate.donation_id '
+            'AND (coalesce(older.created_date, CURRENT_TIMESTAMP), older.id) '
+            '< (coalesce(certificate.created_date, CURRENT_TIMESTAMP), certificate.id))'
+        )
+        op.create_index('ix_certificate_donation_id', 'certificate', ['donation_id'], unique=True)
+
+
+def downgrade():
+    op.drop_index('ix_certificate_donation_id', table_name='certificate')
+    for name, table in reversed(LOWER_EMAIL_INDEXES):
+        op.drop_index(name, table_name=table)
+    for name, table, columns in reversed(COLUMN_INDEXES):
+        op.drop_index(name, table_name=table)
@@ -0,0 +1,40 @@
+"""certificate render job queue
+
+Revision ID: 0003_certificate_render_jobs
+Revises: 0002_hot_lookup_indexes
+Create Date: 2026-10-17 13:20:41.907312
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0003_certificate_render_jobs'
+down_revision = '0002_hot_lookup_indexes'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('certificate_render_job',
+    sa.Column('id', sa.String(), nullable=False),
+    sa.Column('donation_id', sa.String(), nullable=False),
+    sa.Column('status', sa.String(), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('next_attempt_at', sa.DateTime(), nullable=False),
+    sa.Column('locked_until', sa.DateTime(), nullable=True),
+    sa.Column('last_error', sa.String(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+    sa.ForeignKeyConstraint(['donation_id'], ['donation.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('donation_id')
+    )
+    op.create_index('ix_certificate_render_job_status_next_attempt_at', 'certificate_render_job',
+                    ['status', 'next_attempt_at'])
+
+
+def downgrade():
+    op.drop_index('ix_certificate_render_job_status_next_attempt_at', table_name='certificate_render_job')
+    op.drop_table('certificate_render_job')
@@ -0,0 +1,29 @@
+"""catalog versions for HTTP caching
+
+Revision ID: 0004_catalog_versions
+Revises: 0003_certificate_render_jobs
+Create Date: 2026-10-17 14:05:12.530418
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0004_catalog_versions'
+down_revision = '0003_certificate_render_jobs'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('catalog_version',
+    sa.Column('name', sa.String(), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+
+
+def downgrade():
+    op.drop_table('catalog_version')
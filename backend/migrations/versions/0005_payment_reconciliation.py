@@ -0,0 +1,33 @@
+"""payment reconciliation bookkeeping
+
+Adds donation.payment_checked_at (when the Ioka order status was last synced)
+and the index the reconciler sweeps by. Donations already awaiting payment
+count as checked at creation, so they are picked up by the first sweep.
+
+Revision ID: 0005_payment_reconciliation
+Revises: 0004_catalog_versions
+Create Date: 2026-10-17 14:48:27.116034
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0005_payment_reconciliation'
+down_revision = '0004_catalog_versions'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('donation') as batch_op:
+        batch_op.add_column(sa.Column('payment_checked_at', sa.DateTime(), nullable=True))
+    op.execute('UPDATE donation SET payment_checked_at = created_at WHERE payment_checked_at IS NULL')
+    op.create_index('ix_donation_status_payment_checked_at', 'donation', ['status', 'payment_checked_at'])
+
+
+def downgrade():
+    op.drop_index('ix_donation_status_payment_checked_at', table_name='donation')
+    with op.batch_alter_table('donation') as batch_op:
+        batch_op.drop_column('payment_checked_at')
@@ -0,0 +1,53 @@
+"""contact submissions and partnership inquiries
+
+Revision ID: 0006_contact_and_partnership_forms
+Revises: 0005_payment_reconciliation
+Create Date: 2026-10-17 15:31:09.684120
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0006_contact_and_partnership_forms'
+down_revision = '0005_payment_reconciliation'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('contact_submission',
+    sa.Column('id', sa.String(), nullable=False),
+    sa.Column('name', sa.String(), nullable=False),
+    sa.Column('email', sa.String(), nullable=False),
+    sa.Column('phone', sa.String(), nullable=True),
+    sa.Column('message', sa.Text(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_contact_submission_created_at', 'contact_submission', ['created_at', 'id'])
+
+    op.create_table('partnership_inquiry',
+    sa.Column('id', sa.String(), nullable=False),
+    sa.Column('company_name', sa.String(), nullable=False),
+    sa.Column('contact_person', sa.String(), nullable=False),
+    sa.Column('email', sa.String(), nullable=False),
+    sa.Column('phone', sa.String(), nullable=True),
+    sa.Column('partnership_type', sa.String(), nullable=True),
+    sa.Column('message', sa.Text(), nullable=True),
+    sa.Column('status', sa.String(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_partnership_inquiry_created_at', 'partnership_inquiry', ['created_at', 'id'])
+    op.create_index('ix_partnership_inquiry_status_created_at', 'partnership_inquiry',
+                    ['status', 'created_at', 'id'])
+
+
+def downgrade():
+    op.drop_index('ix_partnership_inquiry_status_created_at', table_name='partnership_inquiry')
+    op.drop_index('ix_partnership_inquiry_created_at', table_name='partnership_inquiry')
+    op.drop_table('partnership_inquiry')
+    op.drop_index('ix_contact_submission_created_at', table_name='contact_submission')
+    op.drop_table('contact_submission')
@@ -0,0 +1,31 @@
+"""guest donation link watermark
+
+Adds user.guest_donations_linked_at, set once the donations made with the
+account's email before it existed have been attached to it. Existing
+accounts start unset and are linked on their next login, or all at once by
+`flask link-guest-donations`.
+
+Revision ID: 0007_guest_donation_link_watermark
+Revises: 0006_contact_and_partnership_forms
+Create Date: 2026-10-17 16:05:41.208337
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0007_guest_donation_link_watermark'
+down_revision = '0006_contact_and_partnership_forms'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.add_column(sa.Column('guest_donations_linked_at', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.drop_column('guest_donations_linked_at')
@@ -0,0 +1,43 @@
+"""webhook inbox
+
+Adds webhook_event, where verified Ioka webhook deliveries are stored on
+receipt and later applied to their donation by the webhook worker. The
+unique event_key drops redeliveries of an event.
+
+Revision ID: 0008_webhook_inbox
+Revises: 0007_guest_donation_link_watermark
+Create Date: 2026-10-17 17:12:08.530914
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0008_webhook_inbox'
+down_revision = '0007_guest_donation_link_watermark'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('webhook_event',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('event_key', sa.String(), nullable=False),
+    sa.Column('donation_id', sa.String(), nullable=False),
+    sa.Column('event_type', sa.String(), nullable=False),
+    sa.Column('payload', sa.Text(), nullable=False),
+    sa.Column('status', sa.String(), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('last_error', sa.String(), nullable=True),
+    sa.Column('received_at', sa.DateTime(), nullable=False),
+    sa.Column('processed_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('event_key')
+    )
+    op.create_index('ix_webhook_event_status_donation_id', 'webhook_event', ['status', 'donation_id'])
+
+
+def downgrade():
+    op.drop_index('ix_webhook_event_status_donation_id', table_name='webhook_event')
+    op.drop_table('webhook_event')
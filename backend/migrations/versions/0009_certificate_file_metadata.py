@@ -0,0 +1,34 @@
+"""certificate file metadata
+
+Adds certificate.file_sha256 and certificate.file_size. The hash locates the
+PDF in the sharded certificate store, so serving and status checks read the
+row instead of the filesystem. Existing certificates start unset and keep
+being served from the old flat layout until `flask migrate-certificates`
+moves their files into the store.
+
+Revision ID: 0009_certificate_file_metadata
+Revises: 0008_webhook_inbox
+Create Date: 2026-10-17 18:03:27.114862
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0009_certificate_file_metadata'
+down_revision = '0008_webhook_inbox'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('certificate') as batch_op:
+        batch_op.add_column(sa.Column('file_sha256', sa.String(), nullable=True))
+        batch_op.add_column(sa.Column('file_size', sa.Integer(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('certificate') as batch_op:
+        batch_op.drop_column('file_size')
+        batch_op.drop_column('file_sha256')
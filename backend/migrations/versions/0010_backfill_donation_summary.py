@@ -0,0 +1,38 @@
+"""backfill donation summary
+
+Fills the donation_summary rollup once from the donation table. Databases that
+predate the rollup have the table empty, and from here on the flush hook keeps
+it in step. A rollup that already has rows is left alone; drift is repaired
+with `flask rebuild-donation-summary`.
+
+Revision ID: 0010_backfill_donation_summary
+Revises: 0009_certificate_file_metadata
+Create Date: 2026-10-17 21:12:40.318207
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0010_backfill_donation_summary'
+down_revision = '0009_certificate_file_metadata'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    connection = op.get_bind()
+    if connection.execute(sa.text('SELECT 1 FROM donation_summary LIMIT 1')).first():
+        return
+    op.execute(
+        "INSERT INTO donation_summary (location_id, status, donations, trees, revenue) "
+        "SELECT coalesce(location_id, ''), coalesce(status, ''), count(*), "
+        "coalesce(sum(tree_count), 0), coalesce(sum(amount), 0) "
+        "FROM donation GROUP BY coalesce(location_id, ''), coalesce(status, '')"
+    )
+
+
+def downgrade():
+    # The rollup is maintained data from here on; leave it in place
+    pass
@@ -0,0 +1,55 @@
+"""
+Password hashing policy
+The one place that decides how passwords are hashed. Hashes made under an
+older policy still verify and are replaced on the next successful login, and
+accounts without a password (guest checkouts) store a marker that no
+password matches, so creating them costs no hashing
+"""
+
+import os
+from typing import Optional
+
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+
+# Never produced by generate_password_hash, whose output always contains '$'
+UNUSABLE_PASSWORD = '!'
+
+
+def normalize_method(method: str) -> str:
+    """Spell out the cost parameters werkzeug would fill in, e.g. 'scrypt' -> 'scrypt:32768:8:1'"""
+    parts = method.split(':')
+    if parts[0] == 'pbkdf2':
+        hash_name = parts[1] if len(parts) > 1 else 'sha256'
+        iterations = parts[2] if len(parts) > 2 else DEFAULT_PBKDF2_ITERATIONS
+        return f'pbkdf2:{hash_name}:{iterations}'
+    if parts[0] == 'scrypt':
+        n, r, p = (parts[1:] + ['', '', ''])[:3]
+        return f'scrypt:{n or 2 ** 15}:{r or 8}:{p or 1}'
+    return method
+
+
+class PasswordPolicy:
+    """Hash method and salt length, from PASSWORD_HASH_METHOD and PASSWORD_SALT_LENGTH by default"""
+
+    def __init__(self, method: Optional[str] = None, salt_length: Optional[int] = None):
+        self.method = normalize_method(method or os.environ.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256'))
+        self.salt_length = salt_length or int(os.environ.get('PASSWORD_SALT_LENGTH', 16))
+
+    def hash(self, password: str) -> str:
+        return generate_password_hash(password, method=self.method, salt_length=self.salt_length)
+
+    def verify(self, stored: Optional[str], password: str) -> bool:
+        if not self.is_usable(stored):
+            return False
+        return check_password_hash(stored, password)
+
+    def needs_rehash(self, stored: str) -> bool:
+        """True when a hash that just verified was made with a different method or cost"""
+        return self.is_usable(stored) and stored.split('$', 1)[0] != self.method
+
+    @staticmethod
+    def is_usable(stored: Optional[str]) -> bool:
+        return bool(stored) and not stored.startswith(UNUSABLE_PASSWORD)
+
+
+password_policy = PasswordPolicy()
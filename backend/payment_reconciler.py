@@ -0,0 +1,70 @@
+"""
+Payment status fetcher
+Looks up the Ioka status of many orders at once for the payment reconciler,
+with a bounded number of concurrent requests and a shared rate limit
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    """Token bucket: at most `rate` acquisitions per second, with bursts up to `burst`"""
+
+    def __init__(self, rate: float, burst: Optional[int] = None, clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep):
+        self.rate = rate
+        self.burst = burst or max(1, int(rate))
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = float(self.burst)
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """Block until a token is available and take it"""
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = self._clock()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            self._sleep(wait)
+
+
+class PaymentStatusFetcher:
+    """Runs status lookups on a small thread pool, throttled by a RateLimiter"""
+
+    def __init__(self, concurrency: int = 4, rate: float = 5.0):
+        self.concurrency = max(1, concurrency)
+        self.limiter = RateLimiter(rate)
+
+    def fetch(self, order_ids: Iterable[str], lookup: Callable[[str], Dict]) -> Dict[str, Optional[str]]:
+        """Map each order id to its Ioka status, or None when the lookup failed
+
+        lookup(order_id) returns the IokaService.get_payment_status() result.
+        """
+        def fetch_one(order_id):
+            self.limiter.acquire()
+            try:
+                result = lookup(order_id)
+            except Exception as e:
+                logger.warning(f"Payment status lookup for order {order_id} failed: {e}")
+                return order_id, None
+            return order_id, result.get('status') if result.get('success') else None
+
+        order_ids = list(order_ids)
+        if not order_ids:
+            return {}
+        with ThreadPoolExecutor(max_workers=min(self.concurrency, len(order_ids))) as pool:
+            return dict(pool.map(fetch_one, order_ids))
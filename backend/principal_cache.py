@@ -0,0 +1,114 @@
+"""
+Authenticated principal cache
+Keeps an immutable snapshot of recently authenticated users so that
+token_required and admin_required do not query the user table on every request
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional
+
+
+@dataclass(frozen=True)
+class UserPrincipal:
+    """Read-only view of a User row, without the password hash"""
+    id: str
+    full_name: Optional[str]
+    email: str
+    phone: Optional[str]
+    company_name: Optional[str]
+    role: Optional[str]
+    status: Optional[str]
+    created_at: Optional[datetime]
+    last_login: Optional[datetime]
+
+    @classmethod
+    def from_user(cls, user) -> 'UserPrincipal':
+        return cls(
+            id=user.id,
+            full_name=user.full_name,
+            email=user.email,
+            phone=user.phone,
+            company_name=user.company_name,
+            role=user.role,
+            status=user.status,
+            created_at=user.created_at,
+            last_login=user.last_login
+        )
+
+
+class PrincipalCache:
+    """Bounded LRU cache of UserPrincipal snapshots with a time-to-live
+
+    The cache is per process. Changes made through the admin endpoints
+    invalidate the entry in the worker that handled them; other workers pick
+    the change up once the entry expires, so keep the TTL short.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = 30.0, clock: Callable[[], float] = time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._clock = clock
+        self._entries: 'OrderedDict[str, tuple]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, user_id: str, loader: Callable[[str], Any]) -> Optional[UserPrincipal]:
+        """Return the cached principal, loading it with loader(user_id) on a miss
+
+        loader returns a User (or None if it does not exist); missing users are
+        not cached.
+        """
+        if self.max_size <= 0 or self.ttl <= 0:
+            user = loader(user_id)
+            return UserPrincipal.from_user(user) if user else None
+
+        now = self._clock()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry and entry[0] > now:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        user = loader(user_id)
+        if not user:
+            return None
+        principal = UserPrincipal.from_user(user)
+        with self._lock:
+            self._entries[user_id] = (now + self.ttl, principal)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return principal
+
+    def invalidate(self, user_id: str) -> None:
+        with self._lock:
+            if self._entries.pop(user_id, None) is not None:
+                self.invalidations += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl_seconds': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations
+            }
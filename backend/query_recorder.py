@@ -0,0 +1,89 @@
+"""
+SQL query recorder
+Records the statements one thread sends to the database and groups them by
+shape, so a statement repeated once per row (an N+1 pattern) stands out.
+Used by the test suite to hold endpoints to a query budget and, with
+QUERY_PROFILE set, to report repeated statements per request. Statements come
+from the SQLAlchemy listeners of metrics.QueryStats, so a recorder adds no
+listeners of its own
+"""
+
+import re
+from collections import Counter
+from typing import List, Optional, Tuple
+
+from sqlalchemy.engine import Engine
+
+from metrics import QueryStats, query_stats
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PARAMETER = re.compile(r'\?|%\(\w+\)s|%s|(?<!:):\w+')
+_PARAMETER_LIST = re.compile(r'\((?:\s*\?\s*,)+\s*\?\s*\)')
+_SPACE = re.compile(r'\s+')
+
+
+def statement_shape(statement: str) -> str:
+    """The statement with literals and bound parameters replaced by '?'
+
+    IN lists of any length collapse to '(?...)', so one query per page and
+    one query per row are told apart by count, not by text.
+    """
+    shape = _STRING.sub('?', statement)
+    shape = _PARAMETER.sub('?', shape)
+    shape = _NUMBER.sub('?', shape)
+    shape = _SPACE.sub(' ', shape).strip()
+    return _PARAMETER_LIST.sub('(?...)', shape)
+
+
+class QueryRecorder:
+    """Statements executed by the current thread between start() and stop()
+
+    Usable as a context manager; recorders may be nested, and each sees every
+    statement run while it is active. Statements from other threads (e.g.
+    background workers) are never recorded.
+    """
+
+    def __init__(self, stats: Optional[QueryStats] = None):
+        self.stats = stats or query_stats
+        self.statements: List[Tuple[str, float]] = []
+
+    def start(self) -> 'QueryRecorder':
+        self.stats.install(Engine)
+        self.stats.attach(self)
+        return self
+
+    def stop(self) -> 'QueryRecorder':
+        self.stats.detach(self)
+        return self
+
+    def record(self, statement: str, seconds: float) -> None:
+        self.statements.append((statement, seconds))
+
+    def __enter__(self) -> 'QueryRecorder':
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+    @property
+    def seconds(self) -> float:
+        return sum(elapsed for _, elapsed in self.statements)
+
+    def shapes(self) -> Counter:
+        """How many times each statement shape ran"""
+        return Counter(statement_shape(statement) for statement, _ in self.statements)
+
+    def repeated(self, min_count: int = 2) -> List[Tuple[str, int]]:
+        """Shapes that ran at least min_count times, most frequent first"""
+        return [(shape, count) for shape, count in self.shapes().most_common() if count >= min_count]
+
+    def report(self, limit: int = 10) -> str:
+        lines = [f'{self.count} statements in {self.seconds * 1000:.1f} ms']
+        for shape, count in self.shapes().most_common(limit):
+            lines.append(f'{count:5d} x {shape[:300]}')
+        return '\n'.join(lines)
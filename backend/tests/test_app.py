@@ -1,7 +1,23 @@
 import unittest
+import csv
+import gzip
+import io
 import json
+import os
+import shutil
+import tempfile
 import base64
-from app import app, db, User
+import datetime
+import uuid
+import jwt
+from unittest import mock
+import app as app_module
+from query_recorder import QueryRecorder
+from password_policy import PasswordPolicy
+from certificate_store import CertificateStore, StoredFile
+from app import (app, db, User, Location, News, Donation, Certificate, DonationSummary, CertificateRenderJob,
+                 WebhookEvent, principal_cache)
+
 
 class AuthTestCase(unittest.TestCase):
     def setUp(self):
@@ -52,5 +68,1139 @@ class AuthTestCase(unittest.TestCase):
         data = json.loads(response.data)
         self.assertTrue('token' in data)
 
+class ApiTestCase(unittest.TestCase):
+    """Shared fixtures: a donor, a location and authenticated request helpers"""
+
+    def setUp(self):
+        app.config['TESTING'] = True
+        self.app = app.test_client()
+        self.app_context = app.app_context()
+        self.app_context.push()
+        db.create_all()
+        principal_cache.clear()
+        app_module._catalog_bodies.clear()
+
+        self.user = User(id=str(uuid.uuid4()), full_name='Donor', email='donor@example.com', password='x')
+        self.location = Location(id='loc_1', name='Forest of Central Asia')
+        db.session.add_all([self.user, self.location])
+        db.session.commit()
+        self.headers = self.auth_headers(self.user)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def auth_headers(self, user):
+        token = jwt.encode({'id': user.id, 'exp': datetime.datetime.utcnow() + datetime.timedelta(hours=1)},
+                           app.config['SECRET_KEY'], algorithm="HS256")
+        return {'Authorization': f'Bearer {token}'}
+
+    def make_admin(self):
+        admin = User(id='usr_admin', full_name='Admin', email='admin@example.com', password='x', role='admin')
+        db.session.add(admin)
+        db.session.commit()
+        return admin
+
+    def enable_ioka(self, ioka=None):
+        """Turn the Ioka integration on for this test, with a mock client whose webhook signatures pass"""
+        if ioka is None:
+            ioka = mock.Mock()
+            ioka.verify_webhook_signature.return_value = True
+        for patch in (mock.patch.object(app_module, 'IOKA_ENABLED', True),
+                      mock.patch.object(app_module, 'ioka_service', ioka, create=True)):
+            patch.start()
+            self.addCleanup(patch.stop)
+        return ioka
+
+    def add_donations(self, count, start=0, user=None, status='completed', email=None):
+        user = user or self.user
+        base = datetime.datetime(2024, 1, 1)
+        for i in range(start, start + count):
+            donation = Donation(
+                id=f'don_{i:04d}', location_id=self.location.id, user_id=user.id,
+                email=email or user.email, tree_count=2, amount=5000, status=status,
+                created_at=base + datetime.timedelta(minutes=i), donor_info={}
+            )
+            db.session.add(donation)
+            db.session.add(Certificate(id=f'cert_{i:04d}', donation_id=donation.id,
+                                       created_date=base + datetime.timedelta(minutes=i)))
+        db.session.commit()
+
+    def record_queries(self, url, headers=None):
+        db.session.expire_all()
+        principal_cache.clear()
+        with QueryRecorder() as recorder:
+            response = self.app.get(url, headers=headers or self.headers)
+        self.assertEqual(response.status_code, 200, url)
+        return recorder
+
+    def count_queries(self, url):
+        return self.record_queries(url).count
+
+    def assertMaxQueries(self, url, budget, headers=None):
+        """Fail with the statement shapes when url needs more than budget statements"""
+        recorder = self.record_queries(url, headers)
+        if recorder.count > budget:
+            self.fail(f'{url} ran {recorder.count} statements, budget is {budget}\n{recorder.report()}')
+
+
+class IndexTestCase(ApiTestCase):
+    def test_hot_queries_use_indexes(self):
+        result = app.test_cli_runner().invoke(args=['explain-hot-queries'])
+        self.assertEqual(result.exit_code, 0, result.output)
+
+    def test_email_lookup_ignores_case(self):
+        self.app.post('/api/auth/register', json=dict(
+            full_name='Test User', email='Mixed.Case@example.com', password='password', phone='1'))
+        auth_string = base64.b64encode(b'mixed.case@EXAMPLE.com:password').decode('utf-8')
+        response = self.app.post('/api/auth/login', headers={'Authorization': f'Basic {auth_string}'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_request_log_line(self):
+        with self.assertLogs('app.request', level='INFO') as logs:
+            self.app.post('/api/contact', json={'name': 'Secret Donor', 'email': 'a@example.com', 'message': 'Hi'})
+        record = logs.records[-1]
+        self.assertEqual((record.route, record.status, record.method), ('/api/contact', 200, 'POST'))
+        self.assertGreaterEqual(record.duration_ms, 0)
+        self.assertNotIn('Secret Donor', record.getMessage())
+
+    def test_certificate_donation_is_unique(self):
+        self.add_donations(1)
+        db.session.add(Certificate(id='cert_dup', donation_id='don_0000'))
+        with self.assertRaises(Exception):
+            db.session.commit()
+        db.session.rollback()
+
+
+class PrincipalCacheTestCase(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.admin = self.make_admin()
+        self.admin_headers = self.auth_headers(self.admin)
+
+    def test_repeated_requests_skip_user_lookup(self):
+        hits, misses = principal_cache.hits, principal_cache.misses
+        self.assertEqual(self.app.get('/api/users/me', headers=self.headers).status_code, 200)
+        with QueryRecorder() as counter:
+            response = self.app.get('/api/users/me', headers=self.headers)
+        self.assertEqual(response.get_json()['email'], 'donor@example.com')
+        self.assertEqual(counter.count, 0)
+        self.assertEqual((principal_cache.hits - hits, principal_cache.misses - misses), (1, 1))
+
+        stats = self.app.get('/api/admin/stats/principal-cache', headers=self.admin_headers).get_json()
+        self.assertEqual(stats['hits'], principal_cache.hits)
+
+    def test_admin_changes_invalidate(self):
+        self.app.get('/api/users/me', headers=self.headers)
+        self.app.put(f'/api/admin/users/{self.user.id}', json={'role': 'admin'}, headers=self.admin_headers)
+        self.assertEqual(self.app.get('/api/users/me', headers=self.headers).get_json()['role'], 'admin')
+
+        self.app.delete(f'/api/admin/users/{self.user.id}', headers=self.admin_headers)
+        self.assertEqual(self.app.get('/api/users/me', headers=self.headers).status_code, 401)
+
+
+class CabinetTestCase(ApiTestCase):
+    def test_query_count_is_constant(self):
+        for url in ['/api/users/me/donations', '/api/users/me/certificates', '/api/users/me/dashboard']:
+            self.add_donations(3, start=len(Donation.query.all()))
+            small = self.count_queries(url)
+            self.add_donations(40, start=len(Donation.query.all()))
+            self.assertEqual(self.count_queries(url), small, url)
+
+    def test_donations_joined_fields(self):
+        self.add_donations(2)
+        data = self.app.get('/api/users/me/donations', headers=self.headers).get_json()
+        self.assertEqual([d['id'] for d in data], ['don_0001', 'don_0000'])
+        self.assertEqual(data[0]['location'], 'Forest of Central Asia')
+        self.assertEqual(data[0]['certificate_id'], 'cert_0001')
+
+    def test_cursor_pagination(self):
+        self.add_donations(5)
+        seen = []
+        url = '/api/users/me/certificates?limit=2'
+        while url:
+            response = self.app.get(url, headers=self.headers)
+            seen.extend(c['id'] for c in response.get_json())
+            cursor = response.headers.get('X-Next-Cursor')
+            url = f'/api/users/me/certificates?limit=2&cursor={cursor}' if cursor else None
+        self.assertEqual(seen, [f'cert_{i:04d}' for i in reversed(range(5))])
+
+    def test_unpaged_request_returns_everything(self):
+        self.add_donations(app_module.DEFAULT_PAGE_SIZE + 5)
+        response = self.app.get('/api/users/me/donations', headers=self.headers)
+        self.assertEqual(len(response.get_json()), app_module.DEFAULT_PAGE_SIZE + 5)
+        self.assertNotIn('X-Next-Cursor', response.headers)
+        response = self.app.get('/api/users/me/certificates?cursor=cert_0010', headers=self.headers)
+        self.assertEqual(len(response.get_json()), 10)
+
+    def test_cursor_follows_created_at_not_id(self):
+        base = datetime.datetime(2024, 1, 1)
+        # Ids run against creation time, so an id-only comparison would skip or repeat rows
+        for i, donation_id in enumerate(['don_c', 'don_a', 'don_d', 'don_b']):
+            db.session.add(Donation(id=donation_id, location_id=self.location.id, user_id=self.user.id,
+                                    tree_count=1, amount=2500, status='completed',
+                                    created_at=base + datetime.timedelta(minutes=i), donor_info={}))
+        db.session.commit()
+        seen = []
+        url = '/api/users/me/donations?limit=1'
+        while url:
+            response = self.app.get(url, headers=self.headers)
+            seen.extend(d['id'] for d in response.get_json())
+            cursor = response.headers.get('X-Next-Cursor')
+            url = f'/api/users/me/donations?limit=1&cursor={cursor}' if cursor else None
+        self.assertEqual(seen, ['don_b', 'don_d', 'don_a', 'don_c'])
+
+    def test_dashboard(self):
+        self.add_donations(3)
+        data = self.app.get('/api/users/me/dashboard?limit=2', headers=self.headers).get_json()
+        self.assertEqual(len(data['donations']), 2)
+        self.assertEqual(len(data['certificates']), 2)
+        self.assertEqual(data['totals'], {'donations_count': 3, 'trees_planted': 6, 'total_amount': 15000})
+        self.assertEqual(data['next_cursor'], 'don_0001')
+
+class AdminDonationsTestCase(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.admin = self.make_admin()
+        self.headers = self.auth_headers(self.admin)
+
+    def test_query_count_is_constant(self):
+        self.add_donations(3)
+        small = self.count_queries('/api/admin/donations')
+        self.add_donations(40, start=3)
+        self.assertEqual(self.count_queries('/api/admin/donations'), small)
+
+    def test_unparameterised_call_is_capped(self):
+        self.add_donations(app_module.DEFAULT_PAGE_SIZE + 5)
+        data = self.app.get('/api/admin/donations', headers=self.headers).get_json()
+        self.assertEqual(len(data['donations']), app_module.DEFAULT_PAGE_SIZE)
+        data = self.app.get(f"/api/admin/donations?cursor={data['next_cursor']}", headers=self.headers).get_json()
+        self.assertEqual((len(data['donations']), data['next_cursor']), (5, None))
+
+    def test_joined_donor_and_location(self):
+        self.add_donations(1)
+        donation = self.app.get('/api/admin/donations', headers=self.headers).get_json()['donations'][0]
+        self.assertEqual(donation['donor_name'], 'Donor')
+        self.assertEqual(donation['email'], 'donor@example.com')
+        self.assertEqual(donation['location'], 'Forest of Central Asia')
+
+    def test_filters(self):
+        self.add_donations(3)
+        self.add_donations(2, start=3, status='pending')
+        get = lambda query: [d['id'] for d in self.app.get(
+            f'/api/admin/donations?{query}', headers=self.headers).get_json()['donations']]
+        self.assertEqual(get('status=pending'), ['don_0004', 'don_0003'])
+        self.assertEqual(get('email=DONOR@&status=completed'), ['don_0002', 'don_0001', 'don_0000'])
+        self.assertEqual(get('email=nobody'), [])
+        self.assertEqual(get('location_id=loc_2'), [])
+        self.assertEqual(len(get('date_from=2024-01-01&date_to=2024-01-01')), 5)
+        self.assertEqual(get('date_from=2024-01-02'), [])
+        response = self.app.get('/api/admin/donations?date_from=yesterday', headers=self.headers)
+        self.assertEqual(response.status_code, 400)
+
+        # Registered donors' donations may carry the address only on the account
+        db.session.get(Donation, 'don_0002').email = None
+        db.session.commit()
+        self.assertEqual(get('email=Donor@Example.com&status=completed'), ['don_0002', 'don_0001', 'don_0000'])
+
+    def test_cursor_pagination(self):
+        self.add_donations(5)
+        first = self.app.get('/api/admin/donations?limit=3', headers=self.headers).get_json()
+        self.assertEqual(first['next_cursor'], 'don_0002')
+        second = self.app.get(f"/api/admin/donations?limit=3&cursor={first['next_cursor']}",
+                              headers=self.headers).get_json()
+        self.assertEqual([d['id'] for d in second['donations']], ['don_0001', 'don_0000'])
+        self.assertIsNone(second['next_cursor'])
+
+class AdminUsersTestCase(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.admin = self.make_admin()
+        # usr_0 has no donations, usr_1 one, usr_2 two, ...
+        self.donors = []
+        start = 0
+        for i in range(5):
+            donor = User(id=f'usr_{i}', full_name=f'Person {i}', email=f'person{i}@example.com', password='x')
+            db.session.add(donor)
+            db.session.commit()
+            self.add_donations(i, start=start, user=donor)
+            start += i
+            self.donors.append(donor)
+        self.headers = self.auth_headers(self.admin)
+
+    def get_all(self, query):
+        ids, cursor = [], None
+        while True:
+            url = f'/api/admin/users?limit=2&{query}' + (f'&cursor={cursor}' if cursor else '')
+            data = self.app.get(url, headers=self.headers).get_json()
+            ids.extend(u['id'] for u in data['users'])
+            cursor = data['next_cursor']
+            if not cursor:
+                return ids
+
+    def test_aggregates(self):
+        users = self.app.get('/api/admin/users?q=person3', headers=self.headers).get_json()['users']
+        self.assertEqual(len(users), 1)
+        self.assertEqual((users[0]['donations_count'], users[0]['trees_planted'], users[0]['total_amount']),
+                         (3, 6, 15000))
+
+    def test_sort_by_aggregate_across_pages(self):
+        self.assertEqual(self.get_all('sort=trees_planted'),
+                         ['usr_4', 'usr_3', 'usr_2', 'usr_1']
+                         + sorted(['usr_admin', 'usr_0', self.user.id], reverse=True))
+        self.assertEqual(self.get_all('sort=donations_count&order=asc&q=person'),
+                         ['usr_0', 'usr_1', 'usr_2', 'usr_3', 'usr_4'])
+
+    def test_sort_by_name(self):
+        self.assertEqual(self.get_all('sort=name&order=asc&q=per'),
+                         ['usr_0', 'usr_1', 'usr_2', 'usr_3', 'usr_4'])
+        response = self.app.get('/api/admin/users?sort=password', headers=self.headers)
+        self.assertEqual(response.status_code, 400)
+
+    def test_query_count_is_constant(self):
+        small = self.count_queries('/api/admin/users')
+        self.add_donations(30, start=100, user=self.donors[0])
+        self.assertEqual(self.count_queries('/api/admin/users'), small)
+
+class DonationSummaryTestCase(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.admin = self.make_admin()
+        db.session.add(Location(id='loc_2', name='Empty Grove'))
+        db.session.commit()
+        self.headers = self.auth_headers(self.admin)
+
+    def rollup(self):
+        return {(row.location_id, row.status): (row.donations, row.trees, row.revenue)
+                for row in DonationSummary.query.all() if row.donations}
+
+    def test_rollup_follows_donation_changes(self):
+        self.add_donations(3, status='pending')
+        self.assertEqual(self.rollup(), {('loc_1', 'pending'): (3, 6, 15000)})
+
+        response = self.app.put('/api/admin/donations/don_0001', json={'status': 'completed'},
+                                headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.rollup(), {('loc_1', 'pending'): (2, 4, 10000),
+                                         ('loc_1', 'completed'): (1, 2, 5000)})
+
+        Certificate.query.filter_by(donation_id='don_0000').delete()
+        db.session.delete(Donation.query.get('don_0000'))
+        db.session.commit()
+        self.assertEqual(self.rollup(), {('loc_1', 'pending'): (1, 2, 5000),
+                                         ('loc_1', 'completed'): (1, 2, 5000)})
+
+    def test_report_reads_rollup(self):
+        self.add_donations(2, status='pending')
+        self.add_donations(1, start=2, status='processing')
+        data = self.app.get('/api/admin/reports/donations-summary', headers=self.headers).get_json()
+        self.assertEqual(data['total_donations'], 3)
+        self.assertEqual(data['pending_count'], 2)
+        self.assertEqual(data['processing_count'], 1)
+        self.assertEqual(data['total_revenue'], 15000)
+        self.assertEqual(data['trees_planted'], 6)
+        self.assertEqual(data['by_location'], {
+            'Forest of Central Asia': {'donations': 3, 'trees': 6, 'revenue': 15000},
+            'Empty Grove': {'donations': 0, 'trees': 0, 'revenue': 0}
+        })
+
+    def test_rebuild_command(self):
+        self.add_donations(2)
+        runner = app.test_cli_runner()
+        self.assertEqual(runner.invoke(args=['rebuild-donation-summary', '--check']).exit_code, 0)
+
+        DonationSummary.query.delete()
+        db.session.commit()
+        result = runner.invoke(args=['rebuild-donation-summary', '--check'])
+        self.assertEqual(result.exit_code, 1)
+        self.assertIn('1 drifted rollup rows', result.output)
+
+        result = runner.invoke(args=['rebuild-donation-summary'])
+        self.assertEqual(result.exit_code, 0)
+        self.assertEqual(self.rollup(), {('loc_1', 'completed'): (2, 4, 10000)})
+
+class LocationProgressTestCase(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.location.capacity_trees = 1000
+        self.location.planted_trees = 100
+        db.session.add(Location(id='loc_2', name='Steppe', capacity_trees=None, planted_trees=None))
+        db.session.add(Donation(id='don_pay', location_id=self.location.id, user_id=self.user.id,
+                                email=self.user.email, tree_count=5, amount=12500, status='awaiting_payment',
+                                donor_info={}, payment_order_id='ord_pay'))
+        db.session.commit()
+
+    def planted(self, location_id='loc_1'):
+        db.session.expire_all()
+        return db.session.get(Location, location_id).planted_trees
+
+    def test_payment_increments_counter_in_one_update(self):
+        self.enable_ioka()
+        with QueryRecorder() as recorder:
+            self.app.post('/api/webhooks/ioka', json={'event': 'payment.succeeded',
+                                                      'object': {'external_id': 'don_pay'}})
+        self.assertEqual(self.planted(), 105)
+        updates = [shape for shape in recorder.shapes() if shape.startswith('UPDATE location')]
+        self.assertEqual(updates, ['UPDATE location SET planted_trees=(coalesce(location.planted_trees, ?) + ?) '
+                                   'WHERE location.id = ?'])
+
+        # A redelivered webhook changes nothing
+        self.app.post('/api/webhooks/ioka', json={'event': 'payment.succeeded', 'object': {'external_id': 'don_pay'}})
+        self.assertEqual(self.planted(), 105)
+
+    def test_only_completed_donations_count(self):
+        donation = db.session.get(Donation, 'don_pay')
+        donation.status = 'failed'
+        db.session.commit()
+        self.assertEqual(self.planted(), 100)
+        donation.status = 'completed'
+        db.session.commit()
+        self.assertEqual(self.planted(), 105)
+        # Moving a donation off completed (e.g. a refund by an admin) takes its trees back
+        donation.status = 'cancelled'
+        db.session.commit()
+        self.assertEqual(self.planted(), 100)
+
+        db.session.add(Donation(id='don_new', location_id='loc_2', tree_count=3, amount=7500,
+                                status='completed', donor_info={}))
+        db.session.commit()
+        self.assertEqual(self.planted('loc_2'), 3)
+
+    def test_progress_endpoint(self):
+        response = self.app.get('/api/locations/progress')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json(), {
+            'locations': [
+                {'id': 'loc_1', 'name': 'Forest of Central Asia', 'status': None, 'capacity_trees': 1000,
+                 'planted_trees': 100, 'percent': 10.0},
+                {'id': 'loc_2', 'name': 'Steppe', 'status': None, 'capacity_trees': None,
+                 'planted_trees': 0, 'percent': None}
+            ],
+            'planted_trees': 100,
+            'capacity_trees': 1000
+        })
+        etag = response.headers['ETag']
+        self.assertEqual(self.app.get('/api/locations/progress', headers={'If-None-Match': etag}).status_code, 304)
+
+        db.session.get(Donation, 'don_pay').status = 'completed'
+        db.session.commit()
+        response = self.app.get('/api/locations/progress', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['planted_trees'], 105)
+
+class CertificateQueueTestCase(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.donation = Donation(id='don_paid', location_id=self.location.id, user_id=self.user.id,
+                                 email=self.user.email, tree_count=3, amount=7500, status='awaiting_payment',
+                                 donor_info={'full_name': 'Donor'}, payment_order_id='ord_1')
+        db.session.add(self.donation)
+        db.session.commit()
+        self.enable_ioka()
+
+    def send_webhook(self):
+        return self.app.post('/api/webhooks/ioka', json={
+            'event': 'payment.succeeded', 'object': {'external_id': 'don_paid'}})
+
+    def status(self):
+        return self.app.get('/api/donations/don_paid/status').get_json()
+
+    def test_webhook_only_enqueues(self):
+        with mock.patch.object(app_module, 'generate_certificate_pdf') as render:
+            self.assertEqual(self.send_webhook().status_code, 200)
+            self.assertEqual(self.send_webhook().status_code, 200)
+            render.assert_not_called()
+        self.assertEqual(CertificateRenderJob.query.count(), 1)
+        status = self.status()
+        self.assertEqual((status['status'], status['certificate_status']), ('completed', 'rendering'))
+        self.assertFalse(status['certificate_available'])
+
+        with mock.patch.object(app_module, 'generate_certificate_pdf', return_value=StoredFile('ab' * 32, 1234)):
+            self.assertTrue(app_module.process_next_certificate_job())
+        self.assertFalse(app_module.process_next_certificate_job())
+        status = self.status()
+        self.assertEqual(status['certificate_status'], 'ready')
+        self.assertEqual(status['certificate_url'], '/api/certificates/don_paid.pdf')
+        certificate = Certificate.query.one()
+        self.assertEqual((certificate.file_sha256, certificate.file_size), ('ab' * 32, 1234))
+
+    def test_failed_render_is_retried_with_backoff(self):
+        self.send_webhook()
+        with mock.patch.object(app_module, 'generate_certificate_pdf', return_value=None):
+            self.assertTrue(app_module.process_next_certificate_job())
+            job = CertificateRenderJob.query.one()
+            self.assertEqual((job.status, job.attempts), ('queued', 1))
+            self.assertGreater(job.next_attempt_at, datetime.datetime.utcnow())
+            # Not due yet
+            self.assertFalse(app_module.process_next_certificate_job())
+
+            for attempt in range(2, app_module.CERTIFICATE_MAX_ATTEMPTS + 1):
+                job.next_attempt_at = datetime.datetime.utcnow()
+                db.session.commit()
+                self.assertTrue(app_module.process_next_certificate_job())
+                job = CertificateRenderJob.query.one()
+                self.assertEqual(job.attempts, attempt)
+        self.assertEqual(job.status, 'failed')
+        self.assertEqual(self.status()['certificate_status'], 'failed')
+
+    def test_expired_lease_is_reclaimed(self):
+        self.send_webhook()
+        job = CertificateRenderJob.query.one()
+        job.status = 'rendering'
+        job.locked_until = datetime.datetime.utcnow() - datetime.timedelta(seconds=1)
+        db.session.commit()
+        with mock.patch.object(app_module, 'generate_certificate_pdf', return_value=StoredFile('ab' * 32, 1234)):
+            self.assertTrue(app_module.process_next_certificate_job())
+        self.assertEqual(CertificateRenderJob.query.one().status, 'done')
+
+    def test_rerender_replaces_stored_file(self):
+        store = CertificateStore(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, store.root)
+        old = store.write(lambda path: open(path, 'wb').write(b'%PDF-old'))
+        self.donation.status = 'completed'
+        db.session.add(Certificate(id='cert_paid', donation_id='don_paid', file_sha256=old.digest, file_size=old.size))
+        app_module.enqueue_certificate_render('don_paid', force=True)
+        db.session.commit()
+        new = store.write(lambda path: open(path, 'wb').write(b'%PDF-new'))
+        with mock.patch.object(app_module, 'certificate_store', store), \
+                mock.patch.object(app_module, 'generate_certificate_pdf', return_value=new):
+            self.assertTrue(app_module.process_next_certificate_job())
+        self.assertEqual(Certificate.query.one().file_sha256, new.digest)
+        self.assertFalse(os.path.exists(store.path(old.digest)))
+        self.assertTrue(os.path.exists(store.path(new.digest)))
+
+    @unittest.skipUnless(app_module.PDF_ENABLED, 'reportlab not installed')
+    def test_render_reuses_fonts(self):
+        self.donation.status = 'completed'
+        db.session.commit()
+        store = CertificateStore(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, store.root)
+        renderer = app_module.certificate_renderer
+        with mock.patch.object(renderer, 'register_fonts', wraps=renderer.register_fonts) as register, \
+                mock.patch.object(app_module, 'certificate_store', store):
+            for _ in range(2):
+                stored = app_module.generate_certificate_pdf(self.donation)
+            register.assert_not_called()
+        with open(store.path(stored.digest), 'rb') as pdf:
+            self.assertEqual(pdf.read(5), b'%PDF-')
+        self.assertEqual(os.listdir(store.tmp_dir), [])
+
+class CertificateDeliveryTestCase(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.filename = f'test_{uuid.uuid4().hex}.pdf'
+        self.file_path = os.path.join(app.root_path, 'static', 'certificates', self.filename)
+        os.makedirs(os.path.dirname(self.file_path), exist_ok=True)
+        self.write(b'%PDF-1.4 certificate body')
+        self.addCleanup(os.remove, self.file_path)
+
+    def write(self, content):
+        with open(self.file_path, 'wb') as pdf:
+            pdf.write(content)
+        self.etag = app_module.hashlib.sha256(content).hexdigest()[:32]
+
+    def get(self, headers=None):
+        return self.app.get(f'/api/certificates/{self.filename}', headers=headers)
+
+    def test_direct_mode_honours_etag_and_range(self):
+        response = self.get()
+        self.assertEqual((response.status_code, response.data), (200, b'%PDF-1.4 certificate body'))
+        self.assertEqual(response.headers['ETag'], f'"{self.etag}"')
+        self.assertEqual(response.mimetype, 'application/pdf')
+        self.assertIn('max-age=86400', response.headers['Cache-Control'])
+
+        self.assertEqual(self.get({'If-None-Match': f'"{self.etag}"'}).status_code, 304)
+        response = self.get({'Range': 'bytes=0-3'})
+        self.assertEqual((response.status_code, response.data), (206, b'%PDF'))
+        self.assertEqual(response.headers['Content-Range'], 'bytes 0-3/25')
+
+        # A re-rendered file gets a new ETag
+        self.write(b'%PDF-1.4 rendered again')
+        response = self.get({'If-None-Match': f'"{self.etag}"'})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers['ETag'], f'"{self.etag}"')
+
+    def test_missing_file(self):
+        response = self.app.get('/api/certificates/missing.pdf')
+        self.assertEqual(response.status_code, 404)
+
+    def store_certificate(self):
+        store = CertificateStore(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, store.root)
+        stored = store.write(lambda path: open(path, 'wb').write(b'%PDF-1.4 stored'))
+        self.add_donations(1)
+        certificate = Certificate.query.one()
+        certificate.file_sha256, certificate.file_size = stored.digest, stored.size
+        db.session.commit()
+        patch = mock.patch.object(app_module, 'certificate_store', store)
+        patch.start()
+        self.addCleanup(patch.stop)
+        return store, stored
+
+    def test_stored_certificate_is_found_from_its_row(self):
+        store, stored = self.store_certificate()
+        response = self.app.get('/api/certificates/don_0000.pdf')
+        self.assertEqual((response.status_code, response.data), (200, b'%PDF-1.4 stored'))
+        self.assertEqual(response.headers['ETag'], f'"{stored.digest[:32]}"')
+
+        with mock.patch.object(app_module, 'CERTIFICATE_DELIVERY', 'x-accel-redirect'), \
+                mock.patch.object(app_module.os, 'stat', side_effect=AssertionError('filesystem touched')):
+            response = self.app.get('/api/certificates/don_0000.pdf')
+        self.assertEqual(response.headers['X-Accel-Redirect'],
+                         f'/internal/certificates/{stored.digest[:2]}/{stored.digest[2:4]}/{stored.digest}.pdf')
+
+        os.remove(store.path(stored.digest))
+        self.assertEqual(self.app.get('/api/certificates/don_0000.pdf').status_code, 404)
+
+    def test_migrate_flat_files_into_store(self):
+        store, _ = self.store_certificate()
+        self.add_donations(2, start=1)
+        with mock.patch.object(app_module, 'CERTIFICATES_DIR', os.path.dirname(self.file_path)):
+            flat_file = os.path.join(app_module.CERTIFICATES_DIR, 'don_0001.pdf')
+            with open(flat_file, 'wb') as pdf:
+                pdf.write(b'%PDF-1.4 flat')
+            result = app.test_cli_runner().invoke(args=['migrate-certificates', '--batch-size', '1'])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('Moved 1 certificate files into the store, 1 certificates have no file', result.output)
+        self.assertFalse(os.path.exists(flat_file))
+        certificate = db.session.get(Certificate, 'cert_0001')
+        self.assertEqual(certificate.file_size, len(b'%PDF-1.4 flat'))
+        with open(store.path(certificate.file_sha256), 'rb') as pdf:
+            self.assertEqual(pdf.read(), b'%PDF-1.4 flat')
+        self.assertEqual(self.app.get('/api/certificates/don_0001.pdf').data, b'%PDF-1.4 flat')
+
+    def test_proxy_modes_send_no_body(self):
+        with mock.patch.object(app_module, 'CERTIFICATE_DELIVERY', 'x-accel-redirect'):
+            response = self.get({'Range': 'bytes=0-3'})
+            self.assertEqual((response.status_code, response.data), (200, b''))
+            self.assertEqual(response.headers['X-Accel-Redirect'], f'/internal/certificates/{self.filename}')
+            self.assertEqual(response.headers['ETag'], f'"{self.etag}"')
+            self.assertEqual(response.headers['Accept-Ranges'], 'bytes')
+
+            response = self.get({'If-None-Match': f'"{self.etag}"'})
+            self.assertEqual(response.status_code, 304)
+            self.assertNotIn('X-Accel-Redirect', response.headers)
+
+        with mock.patch.object(app_module, 'CERTIFICATE_DELIVERY', 'x-sendfile'):
+            response = self.get()
+        self.assertEqual(response.headers['X-Sendfile'], self.file_path)
+        self.assertEqual(response.data, b'')
+
+class PaymentReconcilerTestCase(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        long_ago = datetime.datetime.utcnow() - datetime.timedelta(minutes=5)
+        for status in ('PAID', 'DECLINED', 'CANCELLED', 'EXPIRED', 'CREATED'):
+            db.session.add(Donation(id=f'don_{status.lower()}', location_id=self.location.id, user_id=self.user.id,
+                                    email=self.user.email, tree_count=1, amount=2500, status='awaiting_payment',
+                                    donor_info={}, payment_order_id=f'ord_{status}', payment_checked_at=long_ago))
+        # Checked moments ago: not due yet
+        db.session.add(Donation(id='don_recent', user_id=self.user.id, tree_count=1, amount=2500,
+                                status='awaiting_payment', donor_info={}, payment_order_id='ord_PAID_recent'))
+        db.session.commit()
+        self.ioka = mock.Mock()
+        self.ioka.get_payment_status.side_effect = lambda order_id: {'success': True, 'status': order_id[4:]}
+        self.enable_ioka(self.ioka)
+
+    def test_status_endpoint_does_not_call_ioka(self):
+        with QueryRecorder() as counter:
+            response = self.app.get('/api/donations/don_paid/status')
+        self.assertEqual(response.get_json()['status'], 'awaiting_payment')
+        self.ioka.get_payment_status.assert_not_called()
+        self.assertEqual(db.session.get(Donation, 'don_paid').status, 'awaiting_payment')
+        self.assertGreater(counter.count, 0)
+
+    def test_sweep_applies_transitions(self):
+        self.assertEqual(app_module.reconcile_awaiting_payments(), 5)
+        db.session.expire_all()
+        statuses = {donation.id: donation.status for donation in Donation.query.all()}
+        self.assertEqual(statuses, {
+            'don_paid': 'completed', 'don_declined': 'failed', 'don_cancelled': 'cancelled',
+            'don_expired': 'cancelled', 'don_created': 'awaiting_payment', 'don_recent': 'awaiting_payment'
+        })
+        self.assertEqual([job.donation_id for job in CertificateRenderJob.query.all()], ['don_paid'])
+        self.assertEqual(self.status_of('don_paid'), ('completed', 'rendering'))
+        # Everything just checked is not due again until the interval passes
+        self.assertEqual(app_module.reconcile_awaiting_payments(), 0)
+        self.assertEqual(self.ioka.get_payment_status.call_count, 5)
+
+    def test_sweep_is_batched(self):
+        self.assertEqual(app_module.reconcile_awaiting_payments(limit=2), 2)
+        self.assertEqual(app_module.reconcile_awaiting_payments(limit=2), 2)
+        self.assertEqual(app_module.reconcile_awaiting_payments(limit=2), 1)
+
+    def test_failed_lookup_keeps_donation_waiting(self):
+        self.ioka.get_payment_status.side_effect = lambda order_id: {'success': False, 'error': 'timeout'}
+        app_module.reconcile_awaiting_payments()
+        db.session.expire_all()
+        self.assertEqual(db.session.get(Donation, 'don_paid').status, 'awaiting_payment')
+
+    def status_of(self, donation_id):
+        status = self.app.get(f'/api/donations/{donation_id}/status').get_json()
+        return status['status'], status['certificate_status']
+
+class WebhookInboxTestCase(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        db.session.add(Donation(id='don_hook', location_id=self.location.id, user_id=self.user.id,
+                                email=self.user.email, tree_count=2, amount=5000, status='awaiting_payment',
+                                donor_info={}, payment_order_id='ord_hook'))
+        db.session.commit()
+        self.enable_ioka()
+
+    def send(self, event, **extra):
+        return self.app.post('/api/webhooks/ioka', json={
+            'event': event, 'object': {'external_id': 'don_hook', 'id': 'pay_1'}, **extra})
+
+    def donation_status(self):
+        db.session.expire_all()
+        return db.session.get(Donation, 'don_hook').status
+
+    def test_ack_only_stores_while_worker_runs(self):
+        with mock.patch.object(app_module, 'webhook_worker') as worker:
+            worker.running = True
+            response = self.send('payment.succeeded')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json(), {'success': True, 'duplicate': False})
+        worker.wake.assert_called_once_with()
+        self.assertEqual(self.donation_status(), 'awaiting_payment')
+        self.assertEqual(CertificateRenderJob.query.count(), 0)
+        event = WebhookEvent.query.one()
+        self.assertEqual((event.status, event.event_key), ('pending', 'payment.succeeded:pay_1'))
+        self.assertEqual(json.loads(event.payload)['object']['external_id'], 'don_hook')
+
+        self.assertTrue(app_module.process_next_webhook_events())
+        self.assertFalse(app_module.process_next_webhook_events())
+        self.assertEqual(self.donation_status(), 'completed')
+        self.assertEqual(WebhookEvent.query.one().status, 'applied')
+        self.assertEqual(CertificateRenderJob.query.count(), 1)
+
+    def test_redelivery_is_dropped(self):
+        with mock.patch.object(app_module.donation_notifier, 'publish') as publish:
+            self.assertFalse(self.send('payment.succeeded', id='evt_1').get_json()['duplicate'])
+            self.assertTrue(self.send('payment.succeeded', id='evt_1').get_json()['duplicate'])
+        self.assertEqual(WebhookEvent.query.count(), 1)
+        publish.assert_called_once_with('don_hook')
+
+    def test_events_apply_in_arrival_order(self):
+        with mock.patch.object(app_module, 'webhook_worker') as worker:
+            worker.running = True
+            self.send('payment.failed', id='evt_1')
+            self.send('payment.succeeded', id='evt_2')
+            self.send('payment.refund_requested', id='evt_3')
+        self.assertTrue(app_module.process_next_webhook_events())
+        self.assertEqual(self.donation_status(), 'completed')
+        self.assertEqual([(event.event_key, event.status) for event in WebhookEvent.query.order_by(WebhookEvent.id)],
+                         [('event:evt_1', 'applied'), ('event:evt_2', 'applied'), ('event:evt_3', 'skipped')])
+
+    def test_unknown_donation_is_marked_failed(self):
+        response = self.app.post('/api/webhooks/ioka', json={
+            'event': 'payment.succeeded', 'object': {'external_id': 'don_missing'}})
+        self.assertEqual(response.status_code, 200)
+        event = WebhookEvent.query.one()
+        self.assertEqual((event.status, event.last_error), ('failed', 'Donation not found'))
+
+    def test_cli_applies_pending_events(self):
+        with mock.patch.object(app_module, 'webhook_worker') as worker:
+            worker.running = True
+            self.send('payment.cancelled')
+        result = app.test_cli_runner().invoke(args=['process-webhooks', '--once'])
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn('Applied webhook events of 1 donations', result.output)
+        self.assertEqual(self.donation_status(), 'cancelled')
+
+class DonationEventsTestCase(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.add_donations(1, status='awaiting_payment')
+
+    def test_long_poll_returns_changes_immediately(self):
+        data = self.app.get('/api/donations/don_0000/events').get_json()
+        self.assertEqual((data['status'], data['event_id']), ('awaiting_payment', 'awaiting_payment:ready'))
+
+        with mock.patch.object(app_module.donation_notifier, 'poll_interval', 0.01):
+            started = datetime.datetime.utcnow()
+            data = self.app.get('/api/donations/don_0000/events?since=awaiting_payment:ready&timeout=0.2').get_json()
+        self.assertEqual(data['status'], 'awaiting_payment')
+        self.assertGreaterEqual((datetime.datetime.utcnow() - started).total_seconds(), 0.2)
+
+        self.assertEqual(self.app.get('/api/donations/missing/events').status_code, 404)
+
+    def test_server_sent_events(self):
+        response = self.app.get('/api/donations/don_0000/events?timeout=0', headers={'Accept': 'text/event-stream'})
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        body = response.get_data(as_text=True)
+        self.assertIn('id: awaiting_payment:ready\nevent: status\ndata: {', body)
+        self.assertNotIn('event: end', body)
+
+        db.session.get(Donation, 'don_0000').status = 'cancelled'
+        db.session.commit()
+        body = self.app.get('/api/donations/don_0000/events', headers={'Accept': 'text/event-stream'}).get_data(as_text=True)
+        self.assertIn('"status": "cancelled"', body)
+        self.assertTrue(body.endswith('event: end\ndata: {}\n\n'))
+
+    def test_webhook_publishes(self):
+        self.enable_ioka()
+        with mock.patch.object(app_module.donation_notifier, 'publish') as publish:
+            self.app.post('/api/webhooks/ioka', json={'event': 'payment.failed', 'object': {'external_id': 'don_0000'}})
+        publish.assert_called_once_with('don_0000')
+
+class FormsTestCase(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.admin = self.make_admin()
+        self.admin_headers = self.auth_headers(self.admin)
+
+    def test_contact_submissions_are_stored_and_paginated(self):
+        for i in range(3):
+            response = self.app.post('/api/contact', json={'name': f'Name {i}', 'email': 'a@example.com',
+                                                          'message': 'Hello'})
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.app.post('/api/contact', json={'name': 'No email'}).status_code, 400)
+        self.assertEqual(app_module.ContactSubmission.query.count(), 3)
+
+        response = self.app.get('/api/admin/contact-submissions?limit=2', headers=self.admin_headers)
+        first = [item['name'] for item in response.get_json()]
+        response = self.app.get(f"/api/admin/contact-submissions?limit=2&cursor={response.headers['X-Next-Cursor']}",
+                                headers=self.admin_headers)
+        self.assertNotIn('X-Next-Cursor', response.headers)
+        self.assertEqual(first + [item['name'] for item in response.get_json()], ['Name 2', 'Name 1', 'Name 0'])
+
+    def test_partnership_inquiries(self):
+        response = self.app.post('/api/partnership-inquiry', json={
+            'companyName': 'Acme', 'contactPerson': 'Aigerim', 'email': 'acme@example.com'})
+        inquiry_id = response.get_json()['inquiry_id']
+        data = self.app.get('/api/admin/partnership-inquiries', headers=self.admin_headers).get_json()
+        self.assertEqual([(item['id'], item['status']) for item in data], [(inquiry_id, 'pending')])
+        data = self.app.get('/api/admin/partnership-inquiries?status=accepted', headers=self.admin_headers).get_json()
+        self.assertEqual(data, [])
+
+    def test_writer_thread_groups_rows(self):
+        app_module.form_writer_worker.start()
+        self.addCleanup(app_module.form_writer_worker.stop)
+        batches = app_module.form_writer.batches
+        self.assertEqual(self.app.post('/api/contact', json={'name': 'Threaded', 'email': 'a@example.com',
+                                                             'message': 'Hi'}).status_code, 200)
+        self.assertEqual(app_module.form_writer.batches, batches + 1)
+        db.session.expire_all()
+        self.assertEqual(app_module.ContactSubmission.query.one().name, 'Threaded')
+
+    def test_timed_out_row_is_withdrawn(self):
+        stalled = mock.Mock(running=True)  # a writer thread that never gets to the queue
+        with mock.patch.object(app_module, 'form_writer_worker', stalled), \
+                mock.patch.object(app_module, 'FORM_WRITE_TIMEOUT', 0.01):
+            response = self.app.post('/api/contact', json={'name': 'Late', 'email': 'a@example.com',
+                                                           'message': 'Hi'})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(app_module.form_writer.pending(), 0)
+        self.assertFalse(app_module.form_writer.drain())
+        self.assertEqual(app_module.ContactSubmission.query.count(), 0)
+
+class CatalogCacheTestCase(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.admin = self.make_admin()
+        self.admin_headers = self.auth_headers(self.admin)
+
+    def test_conditional_get_returns_304(self):
+        response = self.app.get('/api/locations')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('public', response.headers['Cache-Control'])
+        etag, last_modified = response.headers['ETag'], response.headers['Last-Modified']
+
+        with QueryRecorder() as counter:
+            response = self.app.get('/api/locations', headers={'If-None-Match': etag})
+        self.assertEqual((response.status_code, response.data), (304, b''))
+        self.assertEqual(response.headers['ETag'], etag)
+        self.assertEqual(counter.count, 1)
+
+        response = self.app.get('/api/locations', headers={'If-Modified-Since': last_modified})
+        self.assertEqual(response.status_code, 304)
+
+    def test_admin_changes_bump_version(self):
+        etags = {url: self.app.get(url).headers['ETag']
+                 for url in ('/api/locations', '/api/locations/loc_1', '/api/news', '/api/packages')}
+        self.assertNotEqual(etags['/api/locations'], etags['/api/locations/loc_1'])
+
+        response = self.app.put('/api/admin/locations/loc_1', json={'name': 'Renamed'}, headers=self.admin_headers)
+        self.assertEqual(response.status_code, 200)
+        for url in ('/api/locations', '/api/locations/loc_1'):
+            response = self.app.get(url, headers={'If-None-Match': etags[url]})
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('Renamed', response.get_data(as_text=True))
+        # Other catalogs are unaffected
+        self.assertEqual(self.app.get('/api/packages', headers={'If-None-Match': etags['/api/packages']}).status_code, 304)
+
+        response = self.app.post('/api/admin/news', json={'title': 'Spring', 'content': 'Planting'},
+                                 headers=self.admin_headers)
+        self.assertEqual(response.status_code, 201)
+        response = self.app.get('/api/news', headers={'If-None-Match': etags['/api/news']})
+        self.assertEqual([item['title'] for item in response.get_json()], ['Spring'])
+
+    def test_unknown_location_is_404_despite_validators(self):
+        response = self.app.get('/api/locations/loc_1')
+        headers = {'If-None-Match': response.headers['ETag'],
+                   'If-Modified-Since': response.headers['Last-Modified']}
+        self.assertEqual(self.app.get('/api/locations/loc_1', headers=headers).status_code, 304)
+        self.assertEqual(self.app.get('/api/locations/loc_missing', headers=headers).status_code, 404)
+
+    def test_serialized_body_is_reused(self):
+        self.app.get('/api/locations')
+        with QueryRecorder() as counter:
+            response = self.app.get('/api/locations')
+        self.assertEqual(response.get_json()[0]['id'], 'loc_1')
+        self.assertEqual(counter.count, 1)
+
+    def test_static_reports_etag(self):
+        etag = self.app.get('/api/transparency-reports').headers['ETag']
+        response = self.app.get('/api/transparency-reports', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+
+class MetricsTestCase(ApiTestCase):
+    def test_request_and_queue_metrics(self):
+        self.app.get('/api/locations')
+        db.session.add(CertificateRenderJob(donation_id='don_missing'))
+        db.session.commit()
+        body = self.app.get('/metrics').get_data(as_text=True)
+        self.assertIn('http_request_duration_seconds_count{method="GET",route="/api/locations",status="200"}', body)
+        self.assertRegex(body, r'http_request_db_queries_count\{route="/api/locations"\} [1-9]')
+        self.assertIn('certificate_render_queue{status="queued"} 1.0', body)
+        self.assertIn('donations_awaiting_payment 0.0', body)
+
+    def test_token(self):
+        with mock.patch.object(app_module, 'METRICS_TOKEN', 'scrape'):
+            self.assertEqual(self.app.get('/metrics').status_code, 401)
+            response = self.app.get('/metrics', headers={'Authorization': 'Bearer scrape'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith('text/plain'))
+
+class QueryBudgetTestCase(ApiTestCase):
+    """Statements per request with many rows behind each list; a loop over rows blows the budget"""
+
+    USER_BUDGETS = {
+        '/api/users/me': 1,
+        '/api/users/me/donations': 3,
+        '/api/users/me/certificates': 2,
+        '/api/users/me/dashboard': 3,
+        '/api/donations/don_0001/status': 3,
+        '/api/locations': 2,
+        '/api/packages': 2,
+        '/api/news': 2,
+    }
+    ADMIN_BUDGETS = {
+        '/api/admin/donations': 2,
+        '/api/admin/users': 2,
+        '/api/admin/reports/donations-summary': 2,
+        '/api/admin/locations': 2,
+        '/api/admin/news': 2,
+        '/api/admin/partnership-inquiries': 2,
+        '/api/admin/contact-submissions': 2,
+    }
+
+    def setUp(self):
+        super().setUp()
+        self.admin = self.make_admin()
+        for i in range(5):
+            db.session.add(User(id=f'usr_{i}', full_name=f'Person {i}', email=f'person{i}@example.com', password='x'))
+            db.session.add(Location(id=f'loc_extra_{i}', name=f'Grove {i}'))
+        db.session.commit()
+        self.add_donations(40)
+        for i in range(5):
+            self.app.post('/api/contact', json={'name': f'Visitor {i}', 'email': 'v@example.com', 'message': 'Hi'})
+
+    def test_user_endpoints(self):
+        for url, budget in self.USER_BUDGETS.items():
+            with self.subTest(url=url):
+                self.assertMaxQueries(url, budget)
+
+    def test_admin_endpoints(self):
+        headers = self.auth_headers(self.admin)
+        for url, budget in self.ADMIN_BUDGETS.items():
+            with self.subTest(url=url):
+                self.assertMaxQueries(url, budget, headers)
+
+    def test_profiled_request_reports_repeated_statements(self):
+        with mock.patch.object(app_module, 'QUERY_PROFILE', {'/api/users/me/donations'}), \
+                mock.patch.object(app_module, 'QUERY_PROFILE_REPEAT', 1), \
+                self.assertLogs('app.queries', level='WARNING') as logs:
+            response = self.app.get('/api/users/me/donations', headers=self.headers)
+        self.assertEqual(response.headers['X-Query-Count'], str(logs.records[0].queries))
+        self.assertTrue(all('?' in item['statement'] for item in logs.records[0].repeated))
+        self.assertNotIn('X-Query-Count', self.app.get('/api/locations').headers)
+
+class DonationExportTestCase(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.add_donations(3)
+        self.add_donations(2, start=3, status='pending')
+        self.runner = app.test_cli_runner()
+
+    def test_csv_with_filters_in_one_query(self):
+        with QueryRecorder() as recorder:
+            result = self.runner.invoke(args=['export-donations', '--status', 'completed',
+                                              '--date-to', '2024-01-01', '--batch-size', '2'])
+        self.assertEqual(result.exit_code, 0, result.stderr)
+        rows = list(csv.DictReader(io.StringIO(result.stdout)))
+        self.assertEqual([row['donation_id'] for row in rows], ['don_0000', 'don_0001', 'don_0002'])
+        self.assertEqual(rows[0]['donor_name'], 'Donor')
+        self.assertEqual(rows[0]['location_name'], 'Forest of Central Asia')
+        self.assertEqual(rows[0]['certificate_id'], 'cert_0000')
+        self.assertEqual(rows[0]['created_at'], '2024-01-01T00:00:00')
+        self.assertEqual(recorder.count, 1)
+        self.assertIn('Exported 3 donations', result.stderr)
+
+    def test_gzipped_jsonl_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'donations.jsonl.gz')
+            result = self.runner.invoke(args=['export-donations', '--format', 'jsonl', '--output', path,
+                                              '--status', 'pending', '--status', 'failed'])
+            self.assertEqual(result.exit_code, 0, result.stderr)
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                rows = [json.loads(line) for line in f]
+        self.assertEqual([(row['donation_id'], row['status']) for row in rows],
+                         [('don_0003', 'pending'), ('don_0004', 'pending')])
+        self.assertEqual(rows[0]['amount'], 5000)
+
+    def test_bad_date(self):
+        result = self.runner.invoke(args=['export-donations', '--date-from', 'yesterday'])
+        self.assertNotEqual(result.exit_code, 0)
+
+class AdminStreamingTestCase(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.admin = self.make_admin()
+        db.session.add_all([News(id=f'news_{i}', title=f'News {i}', content='Text',
+                                 created_at=datetime.datetime(2024, 1, 1 + i)) for i in range(3)])
+        db.session.commit()
+        self.add_donations(5)
+        self.headers = self.auth_headers(self.admin)
+
+    def test_json_array_matches_paginated_list(self):
+        for url, key in [('/api/admin/donations', 'donations'), ('/api/admin/users', 'users'),
+                         ('/api/admin/locations', 'locations'), ('/api/admin/news', None)]:
+            with self.subTest(url=url):
+                listed = self.app.get(url, headers=self.headers).get_json()
+                response = self.app.get(f'{url}?stream=json', headers=self.headers)
+                self.assertTrue(response.is_streamed)
+                self.assertEqual(response.mimetype, 'application/json')
+                self.assertEqual(json.loads(response.get_data()), listed[key] if key else listed)
+
+    def test_ndjson_with_filters_and_cursor(self):
+        response = self.app.get('/api/admin/donations?status=completed&cursor=don_0003',
+                                headers={**self.headers, 'Accept': 'application/x-ndjson'})
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        lines = response.get_data(as_text=True).splitlines()
+        self.assertEqual([json.loads(line)['id'] for line in lines], ['don_0002', 'don_0001', 'don_0000'])
+
+    def test_rows_are_sent_in_batches(self):
+        with mock.patch.object(app_module, 'STREAM_BATCH_SIZE', 2):
+            response = self.app.get('/api/admin/donations?stream=json', headers=self.headers)
+            chunks = list(response.response)
+        self.assertEqual(len(chunks), 3)
+        self.assertEqual(len(json.loads(b''.join(chunks))), 5)
+
+    def test_empty_list(self):
+        response = self.app.get('/api/admin/donations?stream=json&status=failed', headers=self.headers)
+        self.assertEqual(json.loads(response.get_data()), [])
+
+class GuestDonationLinkingTestCase(ApiTestCase):
+    def add_guest_donation(self, donation_id, email):
+        db.session.add(Donation(id=donation_id, location_id=self.location.id, email=email, tree_count=1,
+                                amount=999, status='completed', donor_info={}))
+        db.session.commit()
+
+    def login(self, email, password):
+        auth = base64.b64encode(f'{email}:{password}'.encode()).decode()
+        return self.app.post('/api/auth/login', headers={'Authorization': f'Basic {auth}'})
+
+    def linked_user(self, donation_id):
+        db.session.expire_all()
+        return db.session.get(Donation, donation_id).user_id
+
+    def test_register_links_once(self):
+        self.add_guest_donation('don_guest_1', 'new@example.com')
+        self.add_guest_donation('don_guest_2', 'new@example.com')
+        user_id = self.app.post('/api/auth/register', json=dict(
+            full_name='New', email='new@example.com', password='secret', phone='1')).get_json()['user_id']
+        self.assertEqual((self.linked_user('don_guest_1'), self.linked_user('don_guest_2')), (user_id, user_id))
+        self.assertIsNotNone(db.session.get(User, user_id).guest_donations_linked_at)
+
+        with QueryRecorder() as recorder:
+            self.assertEqual(self.login('new@example.com', 'secret').status_code, 200)
+        self.assertFalse([shape for shape in recorder.shapes() if shape.startswith('UPDATE')])
+
+    def test_first_login_of_existing_account_links(self):
+        user = User(id='usr_old', full_name='Old', email='old@example.com',
+                    password=app_module.password_policy.hash('secret'))
+        db.session.add(user)
+        db.session.commit()
+        self.add_guest_donation('don_guest_old', 'old@example.com')
+
+        self.app.get('/api/users/me/donations', headers=self.auth_headers(user))
+        self.assertIsNone(self.linked_user('don_guest_old'))
+        self.assertEqual(self.login('old@example.com', 'secret').status_code, 200)
+        self.assertEqual(self.linked_user('don_guest_old'), 'usr_old')
+
+    def test_email_case_is_ignored(self):
+        self.add_guest_donation('don_guest_mixed', 'Mixed.Case@Example.com')
+        user_id = self.app.post('/api/auth/register', json=dict(
+            full_name='Mixed', email='mixed.case@example.com', password='secret', phone='1')).get_json()['user_id']
+        self.assertEqual(self.linked_user('don_guest_mixed'), user_id)
+
+    def test_upgrade_with_new_email_relinks(self):
+        guest = User(id='usr_guest', full_name='Guest', email='guest@example.com', password='x', status='guest',
+                     guest_donations_linked_at=datetime.datetime(2024, 1, 1))
+        db.session.add(guest)
+        db.session.commit()
+        self.add_guest_donation('don_guest_new_email', 'renamed@example.com')
+        response = self.app.post('/api/auth/register', json=dict(
+            guest_user_id='usr_guest', full_name='Guest', email='renamed@example.com', password='secret', phone='1'))
+        self.assertTrue(response.get_json()['is_upgrade'])
+        self.assertEqual(self.linked_user('don_guest_new_email'), 'usr_guest')
+
+    def test_backfill_command(self):
+        db.session.add(User(id='usr_backfill', full_name='B', email='b@example.com', password='x'))
+        db.session.commit()
+        self.add_guest_donation('don_guest_b', 'b@example.com')
+        self.add_guest_donation('don_guest_upper', 'B@Example.COM')
+        self.add_guest_donation('don_guest_nobody', 'nobody@example.com')
+        result = app.test_cli_runner().invoke(args=['link-guest-donations'])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('Linked 2 guest donations', result.output)
+        self.assertEqual(self.linked_user('don_guest_b'), 'usr_backfill')
+        self.assertEqual(self.linked_user('don_guest_upper'), 'usr_backfill')
+        self.assertIsNone(self.linked_user('don_guest_nobody'))
+        self.assertEqual(User.query.filter(User.guest_donations_linked_at.is_(None)).count(), 0)
+
+class PasswordHashingTestCase(ApiTestCase):
+    def login(self, email, password):
+        auth = base64.b64encode(f'{email}:{password}'.encode()).decode()
+        return self.app.post('/api/auth/login', headers={'Authorization': f'Basic {auth}'})
+
+    def test_guest_checkout_stores_unusable_password(self):
+        with mock.patch.object(app_module.password_policy, 'hash') as hash_password:
+            response = self.app.post('/api/guest-donations', json={
+                'location_id': self.location.id, 'package_id': 'pkg', 'tree_count': 1, 'amount': 999,
+                'donor_info': {'email': 'guest@example.com', 'full_name': 'Guest'}})
+        self.assertEqual(response.status_code, 201)
+        hash_password.assert_not_called()
+        guest = db.session.get(User, response.get_json()['user_id'])
+        self.assertEqual(guest.password, app_module.UNUSABLE_PASSWORD)
+        self.assertEqual(self.login('guest@example.com', app_module.UNUSABLE_PASSWORD).status_code, 401)
+
+    def test_login_rehashes_under_new_policy(self):
+        old_policy = PasswordPolicy('pbkdf2:sha256:1000')
+        db.session.add(User(id='usr_rehash', full_name='R', email='r@example.com', password=old_policy.hash('secret'),
+                            guest_donations_linked_at=datetime.datetime(2024, 1, 1)))
+        db.session.commit()
+        with mock.patch.object(app_module, 'password_policy', PasswordPolicy('pbkdf2:sha256:2000')):
+            self.assertEqual(self.login('r@example.com', 'secret').status_code, 200)
+            db.session.expire_all()
+            self.assertTrue(db.session.get(User, 'usr_rehash').password.startswith('pbkdf2:sha256:2000$'))
+            with QueryRecorder() as recorder:
+                self.assertEqual(self.login('r@example.com', 'secret').status_code, 200)
+        self.assertFalse([shape for shape in recorder.shapes() if shape.startswith('UPDATE')])
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,48 @@
+import unittest
+from batch_writer import BatchWriter
+
+
+class BatchWriterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.batches = []
+        self.rollbacks = 0
+
+        def write(items):
+            if 'bad' in items:
+                raise ValueError('bad row')
+            self.batches.append(items)
+
+        def rollback():
+            self.rollbacks += 1
+
+        self.writer = BatchWriter(write, max_batch=3, on_error=rollback)
+
+    def test_rows_are_written_in_batches(self):
+        pending = [self.writer.submit(i) for i in range(5)]
+        self.assertFalse(pending[0].wait(0))
+        self.assertTrue(self.writer.drain())
+        self.assertTrue(self.writer.drain())
+        self.assertFalse(self.writer.drain())
+        self.assertEqual(self.batches, [[0, 1, 2], [3, 4]])
+        self.assertTrue(all(p.wait(0) for p in pending))
+        self.assertEqual((self.writer.batches, self.writer.rows), (2, 5))
+
+    def test_failed_batch_falls_back_to_single_rows(self):
+        good, bad = self.writer.submit('good'), self.writer.submit('bad')
+        self.writer.drain()
+        self.assertTrue(good.wait(0))
+        with self.assertRaises(ValueError):
+            bad.wait(0)
+        self.assertEqual(self.batches, [['good']])
+        self.assertEqual(self.rollbacks, 2)
+
+    def test_withdrawn_row_is_not_written(self):
+        first, second = self.writer.submit(1), self.writer.submit(2)
+        self.assertTrue(self.writer.withdraw(second))
+        self.writer.drain()
+        self.assertFalse(self.writer.withdraw(first))
+        self.assertEqual(self.batches, [[1]])
+        self.assertFalse(second.wait(0))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from certificate_store import CertificateStore
+
+
+class CertificateStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.store = CertificateStore(self.root)
+
+    @staticmethod
+    def writer(content):
+        def produce(path):
+            with open(path, 'wb') as pdf:
+                pdf.write(content)
+        return produce
+
+    def test_files_are_sharded_by_content_hash(self):
+        stored = self.store.write(self.writer(b'%PDF-1.4 one'))
+        self.assertEqual(stored.size, 12)
+        self.assertEqual(self.store.key(stored.digest),
+                         f'{stored.digest[:2]}/{stored.digest[2:4]}/{stored.digest}.pdf')
+        with open(self.store.path(stored.digest), 'rb') as pdf:
+            self.assertEqual(pdf.read(), b'%PDF-1.4 one')
+        # Same content, same file
+        self.assertEqual(self.store.write(self.writer(b'%PDF-1.4 one')), stored)
+        self.assertEqual(os.listdir(self.store.tmp_dir), [])
+
+    def test_failed_write_leaves_nothing_behind(self):
+        def produce(path):
+            with open(path, 'wb') as pdf:
+                pdf.write(b'%PDF-partial')
+            raise RuntimeError('renderer crashed')
+
+        with self.assertRaises(RuntimeError):
+            self.store.write(produce)
+        self.assertEqual(os.listdir(self.root), ['.tmp'])
+        self.assertEqual(os.listdir(self.store.tmp_dir), [])
+
+    def test_put_and_delete(self):
+        source = os.path.join(self.root, 'flat.pdf')
+        self.writer(b'%PDF-flat')(source)
+        stored = self.store.put(source)
+        self.assertTrue(os.path.exists(source))
+        self.assertTrue(os.path.exists(self.store.path(stored.digest)))
+        self.store.delete(stored.digest)
+        self.store.delete(stored.digest)
+        self.assertFalse(os.path.exists(self.store.path(stored.digest)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import threading
+import time
+import unittest
+from donation_events import DonationNotifier
+
+
+class DonationNotifierTestCase(unittest.TestCase):
+    def setUp(self):
+        self.notified = []
+        self.notifier = DonationNotifier(poll_interval=5, execute_notify=lambda channel, donation_id:
+                                         self.notified.append((channel, donation_id)))
+        self.notifier.listening = True  # as if a LISTEN connection were up
+
+    def test_publish_wakes_waiters_of_that_donation(self):
+        results = {}
+
+        def wait(donation_id):
+            with self.notifier.subscribe(donation_id) as subscription:
+                ready.wait()
+                results[donation_id] = subscription.wait(2 if donation_id == 'don_1' else 0.2)
+
+        ready = threading.Event()
+        threads = [threading.Thread(target=wait, args=(donation_id,)) for donation_id in ('don_1', 'don_2')]
+        for thread in threads:
+            thread.start()
+        while self.notifier.waiting() < 2:
+            time.sleep(0.01)
+        self.notifier.publish('don_1')
+        ready.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, {'don_1': True, 'don_2': False})
+        self.assertEqual(self.notified, [('donation_events', 'don_1')])
+        self.assertEqual(self.notifier.waiting(), 0)
+
+    def test_clear_forgets_earlier_notifications(self):
+        with self.notifier.subscribe('don_1') as subscription:
+            self.notifier.publish('don_1')
+            subscription.clear()
+            self.assertFalse(subscription.wait(0))
+
+    def test_without_listener_waits_are_capped(self):
+        self.notifier.listening = False
+        self.notifier.poll_interval = 0.05
+        with self.notifier.subscribe('don_1') as subscription:
+            started = time.monotonic()
+            self.assertFalse(subscription.wait(10))
+        self.assertLess(time.monotonic() - started, 1)
+
+if __name__ == '__main__':
+    unittest.main()
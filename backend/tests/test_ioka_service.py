@@ -0,0 +1,80 @@
+import os
+import unittest
+from unittest import mock
+import requests
+
+with mock.patch.dict(os.environ, {'IOKA_API_KEY': 'test_key'}):
+    import ioka_service as ioka_module
+
+
+def make_response(status_code, body=None, headers=None):
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = (body or '{}').encode()
+    response._content_consumed = True
+    response.headers.update(headers or {})
+    return response
+
+
+class IokaServiceTestCase(unittest.TestCase):
+    def setUp(self):
+        with mock.patch.dict(os.environ, {'IOKA_API_KEY': 'test_key', 'IOKA_MAX_RETRIES': '2'}):
+            self.service = ioka_module.IokaService()
+        sleep = mock.patch.object(ioka_module.time, 'sleep')
+        self.sleep = sleep.start()
+        self.addCleanup(sleep.stop)
+
+    def mock_session(self, *outcomes):
+        session = mock.patch.object(self.service.session, 'request', side_effect=list(outcomes))
+        self.addCleanup(session.stop)
+        return session.start()
+
+    def test_session_is_reused_with_pool_and_timeouts(self):
+        session = self.service.session
+        self.assertIs(self.service.session, session)
+        self.assertEqual(session.headers['API-KEY'], 'test_key')
+        self.assertEqual(session.get_adapter('https://stage-api.ioka.kz')._pool_maxsize, self.service.pool_size)
+        request = self.mock_session(make_response(200, '{"id": "ord_1", "status": "PAID"}'))
+        self.service.get_payment_status('ord_1')
+        self.assertEqual(request.call_args.kwargs['timeout'], self.service.timeout)
+
+    def test_status_lookup_retries_transient_errors(self):
+        request = self.mock_session(requests.exceptions.ReadTimeout(), make_response(503),
+                                    make_response(200, '{"id": "ord_1", "status": "PAID"}'))
+        result = self.service.get_payment_status('ord_1')
+        self.assertEqual((result['success'], result['status']), (True, 'PAID'))
+        self.assertEqual(request.call_count, 3)
+        self.assertEqual(self.sleep.call_count, 2)
+        stats = self.service.stats()['get_payment_status']
+        self.assertEqual((stats['calls'], stats['errors'], stats['retries']), (3, 2, 2))
+
+    def test_retries_are_bounded(self):
+        request = self.mock_session(*[make_response(502)] * 5)
+        self.assertFalse(self.service.get_payment_status('ord_1')['success'])
+        self.assertEqual(request.call_count, 3)
+
+    def test_order_creation_is_not_resent_after_it_may_have_arrived(self):
+        request = self.mock_session(requests.exceptions.ReadTimeout())
+        self.assertFalse(self.service.create_payment_order(100, 'Trees', 'don_1')['success'])
+        request = self.mock_session(make_response(503))
+        self.assertFalse(self.service.create_payment_order(100, 'Trees', 'don_1')['success'])
+        self.assertEqual(request.call_count, 1)
+        self.sleep.assert_not_called()
+
+    def test_order_creation_retries_when_never_sent(self):
+        request = self.mock_session(requests.exceptions.ConnectTimeout(),
+                                    make_response(429, headers={'Retry-After': '1'}),
+                                    make_response(201, '{"order": {"id": "ord_1", "checkout_url": "https://pay"}}'))
+        result = self.service.create_payment_order(100, 'Trees', 'don_1')
+        self.assertEqual(result['checkout_url'], 'https://pay')
+        self.assertEqual(request.call_count, 3)
+        self.assertEqual(self.sleep.call_args_list[-1], mock.call(1.0))
+
+    def test_backoff_is_jittered_and_capped(self):
+        for attempt in range(10):
+            delay = self.service._retry_delay(attempt)
+            self.assertGreaterEqual(delay, 0)
+            self.assertLessEqual(delay, min(self.service.retry_max_delay, self.service.retry_backoff * 2 ** attempt))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+import json
+import logging
+import sys
+import unittest
+from logging_setup import JsonFormatter, RequestLogSampler, StructuredQueueHandler
+
+
+class JsonFormatterTestCase(unittest.TestCase):
+    def make_record(self, **extra):
+        record = logging.LogRecord('app.request', logging.INFO, __file__, 1, 'GET %s', ('/api/news',), None)
+        record.__dict__.update(extra)
+        return record
+
+    def test_extra_fields_become_keys(self):
+        entry = json.loads(JsonFormatter().format(self.make_record(status=200, duration_ms=1.5)))
+        self.assertEqual((entry['message'], entry['level'], entry['logger']), ('GET /api/news', 'INFO', 'app.request'))
+        self.assertEqual((entry['status'], entry['duration_ms']), (200, 1.5))
+        self.assertNotIn('args', entry)
+
+    def test_queued_record_keeps_traceback_apart(self):
+        try:
+            raise ValueError('boom')
+        except ValueError:
+            record = logging.LogRecord('app', logging.ERROR, __file__, 1, 'failed %s', ('job',), None)
+            record.exc_info = sys.exc_info()
+        prepared = StructuredQueueHandler(None).prepare(record)
+        entry = json.loads(JsonFormatter().format(prepared))
+        self.assertEqual(entry['message'], 'failed job')
+        self.assertIn('ValueError: boom', entry['exc'])
+
+
+class RequestLogSamplerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.roll = 0.5
+        self.sampler = RequestLogSampler({'/api/locations': 0.1, '/health': 0}, default_rate=1.0, slow_ms=500,
+                                         rng=lambda: self.roll)
+
+    def test_rates(self):
+        self.assertTrue(self.sampler.should_log('/api/news', 200, 5))
+        self.assertFalse(self.sampler.should_log('/api/locations', 200, 5))
+        self.roll = 0.05
+        self.assertTrue(self.sampler.should_log('/api/locations', 200, 5))
+        self.assertFalse(self.sampler.should_log('/health', 200, 5))
+
+    def test_errors_and_slow_requests_are_always_logged(self):
+        self.assertTrue(self.sampler.should_log('/health', 503, 5))
+        self.assertTrue(self.sampler.should_log('/health', 200, 800))
+
+
+if __name__ == '__main__':
+    unittest.main()
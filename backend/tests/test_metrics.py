@@ -0,0 +1,35 @@
+import threading
+import unittest
+from sqlalchemy import create_engine, text
+from metrics import QueryStats
+
+
+class QueryStatsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.engine = create_engine('sqlite://')
+        self.stats = QueryStats()
+        self.stats.install(self.engine)
+
+    def run_queries(self, count):
+        with self.engine.connect() as connection:
+            for _ in range(count):
+                connection.execute(text('SELECT 1'))
+
+    def test_counts_statements_between_start_and_stop(self):
+        self.run_queries(2)
+        self.stats.start()
+        self.run_queries(3)
+        count, seconds = self.stats.stop()
+        self.run_queries(1)
+        self.assertEqual(count, 3)
+        self.assertGreater(seconds, 0)
+
+    def test_other_threads_are_not_counted(self):
+        self.stats.start()
+        worker = threading.Thread(target=self.run_queries, args=(4,))
+        worker.start()
+        worker.join()
+        self.assertEqual(self.stats.stop()[0], 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import datetime
+import importlib.util
+import os
+import unittest
+
+from alembic.migration import MigrationContext
+from alembic.operations import Operations
+from sqlalchemy import create_engine, text
+
+VERSIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'migrations', 'versions')
+
+
+def load_migration(name):
+    spec = importlib.util.spec_from_file_location(name, os.path.join(VERSIONS_DIR, f'{name}.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class HotLookupIndexesMigrationTestCase(unittest.TestCase):
+    def setUp(self):
+        self.engine = create_engine('sqlite://')
+
+    def migrate(self, connection, *names):
+        with Operations.context(MigrationContext.configure(connection)):
+            for name in names:
+                load_migration(name).upgrade()
+
+    def test_oldest_duplicate_certificate_survives(self):
+        base = datetime.datetime(2024, 1, 1)
+        with self.engine.begin() as connection:
+            self.migrate(connection, '0001_initial_schema')
+            connection.execute(text("INSERT INTO donation (id, tree_count, amount) VALUES ('don_1', 1, 2500)"))
+            # Random ids sort against creation order: the smallest id is the newest row
+            for certificate_id, minutes in (('0c5e', 30), ('7a1f', 10), ('f3b2', 0), ('f3b3', None)):
+                created = base + datetime.timedelta(minutes=minutes) if minutes is not None else None
+                connection.execute(text('INSERT INTO certificate (id, donation_id, created_date) '
+                                        'VALUES (:id, :donation_id, :created)'),
+                                   {'id': certificate_id, 'donation_id': 'don_1', 'created': created})
+            self.migrate(connection, '0002_hot_lookup_indexes')
+            remaining = connection.execute(text('SELECT id FROM certificate')).scalars().all()
+        self.assertEqual(remaining, ['f3b2'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,34 @@
+import unittest
+from password_policy import PasswordPolicy, UNUSABLE_PASSWORD, normalize_method
+
+
+class PasswordPolicyTestCase(unittest.TestCase):
+    def setUp(self):
+        self.policy = PasswordPolicy('pbkdf2:sha256:1000', salt_length=8)
+
+    def test_normalize_method(self):
+        self.assertEqual(normalize_method('scrypt'), 'scrypt:32768:8:1')
+        self.assertEqual(normalize_method('scrypt:16384'), 'scrypt:16384:8:1')
+        self.assertEqual(normalize_method('pbkdf2:sha512:5000'), 'pbkdf2:sha512:5000')
+        self.assertTrue(normalize_method('pbkdf2').startswith('pbkdf2:sha256:'))
+
+    def test_hash_and_verify(self):
+        stored = self.policy.hash('secret')
+        self.assertTrue(stored.startswith('pbkdf2:sha256:1000$'))
+        self.assertTrue(self.policy.verify(stored, 'secret'))
+        self.assertFalse(self.policy.verify(stored, 'wrong'))
+        self.assertFalse(self.policy.needs_rehash(stored))
+
+    def test_older_hashes_verify_and_need_rehash(self):
+        stored = PasswordPolicy('pbkdf2:sha256:500').hash('secret')
+        self.assertTrue(self.policy.verify(stored, 'secret'))
+        self.assertTrue(self.policy.needs_rehash(stored))
+
+    def test_unusable_password(self):
+        for stored in (UNUSABLE_PASSWORD, '', None):
+            self.assertFalse(self.policy.verify(stored, ''))
+            self.assertFalse(self.policy.verify(stored, UNUSABLE_PASSWORD))
+        self.assertFalse(self.policy.needs_rehash(UNUSABLE_PASSWORD))
+
+if __name__ == '__main__':
+    unittest.main()
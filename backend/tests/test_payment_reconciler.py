@@ -0,0 +1,47 @@
+import unittest
+from payment_reconciler import PaymentStatusFetcher, RateLimiter
+
+
+class RateLimiterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.sleeps = []
+
+        def sleep(seconds):
+            self.sleeps.append(seconds)
+            self.now += seconds
+
+        self.limiter = RateLimiter(rate=2, burst=2, clock=lambda: self.now, sleep=sleep)
+
+    def test_burst_then_throttle(self):
+        self.limiter.acquire()
+        self.limiter.acquire()
+        self.assertEqual(self.sleeps, [])
+        self.limiter.acquire()
+        self.assertEqual(self.sleeps, [0.5])
+
+    def test_tokens_refill_over_time(self):
+        for _ in range(2):
+            self.limiter.acquire()
+        self.now += 1
+        for _ in range(2):
+            self.limiter.acquire()
+        self.assertEqual(self.sleeps, [])
+
+
+class PaymentStatusFetcherTestCase(unittest.TestCase):
+    def test_maps_statuses_and_failures(self):
+        def lookup(order_id):
+            if order_id == 'ord_error':
+                raise RuntimeError('boom')
+            if order_id == 'ord_unknown':
+                return {'success': False, 'error': 'timeout'}
+            return {'success': True, 'status': 'PAID'}
+
+        fetcher = PaymentStatusFetcher(concurrency=3, rate=0)
+        self.assertEqual(fetcher.fetch(['ord_1', 'ord_error', 'ord_unknown'], lookup),
+                         {'ord_1': 'PAID', 'ord_error': None, 'ord_unknown': None})
+        self.assertEqual(fetcher.fetch([], lookup), {})
+
+if __name__ == '__main__':
+    unittest.main()
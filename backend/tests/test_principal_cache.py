@@ -0,0 +1,51 @@
+import unittest
+from types import SimpleNamespace
+from principal_cache import PrincipalCache
+
+
+def make_user(user_id, role='user'):
+    return SimpleNamespace(id=user_id, full_name='Name', email=f'{user_id}@example.com', phone=None,
+                           company_name=None, role=role, status='active', created_at=None, last_login=None)
+
+
+class PrincipalCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.loads = []
+        self.cache = PrincipalCache(max_size=2, ttl=10, clock=lambda: self.now)
+
+    def load(self, user_id):
+        self.loads.append(user_id)
+        return make_user(user_id) if user_id != 'missing' else None
+
+    def test_hit_and_expiry(self):
+        self.assertEqual(self.cache.get('a', self.load).email, 'a@example.com')
+        self.cache.get('a', self.load)
+        self.assertEqual(self.loads, ['a'])
+        self.now = 11
+        self.cache.get('a', self.load)
+        self.assertEqual(self.loads, ['a', 'a'])
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 2))
+
+    def test_least_recently_used_is_evicted(self):
+        for user_id in ['a', 'b', 'a', 'c', 'a', 'b']:
+            self.cache.get(user_id, self.load)
+        self.assertEqual(self.loads, ['a', 'b', 'c', 'b'])
+        self.assertEqual(self.cache.evictions, 2)
+
+    def test_snapshot_is_immutable_and_invalidated(self):
+        principal = self.cache.get('a', self.load)
+        with self.assertRaises(AttributeError):
+            principal.role = 'admin'
+        self.cache.invalidate('a')
+        self.cache.get('a', self.load)
+        self.assertEqual(self.loads, ['a', 'a'])
+
+    def test_missing_user_is_not_cached(self):
+        self.assertIsNone(self.cache.get('missing', self.load))
+        self.assertIsNone(self.cache.get('missing', self.load))
+        self.assertEqual(self.loads, ['missing', 'missing'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import threading
+import unittest
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import Engine
+from metrics import query_stats
+from query_recorder import QueryRecorder, statement_shape
+
+
+class StatementShapeTestCase(unittest.TestCase):
+    def test_literals_and_parameters(self):
+        self.assertEqual(statement_shape("SELECT * FROM donation\n  WHERE id = ? AND status = 'completed' LIMIT 101"),
+                         'SELECT * FROM donation WHERE id = ? AND status = ? LIMIT ?')
+        self.assertEqual(statement_shape('SELECT * FROM "user" WHERE id = %(id_1)s AND x = :x'),
+                         'SELECT * FROM "user" WHERE id = ? AND x = ?')
+
+    def test_in_lists_collapse(self):
+        self.assertEqual(statement_shape('SELECT 1 FROM t WHERE id IN (?, ?, ?)'),
+                         statement_shape('SELECT 1 FROM t WHERE id IN (?, ?)'))
+
+    def test_casts_are_kept(self):
+        self.assertEqual(statement_shape('SELECT a::text FROM t'), 'SELECT a::text FROM t')
+
+
+class QueryRecorderTestCase(unittest.TestCase):
+    def setUp(self):
+        self.engine = create_engine('sqlite://')
+
+    def run_queries(self, *values):
+        with self.engine.connect() as connection:
+            for value in values:
+                connection.execute(text('SELECT :value'), {'value': value})
+
+    def test_groups_repeated_shapes(self):
+        with QueryRecorder() as recorder:
+            self.run_queries(1, 2, 3)
+            with self.engine.connect() as connection:
+                connection.execute(text('SELECT 2 + 2'))
+        self.assertEqual(recorder.count, 4)
+        self.assertEqual(recorder.repeated(), [('SELECT ?', 3)])
+        self.assertIn('3 x SELECT ?', recorder.report())
+
+    def test_nested_recorders(self):
+        with QueryRecorder() as outer:
+            self.run_queries(1)
+            with QueryRecorder() as inner:
+                self.run_queries(2)
+        self.run_queries(3)
+        self.assertEqual((outer.count, inner.count), (2, 1))
+
+    def test_other_threads_are_not_recorded(self):
+        with QueryRecorder() as recorder:
+            worker = threading.Thread(target=self.run_queries, args=(1, 2))
+            worker.start()
+            worker.join()
+        self.assertEqual(recorder.count, 0)
+
+    def test_shares_the_request_stats_listeners(self):
+        query_stats.install(Engine)
+        query_stats.start()
+        with QueryRecorder() as recorder:
+            self.run_queries(1, 2)
+        self.run_queries(3)
+        self.assertEqual(query_stats.stop()[0], 3)
+        self.assertEqual(recorder.count, 2)
+
+if __name__ == '__main__':
+    unittest.main()
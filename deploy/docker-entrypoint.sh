@@ -4,30 +4,34 @@ set -e
 echo "⏳ Waiting for database to be ready..."
 sleep 5
 
-# Проверяем существует ли папка migrations
-if [ ! -d "migrations" ]; then
-    echo "📁 Creating migrations directory..."
-    flask db init
-    echo "✅ Migrations directory created"
-    
-    echo "📝 Creating initial migration..."
-    flask db migrate -m "Initial migration"
-    echo "✅ Initial migration created"
-fi
-
 echo "🔄 Applying database migrations..."
-flask db upgrade || {
-    echo "⚠️ Migration failed, trying to create tables directly..."
-    python << PYTHON
+# Databases from before the migrations were kept in the repository either have no
+# alembic_version (db.create_all) or one recording an autogenerated revision this
+# release does not know. Forget such a revision once: 0001 adopts the existing
+# tables and the later revisions only add what is missing. Any other failure of
+# the upgrade stops the container.
+python << PYTHON
+from alembic.script import ScriptDirectory
 from app import app, db
 with app.app_context():
-    db.create_all()
-    print("✅ Tables created directly")
+    if db.inspect(db.engine).has_table('alembic_version'):
+        known = {script.revision for script in ScriptDirectory.from_config(
+            app.extensions['migrate'].migrate.get_config()).walk_revisions()}
+        recorded = db.session.execute(db.text('SELECT version_num FROM alembic_version')).scalars().all()
+        if any(revision not in known for revision in recorded):
+            print(f"⚠️ Unknown migration history {recorded}, adopting the existing schema")
+            db.session.execute(db.text('DELETE FROM alembic_version'))
+            db.session.commit()
 PYTHON
-}
+flask db upgrade
 
 echo "🌱 Seeding database with default data..."
 python seed.py || echo "⚠️ Seeding skipped or already done"
 
+echo "📈 Preparing shared metrics directory..."
+# Workers write their Prometheus samples here; stale files from the last run would be counted again
+export PROMETHEUS_MULTIPROC_DIR="${PROMETHEUS_MULTIPROC_DIR:-/tmp/prometheus-metrics}"
+rm -rf "$PROMETHEUS_MULTIPROC_DIR" && mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+
 echo "🚀 Starting application..."
-exec gunicorn --bind 0.0.0.0:5000 --workers 3 --timeout 120 --access-logfile - --error-logfile - app:app
+exec gunicorn --bind 0.0.0.0:5000 --workers 3 --worker-class gthread --threads "${GUNICORN_THREADS:-16}" --timeout 120 --error-logfile - app:app